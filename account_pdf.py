@@ -1,15 +1,22 @@
 from __future__ import annotations
 from fpdf import FPDF
 from datetime import datetime
+import os
 from pathlib import Path
+import tempfile
+
+from metrics import timed
 
 BLUE = (30, 58, 138)
 
 def _money(v: float) -> str:
     return f"RD$ {v:,.2f}"
 
+@timed('tiendix_pdf_render_seconds', document='Estado de cuenta')
 def generate_account_statement_pdf(company: dict, client: dict, rows: list, total: float,
-                                   aging: dict, overdue_pct: float) -> str:
+                                   aging: dict, overdue_pct: float, output_path: str | None = None,
+                                   date: datetime | None = None) -> str:
+    """Render a statement to ``output_path`` (a new temporary file by default)."""
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
@@ -32,7 +39,7 @@ def generate_account_statement_pdf(company: dict, client: dict, rows: list, tota
     pdf.cell(0, 8, 'Estado de Cuenta de Cliente', ln=1, align='C')
     pdf.set_text_color(0,0,0)
     pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 5, f"Fecha: {datetime.now().strftime('%d/%m/%Y')}", ln=1, align='R')
+    pdf.cell(0, 5, f"Fecha: {(date or datetime.now()).strftime('%d/%m/%Y')}", ln=1, align='R')
     pdf.ln(4)
     # client info
     pdf.set_font('Helvetica', 'B', 10)
@@ -81,6 +88,8 @@ def generate_account_statement_pdf(company: dict, client: dict, rows: list, tota
     pdf.ln(8)
     pdf.set_font('Helvetica','',8)
     pdf.multi_cell(0,4,'Pagos a cuentas: ______\nLas facturas no pagadas luego de la fecha de vencimiento generan un cargo mensual de un 3% de mora.')
-    output = Path('estado_cuenta.pdf')
-    pdf.output(str(output))
-    return str(output)
+    if output_path is None:
+        fd, output_path = tempfile.mkstemp(prefix='estado_cuenta_', suffix='.pdf')
+        os.close(fd)
+    pdf.output(str(output_path))
+    return str(output_path)
@@ -1,14 +1,325 @@
-from models import db, OrderItem
-from sqlalchemy import func
+"""Per-tenant product recommendations.
 
+Two derived tables, both keyed by company and product name, back the
+suggestions:
 
-def recommend_products(limit: int = 5):
-    """Return top-selling product names as basic recommendations."""
+* ``ProductPopularity``: units sold and number of orders per product, and
+* ``ProductAffinity``: a sparse item-to-item co-occurrence matrix stored as
+  coordinates, the number of orders containing both ``product`` and
+  ``other``.  Zero cells are simply absent.
+
+:func:`rebuild_recommendations` recomputes both from ``OrderItem`` with one
+``INSERT ... SELECT`` each (invoices always come from an order, so their
+items would only count every sale twice).  New orders are added
+incrementally by a session hook in the flush that inserts their items, so
+the tables stay current between the nightly rebuilds.  Serving a suggestion
+is then a single indexed lookup.
+
+Best sellers are ranked by ``ProductScore``, a bounded per-company cache of
+exponentially time-decayed popularity (a sale ``HALF_LIFE_DAYS`` old counts
+half).  :func:`refresh_popularity` folds in only the order items newer than
+each company's watermark (``PopularityCache.last_item_id``): stored scores
+are decayed to the refresh time and the new sales added, so history is never
+rescanned.  Ids still missing below a new watermark (an order that commits
+after a newer one) are kept in ``PopularityCache.pending_ids`` and scored
+when they appear, within the last ``LATE_ITEM_WINDOW`` ids.  Only the top
+``POPULARITY_CACHE_SIZE`` products are kept; a pruned product comes back as
+soon as its recent sales outrank the tail.
+``force`` rebuilds the scores from every order.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import and_, bindparam, delete, event, func, insert, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from metrics import inc
+from models import (
+    db,
+    dialect_insert,
+    dom_now,
+    Order,
+    OrderItem,
+    PopularityCache,
+    ProductAffinity,
+    ProductPopularity,
+    ProductScore,
+)
+
+HALF_LIFE_DAYS = 30
+POPULARITY_CACHE_SIZE = 50  # products kept per company
+LATE_ITEM_WINDOW = 1000  # ids below the watermark still watched for late commits
+
+_scores = ProductScore.__table__
+
+
+def _record_items(connection, items):
+    """Count newly inserted order ``items`` into both tables."""
+    baskets = defaultdict(dict)
+    for item in items:
+        basket = baskets[(item.company_id, item.order_id)]
+        basket[item.product_name] = basket.get(item.product_name, 0) + (item.quantity or 0)
+    known = defaultdict(set)
+    rows = connection.execute(
+        select(OrderItem.order_id, OrderItem.product_name)
+        .where(
+            OrderItem.order_id.in_({order_id for _c, order_id in baskets}),
+            OrderItem.id.notin_([item.id for item in items]),
+        )
+        .distinct()
+    )
+    for order_id, name in rows:
+        known[order_id].add(name)
+
+    popularity = defaultdict(lambda: [0, 0])
+    pairs = defaultdict(int)
+    for (company_id, order_id), basket in baskets.items():
+        old = known[order_id]
+        for name, quantity in basket.items():
+            entry = popularity[(company_id, name)]
+            entry[0] += quantity
+            entry[1] += name not in old
+        # Only pairs involving a product new to the order are uncounted; the
+        # set keeps a pair of two new products from being counted twice.
+        names = old | set(basket)
+        counted = {(a, b) for a in set(basket) - old for b in names if a != b}
+        for a, b in counted | {(b, a) for a, b in counted}:
+            pairs[(company_id, a, b)] += 1
+
+    stmt = dialect_insert(ProductPopularity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id', 'product'],
+        set_={
+            'quantity': ProductPopularity.quantity + stmt.excluded.quantity,
+            'orders': ProductPopularity.orders + stmt.excluded.orders,
+        },
+    )
+    connection.execute(stmt, [
+        {'company_id': c, 'product': name, 'quantity': q, 'orders': n}
+        for (c, name), (q, n) in popularity.items()
+    ])
+    if pairs:
+        stmt = dialect_insert(ProductAffinity)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['company_id', 'product', 'other'],
+            set_={'orders': ProductAffinity.orders + stmt.excluded.orders},
+        )
+        connection.execute(stmt, [
+            {'company_id': c, 'product': a, 'other': b, 'orders': n}
+            for (c, a, b), n in pairs.items()
+        ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_new_items(session, flush_context):
+    items = [obj for obj in session.new if isinstance(obj, OrderItem)]
+    if items:
+        _record_items(session.connection(), items)
+
+
+def rebuild_recommendations(company_id=None):
+    """Recompute popularity and co-occurrence from every order.
+
+    Returns ``(products, pairs)`` row counts.  Committing is left to the
+    caller.
+    """
+    for model in (ProductPopularity, ProductAffinity):
+        stmt = delete(model)
+        if company_id is not None:
+            stmt = stmt.where(model.company_id == company_id)
+        db.session.execute(stmt)
+
+    items = select(
+        OrderItem.company_id, OrderItem.product_name,
+        func.sum(OrderItem.quantity), func.count(func.distinct(OrderItem.order_id)),
+    ).group_by(OrderItem.company_id, OrderItem.product_name)
+    a, b = aliased(OrderItem), aliased(OrderItem)
+    pairs = (
+        select(a.company_id, a.product_name, b.product_name, func.count(func.distinct(a.order_id)))
+        .join(b, and_(b.order_id == a.order_id, b.product_name != a.product_name))
+        .group_by(a.company_id, a.product_name, b.product_name)
+    )
+    if company_id is not None:
+        items = items.where(OrderItem.company_id == company_id)
+        pairs = pairs.where(a.company_id == company_id)
+    products = db.session.execute(
+        insert(ProductPopularity).from_select(['company_id', 'product', 'quantity', 'orders'], items)
+    ).rowcount
+    pairs = db.session.execute(
+        insert(ProductAffinity).from_select(['company_id', 'product', 'other', 'orders'], pairs)
+    ).rowcount
+    return products, pairs
+
+
+def _decay(seconds, half_life):
+    return 0.5 ** (np.maximum(seconds, 0) / (half_life * 86400))
+
+
+def refresh_popularity(company_id=None, now=None, force=False, half_life=None, size=None):
+    """Fold order items newer than each company's watermark into its scores.
+
+    Returns the number of order items scored.  With ``force`` the cached
+    scores are dropped first, so every order is scored again.  Committing is
+    left to the caller.
+    """
+    now = now or dom_now()
+    half_life = half_life or HALF_LIFE_DAYS
+    size = size or POPULARITY_CACHE_SIZE
+    if force:
+        for model in (ProductScore, PopularityCache):
+            stmt = delete(model)
+            if company_id is not None:
+                stmt = stmt.where(model.company_id == company_id)
+            db.session.execute(stmt)
+
+    caches = db.session.query(
+        PopularityCache.company_id, PopularityCache.last_item_id, PopularityCache.pending_ids
+    )
+    if company_id is not None:
+        caches = caches.filter(PopularityCache.company_id == company_id)
+    caches = {c: (last, _parse_ids(pending)) for c, last, pending in caches}
+    watched = set().union(*(pending for _last, pending in caches.values()))
+
+    query = (
+        db.session.query(OrderItem.id, OrderItem.company_id, OrderItem.product_name,
+                         OrderItem.quantity, Order.date)
+        .join(Order, Order.id == OrderItem.order_id)
+        .outerjoin(PopularityCache, PopularityCache.company_id == OrderItem.company_id)
+        .filter(or_(
+            OrderItem.id > func.coalesce(PopularityCache.last_item_id, 0),
+            OrderItem.id.in_(watched),
+        ))
+    )
+    if company_id is not None:
+        query = query.filter(OrderItem.company_id == company_id)
+    empty = (0, frozenset())
+    rows = [
+        row for row in query
+        if row[0] > caches.get(row[1], empty)[0] or row[0] in caches.get(row[1], empty)[1]
+    ]
+    if not rows:
+        return 0
+    ids, companies, names, quantities, dates = zip(*rows)
+    ages = np.array([(now - (d or now)).total_seconds() for d in dates])
+    weights = np.array(quantities, dtype=float) * _decay(ages, half_life)
+    added = defaultdict(float)
+    watermarks = {}
+    for iid, c, name, weight in zip(ids, companies, names, weights):
+        added[(c, name)] += float(weight)
+        watermarks[c] = max(watermarks.get(c, caches.get(c, empty)[0]), iid)
+
+    scored = dict(
+        db.session.query(PopularityCache.company_id, PopularityCache.scored_at)
+        .filter(PopularityCache.company_id.in_(list(watermarks)))
+    )
+    if scored:
+        db.session.execute(
+            update(_scores)
+            .where(_scores.c.company_id == bindparam('c'))
+            .values(score=_scores.c.score * bindparam('factor')),
+            [{'c': c, 'factor': float(_decay((now - at).total_seconds(), half_life))}
+             for c, at in scored.items()],
+        )
+    stmt = dialect_insert(ProductScore)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id', 'product'],
+        set_={'score': ProductScore.score + stmt.excluded.score},
+    )
+    db.session.execute(stmt, [
+        {'company_id': c, 'product': name, 'score': score} for (c, name), score in added.items()
+    ])
+    top = (
+        select(_scores.c.id)
+        .where(_scores.c.company_id == bindparam('c'))
+        .order_by(_scores.c.score.desc(), _scores.c.product)
+        .limit(size)
+    )
+    db.session.execute(
+        delete(_scores).where(_scores.c.company_id == bindparam('c'), _scores.c.id.notin_(top)),
+        [{'c': c} for c in watermarks],
+    )
+    stmt = dialect_insert(PopularityCache)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id'],
+        set_={
+            'last_item_id': stmt.excluded.last_item_id,
+            'pending_ids': stmt.excluded.pending_ids,
+            'scored_at': stmt.excluded.scored_at,
+        },
+    )
+    db.session.execute(stmt, [
+        {
+            'company_id': c, 'last_item_id': last, 'scored_at': now,
+            'pending_ids': ','.join(map(str, sorted(_missing_ids(last, *caches.get(c, empty))))),
+        }
+        for c, last in watermarks.items()
+    ])
+    return len(rows)
+
+
+def _parse_ids(text):
+    return {int(i) for i in (text or '').split(',') if i}
+
+
+def _missing_ids(last, previous, pending):
+    """Ids of the ``LATE_ITEM_WINDOW`` below ``last`` that no order item uses yet.
+
+    ``previous`` is the old watermark and ``pending`` the ids still missing
+    below it; ids that are present now belong to another company or were
+    just scored.
+    """
+    floor = last - LATE_ITEM_WINDOW
+    candidates = {i for i in pending if i > floor}
+    candidates.update(range(max(previous, floor) + 1, last + 1))
+    if not candidates:
+        return set()
+    present = {
+        iid for (iid,) in db.session.query(OrderItem.id).filter(OrderItem.id.in_(candidates))
+    }
+    return candidates - present
+
+
+def recommend_products(company_id, limit: int = 5):
+    """Return the most popular product names of ``company_id``.
+
+    Ranked by decayed score; companies whose cache has not been filled yet
+    fall back to all-time units sold.
+    """
     results = (
-        db.session.query(OrderItem.product_name)
-        .group_by(OrderItem.product_name)
-        .order_by(func.sum(OrderItem.quantity).desc())
+        db.session.query(ProductScore.product)
+        .filter(ProductScore.company_id == company_id)
+        .order_by(ProductScore.score.desc(), ProductScore.product)
         .limit(limit)
         .all()
     )
+    inc('tiendix_cache_requests_total', cache='popularity', result='hit' if results else 'miss')
+    if not results:
+        results = (
+            db.session.query(ProductPopularity.product)
+            .filter(ProductPopularity.company_id == company_id)
+            .order_by(ProductPopularity.quantity.desc(), ProductPopularity.product)
+            .limit(limit)
+        )
+    return [r[0] for r in results]
+
+
+def frequently_bought_together(company_id, products, limit: int = 5):
+    """Return products most often ordered with ``products``, excluding them."""
+    names = {p for p in products if p}
+    if not names:
+        return []
+    score = func.sum(ProductAffinity.orders)
+    results = (
+        db.session.query(ProductAffinity.other, score)
+        .filter(
+            ProductAffinity.company_id == company_id,
+            ProductAffinity.product.in_(names),
+            ProductAffinity.other.notin_(names),
+        )
+        .group_by(ProductAffinity.other)
+        .order_by(score.desc(), ProductAffinity.other)
+        .limit(limit)
+    )
     return [r[0] for r in results]
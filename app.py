@@ -13,14 +13,11 @@ from flask import (
     current_app,
     Response,
     stream_with_context,
+    abort,
 )
 from flask_migrate import Migrate, upgrade
 import logging
 from logging.handlers import RotatingFileHandler
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
 from flask_wtf import CSRFProtect
 from models import (
     db,
@@ -37,12 +34,16 @@ from models import (
     InventoryMovement,
     Warehouse,
     ProductStock,
+    StockTransfer,
     CompanyInfo,
     User,
     AccountRequest,
     ExportLog,
     NcfLog,
+    MaintenanceJob,
     Notification,
+    QuotationCampaign,
+    CATEGORIES,
     dom_now,
 )
 from io import BytesIO, StringIO
@@ -54,24 +55,60 @@ except ModuleNotFoundError:  # pragma: no cover
 from datetime import datetime, timedelta
 from sqlalchemy import func, inspect, or_
 from sqlalchemy.exc import NoSuchTableError
-from sqlalchemy.orm import load_only, joinedload
+from sqlalchemy.orm import contains_eager, load_only, joinedload
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
+import hmac
 import os
 import re
 import json
-from ai import recommend_products
+from ai import frequently_bought_together, rebuild_recommendations, recommend_products, refresh_popularity
+from tenant_cache import get_company, invalidate_company
+from references import claim_reference, next_reference, peek_reference
+from stock_ledger import InsufficientStock, StockLine, apply_movements
+from stock_history import PERIODS, stock_as_of, take_snapshots
+from transfers import TransferError, create_transfer, transfer_items, transfer_to_dict
+from stock_matrix import company_warehouses, iter_matrix, stock_matrix, warehouse_sales
+from reorder import compute_reorder_points
+from mailer import drain, enqueue_email, outbox_status, start_sender
+from maintenance import JOBS, job_status, run_due, run_job, start_scheduler
+from balances import reconcile_balances, top_debtors
+from statements import (
+    STATEMENT_WORKERS,
+    client_dict,
+    company_dict,
+    generate_statements,
+    statement_row,
+)
+from campaigns import (
+    CAMPAIGN_WORKERS,
+    MAX_CAMPAIGN_QUOTATIONS,
+    QUOTATION_FOOTER,
+    campaign_quotations,
+    campaign_report,
+    create_campaign,
+    run_campaign,
+)
+from payments import PAYMENT_BATCH, PaymentError, import_payments, record_payments
+from receivables import (
+    AGING_BUCKETS,
+    EPSILON,
+    aging_query,
+    aging_row,
+    aging_totals,
+    client_aging,
+    open_invoices,
+)
+from movement_archive import ARCHIVE_MONTHS, archive_movements, movement_history
+from importers import csv_rows, import_inventory, import_products, write_errors
 from weasy_pdf import generate_pdf
+import metrics
+import query_stats
 from account_pdf import generate_account_statement_pdf
 from functools import wraps
 from auth import auth_bp, generate_reset_token
 from forms import AccountRequestForm
-from config import DevelopmentConfig
-try:
-    from dotenv import load_dotenv
-except ModuleNotFoundError:  # pragma: no cover
-    def load_dotenv():
-        pass
+from config import DevelopmentConfig  # loads .env
 try:
     from rq import Queue
     from redis import Redis
@@ -79,8 +116,8 @@ except Exception:  # pragma: no cover
     Queue = None
     Redis = None
 import threading
+import click
 
-load_dotenv()
 # Load RNC data for company name lookup
 RNC_DATA = {}
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'DGII_RNC.TXT')
@@ -106,35 +143,15 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Tiendix startup')
 
-MAIL_SERVER = os.getenv('MAIL_SERVER')
-MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
-MAIL_USERNAME = os.getenv('MAIL_USERNAME')
-MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
-MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
-
-
 def send_email(to, subject, html, attachments=None):
-    if not MAIL_SERVER or not MAIL_DEFAULT_SENDER:
+    """Queue an email in the outbox; committing is left to the caller.
+
+    ``mailer`` delivers it in the background once committed.
+    """
+    if not app.config.get('MAIL_SERVER') or not app.config.get('MAIL_DEFAULT_SENDER'):
         app.logger.warning('Email settings missing; skipping send to %s', to)
-        return
-    msg = MIMEMultipart()
-    msg['Subject'] = subject
-    msg['From'] = MAIL_DEFAULT_SENDER
-    msg['To'] = to
-    msg.attach(MIMEText(html, 'html'))
-    for attachment in attachments or []:
-        filename, data = attachment
-        part = MIMEApplication(data, Name=filename)
-        part['Content-Disposition'] = f'attachment; filename="{filename}"'
-        msg.attach(part)
-    try:
-        with smtplib.SMTP(MAIL_SERVER, MAIL_PORT) as s:
-            if MAIL_USERNAME and MAIL_PASSWORD:
-                s.starttls()
-                s.login(MAIL_USERNAME, MAIL_PASSWORD)
-            s.sendmail(MAIL_DEFAULT_SENDER, [to], msg.as_string())
-    except Exception as e:  # pragma: no cover
-        app.logger.error('Email send failed: %s', e)
+        return None
+    return enqueue_email(to, subject, html, attachments)
 
 
 def _fmt_money(value):
@@ -145,6 +162,8 @@ app.jinja_env.filters['money'] = _fmt_money
 
 db.init_app(app)
 migrate.init_app(app, db)
+query_stats.init_app(app)
+metrics.init_app(app)
 csrf = CSRFProtect(app)
 app.register_blueprint(auth_bp)
 
@@ -163,8 +182,8 @@ def enqueue_export(fn, *args):
     """Enqueue an export job using RQ if available or fallback to threading."""
     app_obj = current_app._get_current_object()
     if export_queue:
-        return export_queue.enqueue(fn, app_obj, *args)
-    t = threading.Thread(target=fn, args=(app_obj, *args), daemon=True)
+        return export_queue.enqueue(metrics.run_job, fn, app_obj, *args)
+    t = threading.Thread(target=metrics.run_job, args=(fn, app_obj, *args), daemon=True)
     t.start()
     return t
 
@@ -340,9 +359,56 @@ def _migrate_legacy_schema():
             statements.append(
                 "ALTER TABLE inventory_movement ADD COLUMN executed_by INTEGER REFERENCES user(id)"
             )
+        if 'delta' not in im_cols:
+            statements.append("ALTER TABLE inventory_movement ADD COLUMN delta INTEGER")
+        if 'unit_cost' not in im_cols:
+            statements.append("ALTER TABLE inventory_movement ADD COLUMN unit_cost FLOAT")
+
+    if inspector.has_table('product_stock'):
+        try:
+            ps_cols = {c['name'] for c in inspector.get_columns('product_stock')}
+        except NoSuchTableError:  # pragma: no cover - sqlite reflection race
+            ps_cols = set()
+        if 'demand_rate' not in ps_cols:
+            statements.append("ALTER TABLE product_stock ADD COLUMN demand_rate FLOAT DEFAULT 0")
+        if 'reorder_point' not in ps_cols:
+            statements.append("ALTER TABLE product_stock ADD COLUMN reorder_point INTEGER DEFAULT 0")
+        if 'reorder_qty' not in ps_cols:
+            statements.append("ALTER TABLE product_stock ADD COLUMN reorder_qty INTEGER DEFAULT 0")
+        if 'avg_cost' not in ps_cols:
+            statements.append("ALTER TABLE product_stock ADD COLUMN avg_cost FLOAT DEFAULT 0")
+
+    backfill = False
+    if inspector.has_table('invoice'):
+        try:
+            invoice_cols = {c['name'] for c in inspector.get_columns('invoice')}
+        except NoSuchTableError:  # pragma: no cover - sqlite reflection race
+            invoice_cols = set()
+        if 'balance_due' not in invoice_cols:
+            statements.append("ALTER TABLE invoice ADD COLUMN balance_due FLOAT NOT NULL DEFAULT 0")
+            backfill = True
+
+    if inspector.has_table('payment'):
+        try:
+            payment_cols = {c['name'] for c in inspector.get_columns('payment')}
+        except NoSuchTableError:  # pragma: no cover - sqlite reflection race
+            payment_cols = set()
+        if 'reference' not in payment_cols:
+            statements.append("ALTER TABLE payment ADD COLUMN reference VARCHAR(64)")
+
+    if inspector.has_table('client'):
+        try:
+            client_cols = {c['name'] for c in inspector.get_columns('client')}
+        except NoSuchTableError:  # pragma: no cover - sqlite reflection race
+            client_cols = set()
+        if 'outstanding' not in client_cols:
+            statements.append("ALTER TABLE client ADD COLUMN outstanding FLOAT NOT NULL DEFAULT 0")
+            backfill = True
 
     for stmt in statements:
         db.session.execute(db.text(stmt))
+    if backfill:
+        reconcile_balances()
     if statements:
         db.session.commit()
 
@@ -365,18 +431,10 @@ def ensure_admin():  # pragma: no cover - optional helper for deployments
 # Utility constants
 ITBIS_RATE = 0.18
 UNITS = ('Unidad', 'Metro', 'Onza', 'Libra', 'Kilogramo', 'Litro')
-CATEGORIES = (
-    'Alimentos y Bebidas',
-    'Productos Industriales / Materiales',
-    'Minerales',
-    'Salud y Cuidado Personal',
-    'Electrónica y Tecnología',
-    'Hogar y Construcción',
-    'Energía Renovable',
-    'Otros',
-)
 INVOICE_STATUSES = ('Pendiente', 'Pagada')
+PAYMENT_ROLES = ('admin', 'manager', 'contabilidad')
 MAX_EXPORT_ROWS = 50000
+IMPORT_ASYNC_BYTES = 2 * 1024 * 1024
 
 
 def current_company_id():
@@ -414,19 +472,8 @@ def _to_int(value):
 
 
 def generate_reference(name: str) -> str:
-    """Generate a unique reference based on product name."""
-    prefix = ''.join(ch for ch in (name or '').upper() if ch.isalnum())[:3]
-    if not prefix:
-        prefix = 'REF'
-    existing = company_query(Product).filter(Product.reference.like(f"{prefix}%")).all()
-    numbers = []
-    for p in existing:
-        if p.reference and p.reference.startswith(prefix):
-            suf = p.reference[len(prefix):]
-            if suf.isdigit():
-                numbers.append(int(suf))
-    next_no = (max(numbers) + 1) if numbers else 1
-    return f"{prefix}{next_no:03d}"
+    """Reserve the next unique reference based on product name."""
+    return next_reference(current_company_id(), name)
 
 
 def _parse_report_params(fecha_inicio, fecha_fin, estado, categoria):
@@ -544,8 +591,10 @@ def rnc_lookup(rnc):
 
 @app.before_request
 def load_company():
-    cid = current_company_id()
-    g.company = CompanyInfo.query.get(cid) if cid else None
+    if request.endpoint == 'static':
+        g.company = None
+        return
+    g.company = get_company(current_company_id())
 
 
 @app.context_processor
@@ -553,17 +602,7 @@ def inject_company():
     notif_count = 0
     try:
         if 'user_id' in session and current_company_id():
-            low_stock = (
-                company_query(ProductStock)
-                .filter(ProductStock.stock <= ProductStock.min_stock, ProductStock.min_stock > 0)
-                .all()
-            )
-            for ps in low_stock:
-                msg = f"Stock bajo: {ps.product.name}"
-                if not Notification.query.filter_by(company_id=current_company_id(), message=msg).first():
-                    db.session.add(Notification(company_id=current_company_id(), message=msg))
-            if low_stock:
-                db.session.commit()
+            # Low-stock notifications are created by the maintenance job.
             notif_count = Notification.query.filter_by(company_id=current_company_id(), is_read=False).count()
     except Exception:
         pass
@@ -571,7 +610,7 @@ def inject_company():
 
 
 def get_company_info():
-    c = CompanyInfo.query.get(current_company_id())
+    c = getattr(g, 'company', None) or get_company(current_company_id())
     if not c:
         return {}
     return {
@@ -581,8 +620,6 @@ def get_company_info():
         'phone': c.phone,
         'website': c.website,
         'logo': os.path.join(app.static_folder, c.logo) if c.logo else None,
-        'ncf_final': c.ncf_final,
-        'ncf_fiscal': c.ncf_fiscal,
     }
 # Routes
 @app.before_request
@@ -595,11 +632,13 @@ def require_login():
         'auth.reset_request',
         'auth.reset_password',
         'terminos',
+        'metrics_endpoint',  # checks its own token or admin session
     }
     if request.endpoint not in allowed and 'user_id' not in session:
         return redirect(url_for('auth.login'))
     admin_extra = {'admin_companies', 'select_company', 'clear_company',
-                   'admin_requests', 'approve_request', 'reject_request'}
+                   'admin_requests', 'approve_request', 'reject_request', 'admin_maintenance',
+                   'admin_outbox'}
     if session.get('role') == 'admin' and not session.get('company_id') \
             and request.endpoint not in allowed.union(admin_extra):
         return redirect(url_for('admin_companies'))
@@ -698,6 +737,49 @@ def admin_companies():
     return render_template('admin_companies.html', companies=companies)
 
 
+@app.route('/admin/mantenimiento')
+@admin_only
+def admin_maintenance():
+    """Last run of each periodic maintenance job."""
+    return jsonify(job_status())
+
+
+@app.route('/admin/correos')
+@admin_only
+def admin_outbox():
+    """Email outbox size per status."""
+    return jsonify(outbox_status())
+
+
+def _queue_depths():
+    gauges = [
+        ('tiendix_queue_depth', {'queue': 'email', 'state': state}, count)
+        for state, count in outbox_status()['counts'].items() if state != 'sent'
+    ]
+    exports = ExportLog.query.filter_by(status='queued').count()
+    gauges.append(('tiendix_queue_depth', {'queue': 'exports', 'state': 'queued'}, exports))
+    campaigns = dict(
+        db.session.query(QuotationCampaign.status, func.count(QuotationCampaign.id))
+        .filter(QuotationCampaign.status.in_(('queued', 'running')))
+        .group_by(QuotationCampaign.status)
+    )
+    for state in ('queued', 'running'):
+        gauges.append(('tiendix_queue_depth', {'queue': 'campaigns', 'state': state}, campaigns.get(state, 0)))
+    if export_queue is not None:
+        gauges.append(('tiendix_queue_depth', {'queue': 'rq_exports', 'state': 'queued'}, len(export_queue)))
+    return gauges
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of every worker process, for admins or ``METRICS_TOKEN``."""
+    token = app.config.get('METRICS_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(auth, f'Bearer {token}')) and session.get('role') != 'admin':
+        abort(403)
+    return Response(metrics.render(_queue_depths()), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/admin/companies/select/<int:company_id>')
 @admin_only
 def select_company(company_id):
@@ -737,7 +819,7 @@ def approve_request(req_id):
     user.password = password
     db.session.add(user)
     db.session.delete(req)
-    db.session.commit()
+    db.session.flush()
 
     # Envío de enlace temporal para establecer o restablecer contraseña
     token = generate_reset_token(user)
@@ -749,6 +831,7 @@ def approve_request(req_id):
         reset_url=url_for('auth.reset_password', token=token, _external=True),
     )
     send_email(email, 'Tu cuenta ha sido aprobada', html)
+    db.session.commit()
     flash('Cuenta aprobada')
     return redirect(url_for('admin_requests'))
 
@@ -1016,13 +1099,17 @@ def api_create_client():
 @app.get('/api/reference')
 def api_reference():
     name = request.args.get('name', '')
-    return {'reference': generate_reference(name)}
+    return {'reference': peek_reference(current_company_id(), name)}
 
 # Products CRUD
 @app.route('/productos', methods=['GET', 'POST'])
 def products():
     if request.method == 'POST':
-        reference = request.form.get('reference') or generate_reference(request.form['name'])
+        reference = request.form.get('reference')
+        if reference:
+            reference = claim_reference(current_company_id(), request.form['name'], reference)
+        else:
+            reference = generate_reference(request.form['name'])
         product = Product(
             code=request.form['code'],
             reference=reference,
@@ -1051,30 +1138,55 @@ def products():
 def products_import():
     if request.method == 'POST':
         file = request.files['file']
-        rows = file.stream.read().decode('utf-8').splitlines()
-        reader = csv.DictReader(rows)
-        for row in reader:
-            code = row.get('code')
-            if not code:
-                continue
-            prod = company_query(Product).filter_by(code=code).first()
-            if not prod:
-                prod = Product(code=code, company_id=current_company_id())
-                db.session.add(prod)
-            prod.name = row.get('name') or prod.name
-            prod.unit = row.get('unit') or prod.unit
-            prod.price = _to_float(row.get('price')) or prod.price
-            cat = row.get('category')
-            if cat in CATEGORIES:
-                prod.category = cat
-            prod.has_itbis = row.get('has_itbis', '').strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
-            if not prod.reference:
-                prod.reference = generate_reference(prod.name)
-        db.session.commit()
-        flash('Productos importados')
+        size_limit = current_app.config.get('IMPORT_ASYNC_BYTES', IMPORT_ASYNC_BYTES)
+        if (request.content_length or 0) > size_limit:
+            user = session.get('full_name') or session.get('username')
+            filtros = {'archivo': file.filename}
+            entry_id = log_export(user, 'csv', 'import_productos', filtros, 'queued')
+            os.makedirs('maint', exist_ok=True)
+            path = os.path.join('maint', f'import_{entry_id}.csv')
+            file.save(path)
+            enqueue_export(_product_import_job, current_company_id(), path, entry_id)
+            flash('Importación en proceso, revise el historial en unos minutos')
+            return redirect(url_for('export_history'))
+        result = import_products(current_company_id(), csv_rows(file.stream))
+        flash(f"Productos importados: {result['created']} nuevos, {result['updated']} actualizados")
+        if result['errors']:
+            flash(f"{len(result['errors'])} filas con errores")
+            return render_template('productos_importar.html', errors=result['errors'])
         return redirect(url_for('products'))
     return render_template('productos_importar.html')
 
+
+def _product_import_job(app_obj, company_id, path, entry_id):  # pragma: no cover - background
+    """Background task importing a large product CSV saved under ``maint/``."""
+    with app_obj.app_context():
+        entry = ExportLog.query.get(entry_id)
+
+        def progress(rows):
+            entry.message = f'{rows} filas procesadas'
+            db.session.commit()
+
+        try:
+            with open(path, 'rb') as f:
+                result = import_products(company_id, csv_rows(f), progress=progress)
+            entry.status = 'success'
+            entry.message = (
+                f"{result['created']} nuevos, {result['updated']} actualizados, "
+                f"{len(result['errors'])} errores"
+            )
+            if result['errors']:
+                entry.file_path = write_errors(path.replace('.csv', '_errores.csv'), result['errors'])
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            entry = ExportLog.query.get(entry_id)
+            entry.status = 'fail'
+            entry.message = str(exc)
+            db.session.commit()
+        finally:
+            db.session.remove()
+
 @app.route('/productos/delete/<int:product_id>')
 def delete_product(product_id):
     product = company_get(Product, product_id)
@@ -1104,6 +1216,7 @@ def inventory_report():
             company_query(ProductStock)
             .filter_by(warehouse_id=wid)
             .join(Product)
+            .options(contains_eager(ProductStock.product))
         )
         if q:
             like = f"%{q}%"
@@ -1116,6 +1229,8 @@ def inventory_report():
             query = query.filter(ProductStock.stock == 0)
         elif status == 'normal':
             query = query.filter(ProductStock.stock > ProductStock.min_stock)
+        elif status == 'reorder':
+            query = query.filter(ProductStock.reorder_point > 0, ProductStock.stock <= ProductStock.reorder_point)
 
         pagination = (
             query.order_by(Product.name)
@@ -1125,17 +1240,13 @@ def inventory_report():
         movements = (
             company_query(InventoryMovement)
             .filter_by(warehouse_id=wid)
+            .options(joinedload(InventoryMovement.product))
             .order_by(InventoryMovement.timestamp.desc())
             .limit(20)
             .all()
         )
 
-    sales_total = (
-        db.session.query(func.sum(Invoice.total))
-        .filter_by(company_id=current_company_id(), warehouse_id=wid)
-        .scalar()
-        or 0
-    )
+    sales_total = warehouse_sales(current_company_id()).get(wid, 0)
     return render_template(
         'inventario.html',
         stocks=stocks,
@@ -1152,6 +1263,81 @@ def inventory_report():
     )
 
 
+def _matrix_filters():
+    return {
+        'q': request.args.get('q', ''),
+        'category': request.args.get('category', ''),
+        'imbalanced': request.args.get('imbalanced') == '1',
+    }
+
+
+@app.route('/inventario/matriz')
+def inventory_matrix():
+    """Stock of every product across all warehouses, paginated by product."""
+    filters = _matrix_filters()
+    matrix = stock_matrix(
+        current_company_id(),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 50, type=int),
+        **filters,
+    )
+    return render_template('inventario_matriz.html', matrix=matrix, categories=CATEGORIES, **filters)
+
+
+@app.get('/api/inventario/matriz')
+def api_inventory_matrix():
+    return jsonify(stock_matrix(
+        current_company_id(),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 50, type=int),
+        **_matrix_filters(),
+    ))
+
+
+@app.route('/inventario/matriz/export')
+def export_inventory_matrix():
+    role = session.get('role')
+    if role not in ('admin', 'manager', 'contabilidad'):
+        return '', 403
+    company_id = current_company_id()
+    filters = _matrix_filters()
+    warehouses = company_warehouses(company_id)
+    formato = request.args.get('formato', 'csv')
+    user = session.get('full_name') or session.get('username')
+    log_export(user, formato, 'matriz_inventario', filters, 'success')
+    if formato == 'json':
+        return jsonify({
+            'warehouses': [{'id': w.id, 'name': w.name} for w in warehouses],
+            'rows': list(iter_matrix(company_id, warehouses, **filters)),
+        })
+
+    def generate():
+        sio = StringIO()
+        writer = csv.writer(sio)
+        writer.writerow(['Código', 'Producto', *[w.name for w in warehouses], 'Total'])
+        yield sio.getvalue(); sio.seek(0); sio.truncate(0)
+        for row in iter_matrix(company_id, warehouses, **filters):
+            writer.writerow([row['code'] or '', row['name'] or '',
+                             *[row['stock'][w.id] for w in warehouses], row['total']])
+            yield sio.getvalue(); sio.seek(0); sio.truncate(0)
+
+    headers = {'Content-Disposition': 'attachment; filename=inventario_matriz.csv'}
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
+
+
+@app.post('/inventario/reorden')
+@manager_only
+def recompute_reorder_points():
+    count = compute_reorder_points(
+        current_company_id(),
+        lookback_days=current_app.config.get('REORDER_LOOKBACK_DAYS'),
+        lead_time=current_app.config.get('REORDER_LEAD_TIME_DAYS'),
+        cover_days=current_app.config.get('REORDER_COVER_DAYS'),
+    )
+    flash(f'Puntos de reorden calculados para {count} productos')
+    return redirect(url_for('inventory_report', warehouse_id=request.form.get('warehouse_id'), status='reorder'))
+
+
 @app.post('/inventario/<int:stock_id>/minimo')
 def update_min_stock(stock_id):
     stock = company_get(ProductStock, stock_id)
@@ -1171,39 +1357,28 @@ def inventory_adjust():
         qty = _to_int(request.form['quantity'])
         mtype = request.form['movement_type']
         product = company_get(Product, pid)
-        stock = company_query(ProductStock).filter_by(product_id=pid, warehouse_id=wid).first()
-        if not stock:
-            stock = ProductStock(product_id=pid, warehouse_id=wid, company_id=current_company_id())
-            db.session.add(stock)
-        # ensure numeric defaults
-        if stock.stock is None:
-            stock.stock = 0
-        if product.stock is None:
-            product.stock = 0
-        if mtype == 'entrada':
-            stock.stock += qty
-            product.stock += qty
-            mov_qty = qty
-        elif mtype == 'salida':
-            if stock.stock < qty:
-                flash('Stock insuficiente')
+        company_get(Warehouse, wid)
+        if mtype not in ('entrada', 'salida', 'ajuste'):
+            mtype = 'ajuste'
+        unit_cost = None
+        if mtype == 'entrada' and request.form.get('unit_cost'):
+            try:
+                unit_cost = float(request.form['unit_cost'])
+            except ValueError:
+                unit_cost = -1
+            if unit_cost < 0:
+                flash('Costo unitario inválido')
                 return redirect(url_for('inventory_adjust'))
-            stock.stock -= qty
-            product.stock -= qty
-            mov_qty = qty
-        else:  # ajuste
-            mov_qty = abs(stock.stock - qty)
-            product.stock += qty - stock.stock
-            stock.stock = qty
-        mov = InventoryMovement(
-            product_id=product.id,
-            quantity=mov_qty,
-            movement_type=mtype,
-            warehouse_id=wid,
-            company_id=current_company_id(),
-            executed_by=session.get('user_id'),
-        )
-        db.session.add(mov)
+        try:
+            apply_movements(
+                current_company_id(),
+                session.get('user_id'),
+                [StockLine(product.id, wid, qty, mtype, unit_cost=unit_cost)],
+            )
+        except InsufficientStock:
+            db.session.rollback()
+            flash('Stock insuficiente')
+            return redirect(url_for('inventory_adjust'))
         db.session.commit()
         flash('Inventario actualizado')
         return redirect(url_for('inventory_report', warehouse_id=wid))
@@ -1225,131 +1400,149 @@ def inventory_import():
             flash('Debe subir un archivo CSV válido')
             return render_template('inventario_importar.html', warehouses=warehouses)
 
-        stream = StringIO(file.stream.read().decode('utf-8'))
-        reader = csv.DictReader(stream)
+        reader = csv_rows(file.stream)
         expected = {'code', 'stock', 'min_stock'}
         if not reader.fieldnames or not expected.issubset(set(reader.fieldnames)):
             flash('Cabeceras inválidas. Se requieren: code, stock, min_stock')
             return render_template('inventario_importar.html', warehouses=warehouses)
 
-        errors = []
-        valid_rows = []
-        for idx, row in enumerate(reader, start=2):
-            code = (row.get('code') or '').strip()
-            if not code:
-                errors.append((idx, 'Código faltante'))
-                continue
-            product = company_query(Product).filter_by(code=code).first()
-            if not product:
-                errors.append((idx, f'Producto {code} no encontrado'))
-                continue
-            try:
-                stock_qty = int(row.get('stock'))
-            except (TypeError, ValueError):
-                errors.append((idx, f'Stock inválido para {code}'))
-                continue
-            min_val = row.get('min_stock')
-            try:
-                min_stock = int(min_val) if min_val not in (None, '') else None
-            except ValueError:
-                errors.append((idx, f'Min stock inválido para {code}'))
-                continue
-            valid_rows.append((product, stock_qty, min_stock))
+        size_limit = current_app.config.get('IMPORT_ASYNC_BYTES', IMPORT_ASYNC_BYTES)
+        if (request.content_length or 0) > size_limit:
+            user = session.get('full_name') or session.get('username')
+            filtros = {'archivo': file.filename, 'warehouse_id': wid}
+            entry_id = log_export(user, 'csv', 'import_inventario', filtros, 'queued')
+            os.makedirs('maint', exist_ok=True)
+            path = os.path.join('maint', f'import_{entry_id}.csv')
+            file.stream.seek(0)
+            file.save(path)
+            enqueue_export(_inventory_import_job, current_company_id(), wid, session.get('user_id'), path, entry_id)
+            flash('Importación en proceso, revise el historial en unos minutos')
+            return redirect(url_for('export_history'))
+
+        result = import_inventory(current_company_id(), wid, session.get('user_id'), reader)
+        if result['errors']:
+            flash(f"Importación cancelada. {len(result['errors'])} filas con errores.")
+            return render_template('inventario_importar.html', warehouses=warehouses, errors=result['errors'])
+
+        flash(f"Se importaron {result['imported']} productos")
+        return redirect(url_for('inventory_report', warehouse_id=wid))
 
-        if errors:
+    return render_template('inventario_importar.html', warehouses=warehouses)
+
+
+def _inventory_import_job(app_obj, company_id, warehouse_id, user_id, path, entry_id):  # pragma: no cover - background
+    """Background task importing a large stock CSV saved under ``maint/``."""
+    with app_obj.app_context():
+        entry = ExportLog.query.get(entry_id)
+
+        def progress(phase, rows):
+            # Only validation progress is committed; the write phase runs in
+            # a single transaction that must not be committed half-way.
+            if phase == 'validate':
+                entry.message = f'{rows} filas validadas'
+                db.session.commit()
+            else:
+                app_obj.logger.info('inventory import %s: %s filas escritas', entry_id, rows)
+
+        try:
+            with open(path, 'rb') as f:
+                result = import_inventory(company_id, warehouse_id, user_id, csv_rows(f), progress=progress)
+            entry = ExportLog.query.get(entry_id)
+            if result['errors']:
+                entry.status = 'fail'
+                entry.message = f"Importación cancelada. {len(result['errors'])} filas con errores."
+                entry.file_path = write_errors(path.replace('.csv', '_errores.csv'), result['errors'])
+            else:
+                entry.status = 'success'
+                entry.message = f"Se importaron {result['imported']} productos"
+            db.session.commit()
+        except Exception as exc:
             db.session.rollback()
-            flash(f'Importación cancelada. {len(errors)} filas con errores.')
-            return render_template('inventario_importar.html', warehouses=warehouses, errors=errors)
-
-        for product, stock_qty, min_stock in valid_rows:
-            product.stock = stock_qty
-            ps = (
-                company_query(ProductStock)
-                .filter_by(product_id=product.id, warehouse_id=wid)
-                .first()
-            )
-            if not ps:
-                ps = ProductStock(product_id=product.id, warehouse_id=wid, company_id=current_company_id())
-                db.session.add(ps)
-            ps.stock = stock_qty
-            if min_stock is not None:
-                ps.min_stock = min_stock
-                product.min_stock = min_stock
-            mov = InventoryMovement(
-                product_id=product.id,
-                quantity=stock_qty,
-                movement_type='entrada',
-                reference_type='import',
-                warehouse_id=wid,
-                company_id=current_company_id(),
-                executed_by=session.get('user_id'),
-            )
-            db.session.add(mov)
+            entry = ExportLog.query.get(entry_id)
+            entry.status = 'fail'
+            entry.message = str(exc)
+            db.session.commit()
+        finally:
+            db.session.remove()
 
-        db.session.commit()
-        flash(f'Se importaron {len(valid_rows)} productos')
-        return redirect(url_for('inventory_report', warehouse_id=wid))
 
-    return render_template('inventario_importar.html', warehouses=warehouses)
+def _apply_transfer(origin, dest, items, note=None):
+    """Create a transfer document, committing it or returning an error message."""
+    try:
+        transfer = create_transfer(
+            current_company_id(), session.get('user_id'), origin, dest, items, note=note
+        )
+    except TransferError as exc:
+        db.session.rollback()
+        return None, exc.errors
+    except InsufficientStock as exc:
+        db.session.rollback()
+        product = db.session.get(Product, exc.product_id)
+        return None, [(0, f'Stock insuficiente para {product.name if product else exc.product_id}')]
+    db.session.commit()
+    return transfer, []
 
 
 @app.route('/inventario/transferir', methods=['GET', 'POST'])
 def inventory_transfer():
-    products = company_query(Product).order_by(Product.name).all()
-    warehouses = company_query(Warehouse).order_by(Warehouse.name).all()
     if request.method == 'POST':
-        pid = int(request.form['product_id'])
-        origin = int(request.form['origin_id'])
-        dest = int(request.form['dest_id'])
-        qty = _to_int(request.form['quantity'])
-        if origin == dest:
-            flash('Seleccione almacenes distintos')
-            return redirect(url_for('inventory_transfer'))
-        o_stock = (
-            company_query(ProductStock)
-            .filter_by(product_id=pid, warehouse_id=origin)
-            .first()
-        )
-        d_stock = (
-            company_query(ProductStock)
-            .filter_by(product_id=pid, warehouse_id=dest)
-            .first()
-        )
-        if not o_stock or o_stock.stock < qty:
-            flash('Stock insuficiente')
-            return redirect(url_for('inventory_transfer'))
-        if not d_stock:
-            d_stock = ProductStock(product_id=pid, warehouse_id=dest, stock=0, company_id=current_company_id())
-            db.session.add(d_stock)
-        o_stock.stock -= qty
-        d_stock.stock += qty
-        mov_out = InventoryMovement(
-            product_id=pid,
-            quantity=qty,
-            movement_type='salida',
-            warehouse_id=origin,
-            company_id=current_company_id(),
-            reference_type='transfer',
-            reference_id=dest,
-            executed_by=session.get('user_id'),
-        )
-        mov_in = InventoryMovement(
-            product_id=pid,
-            quantity=qty,
-            movement_type='entrada',
-            warehouse_id=dest,
-            company_id=current_company_id(),
-            reference_type='transfer',
-            reference_id=origin,
-            executed_by=session.get('user_id'),
-        )
-        db.session.add_all([mov_out, mov_in])
-        db.session.commit()
-        flash('Transferencia realizada')
+        origin = request.form.get('origin_id', type=int)
+        dest = request.form.get('dest_id', type=int)
+        file = request.files.get('file')
+        if file and file.filename:
+            if not file.filename.lower().endswith('.csv'):
+                flash('Debe subir un archivo CSV válido')
+                return redirect(url_for('inventory_transfer'))
+            reader = csv_rows(file.stream)
+            if not reader.fieldnames or not {'code', 'quantity'}.issubset(reader.fieldnames):
+                flash('Cabeceras inválidas. Se requieren: code, quantity')
+                return redirect(url_for('inventory_transfer'))
+            items = transfer_items(reader)
+        else:
+            items = [{'product_id': request.form.get('product_id'),
+                      'quantity': request.form.get('quantity')}]
+        transfer, errors = _apply_transfer(origin, dest, items, request.form.get('note'))
+        if errors:
+            if len(errors) == 1:
+                line, message = errors[0]
+                # Line numbers only mean something for uploaded files.
+                flash(f'Línea {line}: {message}' if line and file and file.filename else message)
+                return redirect(url_for('inventory_transfer'))
+            flash(f'Transferencia cancelada. {len(errors)} líneas con errores.')
+            products = company_query(Product).order_by(Product.name).all()
+            warehouses = company_query(Warehouse).order_by(Warehouse.name).all()
+            return render_template('inventario_transferir.html', products=products,
+                                   warehouses=warehouses, errors=errors)
+        flash(f'Transferencia #{transfer.id} realizada ({len(transfer.items)} productos)')
         return redirect(url_for('inventory_report', warehouse_id=dest))
+    products = company_query(Product).order_by(Product.name).all()
+    warehouses = company_query(Warehouse).order_by(Warehouse.name).all()
     return render_template('inventario_transferir.html', products=products, warehouses=warehouses)
 
 
+@app.post('/api/inventario/transferencias')
+def api_create_transfer():
+    """Create a transfer from ``{origin_id, dest_id, note, items: [...]}``.
+
+    Items carry ``product_id`` or ``code`` and ``quantity``.
+    """
+    data = request.get_json() or {}
+    items = data.get('items')
+    if not isinstance(items, list):
+        return {'error': 'items debe ser una lista'}, 400
+    transfer, errors = _apply_transfer(
+        _to_int(data.get('origin_id')), _to_int(data.get('dest_id')), items, data.get('note')
+    )
+    if errors:
+        return {'errors': [{'line': line, 'error': msg} for line, msg in errors]}, 400
+    return jsonify(transfer_to_dict(transfer)), 201
+
+
+@app.get('/api/inventario/transferencias/<int:transfer_id>')
+def api_get_transfer(transfer_id):
+    return jsonify(transfer_to_dict(company_get(StockTransfer, transfer_id)))
+
+
 @app.route('/almacenes', methods=['GET', 'POST'])
 @manager_only
 def warehouses():
@@ -1377,7 +1570,11 @@ def edit_product(product_id):
     product = company_get(Product, product_id)
     if request.method == 'POST':
         product.code = request.form['code']
-        product.reference = request.form.get('reference') or generate_reference(request.form['name'])
+        reference = request.form.get('reference')
+        if not reference:
+            product.reference = generate_reference(request.form['name'])
+        elif reference != product.reference:
+            product.reference = claim_reference(current_company_id(), request.form['name'], reference)
         product.name = request.form['name']
         product.unit = request.form['unit']
         product.price = _to_float(request.form['price'])
@@ -1397,13 +1594,10 @@ def list_quotations():
     status = request.args.get('status')
     page = request.args.get('page', 1, type=int)
 
+    # Read-only: the maintenance job stores the 'vencida' status; until it
+    # runs, expired 'vigente' quotations are treated as 'vencida' here.
     now = dom_now()
-    company_query(Quotation).filter(
-        Quotation.status == 'vigente', Quotation.valid_until < now
-    ).update({'status': 'vencida'}, synchronize_session=False)
-    db.session.commit()
-
-    query = company_query(Quotation).join(Client)
+    query = company_query(Quotation).join(Client).options(contains_eager(Quotation.client))
     if client_q:
         query = query.filter(
             (Client.name.contains(client_q)) | (Client.identifier.contains(client_q))
@@ -1414,7 +1608,14 @@ def list_quotations():
     if date_to:
         dt = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
         query = query.filter(Quotation.date < dt)
-    if status:
+    if status == 'vencida':
+        query = query.filter(or_(
+            Quotation.status == 'vencida',
+            (Quotation.status == 'vigente') & (Quotation.valid_until < now),
+        ))
+    elif status == 'vigente':
+        query = query.filter(Quotation.status == 'vigente', Quotation.valid_until >= now)
+    elif status:
         query = query.filter(Quotation.status == status)
 
     quotations = query.order_by(Quotation.date.desc()).paginate(
@@ -1620,6 +1821,7 @@ def settings_company():
             )
             db.session.add(log)
         db.session.commit()
+        invalidate_company(company.id)
         flash('Ajustes guardados')
         return redirect(url_for('settings_company'))
     return render_template('ajustes_empresa.html', company=company)
@@ -1628,7 +1830,7 @@ def settings_company():
 @app.route('/ajustes/usuarios/agregar', methods=['GET', 'POST'])
 @manager_only
 def settings_add_user():
-    company = CompanyInfo.query.get(current_company_id())
+    company = g.company
     if request.method == 'POST':
         if session.get('role') == 'manager':
             count = User.query.filter_by(company_id=company.id, role='company').count()
@@ -1693,9 +1895,7 @@ def quotation_pdf(quotation_id):
                  bank=quotation.bank, doc_number=quotation.id, note=quotation.note,
                  output_path=pdf_path,
                  date=quotation.date, valid_until=quotation.valid_until,
-                 footer=("Condiciones: Esta cotización es válida por 30 días a partir de la fecha de emisión. "
-                         "Los precios están sujetos a cambios sin previo aviso. "
-                         "El ITBIS ha sido calculado conforme a la ley vigente."))
+                 footer=QUOTATION_FOOTER)
     return send_file(pdf_path, download_name=filename, as_attachment=True)
 
 
@@ -1716,16 +1916,93 @@ def send_quotation_email(quotation_id):
                  bank=quotation.bank, doc_number=quotation.id, note=quotation.note,
                  output_path=pdf_path,
                  date=quotation.date, valid_until=quotation.valid_until,
-                 footer=("Condiciones: Esta cotización es válida por 30 días a partir de la fecha de emisión. "
-                         "Los precios están sujetos a cambios sin previo aviso. "
-                         "El ITBIS ha sido calculado conforme a la ley vigente."))
+                 footer=QUOTATION_FOOTER)
     with open(pdf_path, 'rb') as f:
         pdf_data = f.read()
     html = render_template('emails/quotation.html', client=client, company=company, quotation=quotation)
     send_email(client.email, 'Cotización', html, attachments=[(filename, pdf_data)])
+    db.session.commit()
     flash(f'Cotización enviada con éxito a {client.email}')
     return redirect(url_for('list_quotations'))
 
+@app.post('/cotizaciones/campana')
+def quotation_campaign():
+    """Email a batch of quotations to their clients in the background.
+
+    Takes ``ids`` or the list filters (``status``, ``date_from``,
+    ``date_to``) from a form or a JSON body.  JSON requests get ``202``
+    with the URL of the campaign report.
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    wants_json = data is not None
+    data = data or request.form
+
+    def fail(message, code=400):
+        if wants_json:
+            return {'error': message}, code
+        flash(message)
+        return redirect(url_for('list_quotations'))
+
+    if session.get('role') not in ('admin', 'manager'):
+        return fail('Acceso restringido', 403)
+    if not app.config.get('MAIL_SERVER'):
+        return fail('El envío de correos no está configurado')
+    ids = data.getlist('ids') if hasattr(data, 'getlist') else data.get('ids') or []
+    try:
+        ids = [int(i) for i in ids]
+        date_from = datetime.strptime(data['date_from'], '%Y-%m-%d') if data.get('date_from') else None
+        date_to = datetime.strptime(data['date_to'], '%Y-%m-%d') if data.get('date_to') else None
+    except (TypeError, ValueError):
+        return fail('Parámetros inválidos')
+    query = campaign_quotations(current_company_id(), ids, data.get('status'), date_from, date_to)
+    quotation_ids = [qid for (qid,) in query.with_entities(Quotation.id).order_by(Quotation.id)]
+    if not quotation_ids:
+        return fail('No hay cotizaciones para enviar')
+    if len(quotation_ids) > MAX_CAMPAIGN_QUOTATIONS:
+        return fail(f'Máximo {MAX_CAMPAIGN_QUOTATIONS} cotizaciones por envío')
+    campaign = create_campaign(current_company_id(), session.get('user_id'), quotation_ids)
+    db.session.commit()
+    enqueue_export(_campaign_job, campaign.id, get_company_info())
+    if wants_json:
+        return {
+            'id': campaign.id,
+            'quotations': len(quotation_ids),
+            'status_url': url_for('quotation_campaign_status', campaign_id=campaign.id),
+        }, 202
+    flash(f'Enviando {len(quotation_ids)} cotizaciones por correo')
+    return redirect(url_for('list_quotations'))
+
+
+@app.get('/api/cotizaciones/campana/<int:campaign_id>')
+def quotation_campaign_status(campaign_id):
+    return jsonify(campaign_report(company_get(QuotationCampaign, campaign_id)))
+
+
+def run_quotation_campaign(campaign_id, company):
+    """Run a campaign, marking it ``fail`` if rendering or queueing breaks."""
+    try:
+        return run_campaign(campaign_id, company, app.config.get('CAMPAIGN_WORKERS', CAMPAIGN_WORKERS))
+    except Exception as exc:
+        db.session.rollback()
+        campaign = db.session.get(QuotationCampaign, campaign_id)
+        campaign.status = 'fail'
+        campaign.message = str(exc)[:255]
+        campaign.finished_at = dom_now()
+        db.session.commit()
+        raise
+
+
+def _campaign_job(app_obj, campaign_id, company):  # pragma: no cover - background
+    """Background task sending a quotation campaign."""
+    with app_obj.app_context():
+        try:
+            run_quotation_campaign(campaign_id, company)
+        except Exception:
+            app_obj.logger.exception('quotation campaign %s failed', campaign_id)
+        finally:
+            db.session.remove()
+
+
 @app.route('/cotizaciones/<int:quotation_id>/convertir', methods=['GET', 'POST'])
 def quotation_to_order(quotation_id):
     quotation = company_get(Quotation, quotation_id)
@@ -1742,16 +2019,20 @@ def quotation_to_order(quotation_id):
     if dom_now() > quotation.valid_until:
         flash('La cotización ha expirado')
         return redirect(url_for('list_quotations'))
+    codes = {item.code for item in quotation.items}
+    products = {
+        p.code: p
+        for p in company_query(Product).options(load_only(Product.id, Product.code)).filter(Product.code.in_(codes))
+    }
+    lines = []
+    names = {}
     for item in quotation.items:
-        product = company_query(Product).filter_by(code=item.code).first()
-        stock = (
-            company_query(ProductStock)
-            .filter_by(product_id=product.id, warehouse_id=wid)
-            .first()
-        )
-        if not stock or stock.stock < item.quantity:
+        product = products.get(item.code)
+        if not product:
             flash('Stock insuficiente para ' + item.product_name)
             return redirect(url_for('list_quotations'))
+        lines.append(StockLine(product.id, wid, item.quantity, 'salida'))
+        names[product.id] = item.product_name
     order = Order(
         client_id=quotation.client_id,
         quotation_id=quotation.id,
@@ -1784,27 +2065,13 @@ def quotation_to_order(quotation_id):
             company_id=current_company_id(),
         )
         db.session.add(o_item)
-        product = company_query(Product).filter_by(code=item.code).first()
-        if product:
-            ps = (
-                company_query(ProductStock)
-                .filter_by(product_id=product.id, warehouse_id=wid)
-                .first()
-            )
-            if ps:
-                ps.stock -= item.quantity
-            product.stock -= item.quantity
-            mov = InventoryMovement(
-                product_id=product.id,
-                quantity=item.quantity,
-                movement_type='salida',
-                reference_type='Order',
-                reference_id=order.id,
-                warehouse_id=wid,
-                company_id=current_company_id(),
-                executed_by=session.get('user_id'),
-            )
-            db.session.add(mov)
+    try:
+        apply_movements(current_company_id(), session.get('user_id'), lines,
+                        reference_type='Order', reference_id=order.id)
+    except InsufficientStock as exc:
+        db.session.rollback()
+        flash('Stock insuficiente para ' + names[exc.product_id])
+        return redirect(url_for('list_quotations'))
     db.session.commit()
     flash('Pedido creado')
     notify('Pedido creado')
@@ -1814,7 +2081,7 @@ def quotation_to_order(quotation_id):
 @app.route('/pedidos')
 def list_orders():
     q = request.args.get('q')
-    query = company_query(Order).join(Client)
+    query = company_query(Order).join(Client).options(contains_eager(Order.client))
     if q:
         query = query.filter((Client.name.contains(q)) | (Client.identifier.contains(q)))
     orders = query.order_by(Order.date.desc()).all()
@@ -1900,7 +2167,7 @@ def order_pdf(order_id):
 @app.route('/facturas')
 def list_invoices():
     q = request.args.get('q')
-    query = company_query(Invoice).join(Client)
+    query = company_query(Invoice).join(Client).options(contains_eager(Invoice.client))
     if q:
         query = query.filter((Client.name.contains(q)) | (Client.identifier.contains(q)))
     invoices = query.order_by(Invoice.date.desc()).all()
@@ -1910,12 +2177,125 @@ def list_invoices():
 @app.route('/facturas/<int:invoice_id>/pagar', methods=['POST'])
 def pay_invoice(invoice_id):
     invoice = company_get(Invoice, invoice_id)
+    if invoice.balance_due > EPSILON:
+        db.session.add(Payment(invoice_id=invoice.id, amount=invoice.balance_due,
+                               company_id=invoice.company_id))
     invoice.status = 'Pagada'
     db.session.commit()
     flash('Factura marcada como pagada')
     return redirect(url_for('list_invoices'))
 
 
+@app.post('/api/pagos')
+def api_record_payments():
+    """Record payments from ``{payments: [...]}`` or a single payment object.
+
+    Each payment has ``amount`` and one of ``invoice_id``, ``ncf``,
+    ``client_id`` or ``identifier``, plus optional ``date`` and
+    ``reference``.  Nothing is recorded if any payment is invalid.
+    """
+    if session.get('role') not in PAYMENT_ROLES:
+        return {'error': 'Acceso restringido'}, 403
+    data = request.get_json() or {}
+    items = data.get('payments', [data])
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return {'error': 'payments debe ser una lista'}, 400
+    if len(items) > PAYMENT_BATCH:
+        return {'error': f'Máximo {PAYMENT_BATCH} pagos por solicitud'}, 400
+    try:
+        result = record_payments(current_company_id(), items)
+    except PaymentError as exc:
+        db.session.rollback()
+        return {'errors': [{'line': line, 'error': msg} for line, msg in exc.errors]}, 400
+    db.session.commit()
+    result['unapplied'] = [{'line': line, 'amount': amount} for line, amount in result['unapplied']]
+    del result['errors']
+    return jsonify(result), 201
+
+
+@app.get('/api/facturas/<int:invoice_id>/pagos')
+def api_invoice_payments(invoice_id):
+    invoice = company_get(Invoice, invoice_id)
+    return jsonify({
+        'invoice_id': invoice.id,
+        'total': invoice.total,
+        'balance_due': round(invoice.balance_due, 2),
+        'status': invoice.status,
+        'payments': [
+            {'id': p.id, 'amount': p.amount, 'date': p.date.isoformat() if p.date else None,
+             'reference': p.reference}
+            for p in sorted(invoice.payments, key=lambda p: p.id)
+        ],
+    })
+
+
+@app.route('/pagos/importar', methods=['GET', 'POST'])
+def payment_import():
+    if session.get('role') not in PAYMENT_ROLES:
+        flash('Acceso restringido')
+        return redirect(url_for('list_invoices'))
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename.lower().endswith('.csv'):
+            flash('Debe subir un archivo CSV válido')
+            return render_template('pagos_importar.html')
+
+        reader = csv_rows(file.stream)
+        fields = set(reader.fieldnames or ())
+        if 'amount' not in fields or not fields & {'ncf', 'client'}:
+            flash('Cabeceras inválidas. Se requieren: amount y ncf o client')
+            return render_template('pagos_importar.html')
+
+        size_limit = current_app.config.get('IMPORT_ASYNC_BYTES', IMPORT_ASYNC_BYTES)
+        if (request.content_length or 0) > size_limit:
+            user = session.get('full_name') or session.get('username')
+            entry_id = log_export(user, 'csv', 'import_pagos', {'archivo': file.filename}, 'queued')
+            os.makedirs('maint', exist_ok=True)
+            path = os.path.join('maint', f'import_{entry_id}.csv')
+            file.stream.seek(0)
+            file.save(path)
+            enqueue_export(_payment_import_job, current_company_id(), path, entry_id)
+            flash('Importación en proceso, revise el historial en unos minutos')
+            return redirect(url_for('export_history'))
+
+        result = import_payments(current_company_id(), reader)
+        flash(f"Se aplicaron {result['applied']} pagos por {result['amount']:,.2f}")
+        return render_template('pagos_importar.html', result=result)
+
+    return render_template('pagos_importar.html')
+
+
+def _payment_import_job(app_obj, company_id, path, entry_id):  # pragma: no cover - background
+    """Background task applying a large bank file saved under ``maint/``."""
+    with app_obj.app_context():
+        def progress(rows):
+            entry = ExportLog.query.get(entry_id)
+            entry.message = f'{rows} filas procesadas'
+            db.session.commit()
+
+        try:
+            with open(path, 'rb') as f:
+                result = import_payments(company_id, csv_rows(f), progress=progress)
+            entry = ExportLog.query.get(entry_id)
+            entry.status = 'success'
+            entry.message = f"Se aplicaron {result['applied']} pagos por {result['amount']:,.2f}"
+            issues = result['errors'] + [
+                (line, f'Sobrante sin aplicar: {amount:.2f}') for line, amount in result['unapplied']
+            ]
+            if issues:
+                entry.message += f'. {len(issues)} filas con observaciones.'
+                entry.file_path = write_errors(path.replace('.csv', '_errores.csv'), sorted(issues))
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            entry = ExportLog.query.get(entry_id)
+            entry.status = 'fail'
+            entry.message = str(exc)
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
 @app.route('/notificaciones')
 def notifications_view():
     notifs = company_query(Notification).order_by(Notification.created_at.desc()).all()
@@ -2233,73 +2613,165 @@ def account_statement_clients():
     return render_template('estado_cuentas.html', clients=clients)
 
 
-def _invoice_balance(inv):
-    return inv.total - sum(p.amount for p in inv.payments)
+def _aging_params():
+    return {
+        'page': max(request.args.get('page', 1, type=int), 1),
+        'per_page': min(max(request.args.get('per_page', 50, type=int), 1), 200),
+        'q': request.args.get('q', ''),
+    }
+
+
+def _aging_page(params, as_of):
+    """One page of the aging report plus tenant totals."""
+    query = aging_query(current_company_id(), as_of, params['q'])
+    rows = query.limit(params['per_page'] + 1).offset((params['page'] - 1) * params['per_page']).all()
+    return {
+        'as_of': as_of.strftime('%Y-%m-%d'),
+        'buckets': [label for label, _days in AGING_BUCKETS],
+        'clients': [aging_row(r) for r in rows[:params['per_page']]],
+        'totals': aging_totals(current_company_id(), as_of, params['q']),
+        'page': params['page'],
+        'per_page': params['per_page'],
+        'has_next': len(rows) > params['per_page'],
+    }
+
+
+@app.get('/reportes/antiguedad')
+def receivables_aging():
+    params = _aging_params()
+    report = _aging_page(params, dom_now())
+    return render_template('antiguedad_saldos.html', report=report, q=params['q'])
+
+
+@app.get('/api/reportes/antiguedad')
+def api_receivables_aging():
+    return jsonify(_aging_page(_aging_params(), dom_now()))
+
+
+@app.get('/api/reportes/deudores')
+def api_top_debtors():
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return jsonify([
+        {'client_id': c.id, 'name': c.name, 'identifier': c.identifier,
+         'outstanding': round(c.outstanding, 2)}
+        for c in top_debtors(current_company_id(), limit)
+    ])
+
+
+@app.get('/reportes/antiguedad/export')
+def export_receivables_aging():
+    role = session.get('role')
+    if role not in ('admin', 'manager', 'contabilidad'):
+        return '', 403
+    company_id = current_company_id()
+    q = request.args.get('q', '')
+    as_of = dom_now()
+    log_export(session.get('full_name') or session.get('username'), 'csv', 'antiguedad', {'q': q}, 'success')
+    labels = [label for label, _days in AGING_BUCKETS]
+
+    def generate():
+        sio = StringIO()
+        writer = csv.writer(sio)
+        writer.writerow(['Cliente', 'RNC', 'Facturas', *labels, 'Vencido', 'Saldo'])
+        yield sio.getvalue(); sio.seek(0); sio.truncate(0)
+        for row in aging_query(company_id, as_of, q).yield_per(500):
+            data = aging_row(row)
+            writer.writerow([
+                data['name'], data['identifier'] or '', data['invoices'],
+                *[f"{data['buckets'][label]:.2f}" for label in labels],
+                f"{data['overdue']:.2f}", f"{data['balance']:.2f}",
+            ])
+            yield sio.getvalue(); sio.seek(0); sio.truncate(0)
+
+    headers = {'Content-Disposition': f"attachment; filename=antiguedad_{as_of.strftime('%Y%m%d')}.csv"}
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
 
 
 @app.get('/reportes/estado-cuentas/<int:client_id>')
 def account_statement_detail(client_id):
     client = company_get(Client, client_id)
+    now = dom_now()
     invoices = (
-        company_query(Invoice)
-        .filter_by(client_id=client.id)
-        .options(joinedload(Invoice.order), joinedload(Invoice.payments))
+        open_invoices(current_company_id(), client.id)
+        .options(joinedload(Invoice.order))
+        .order_by(Invoice.date)
         .all()
     )
-    rows = []
-    totals = 0
-    aging = {'0-30': 0, '31-60': 0, '61-90': 0, '91-120': 0, '121+': 0}
-    now = datetime.utcnow()
-    for inv in invoices:
-        balance = _invoice_balance(inv)
-        if balance <= 0:
-            continue
-        due = inv.date + timedelta(days=30)
-        rows.append({
-            'document': inv.ncf or f'FAC-{inv.id}',
-            'order': inv.order.customer_po if inv.order and inv.order.customer_po else inv.order_id,
-            'date': inv.date.strftime('%d/%m/%Y'),
-            'due': due.strftime('%d/%m/%Y'),
-            'info': inv.note or '',
-            'amount': inv.total,
-            'balance': balance,
-        })
-        totals += balance
-        age = (now - inv.date).days
-        if age <= 30:
-            aging['0-30'] += balance
-        elif age <= 60:
-            aging['31-60'] += balance
-        elif age <= 90:
-            aging['61-90'] += balance
-        elif age <= 120:
-            aging['91-120'] += balance
-        else:
-            aging['121+'] += balance
-    overdue = sum(r['balance'] for r in rows if datetime.strptime(r['due'], '%d/%m/%Y') < now)
+    rows = [
+        statement_row(inv.id, inv.ncf, inv.order_id, inv.order.customer_po if inv.order else None,
+                      inv.date, inv.note, inv.total, balance)
+        for inv, balance in invoices
+    ]
+    aging, totals, overdue = client_aging(current_company_id(), client.id, now)
     overdue_pct = (overdue / totals * 100) if totals else 0
     if request.args.get('pdf') == '1':
-        company = {
-            'name': g.company.name,
-            'street': g.company.street,
-            'phone': g.company.phone,
-            'rnc': g.company.rnc,
-            'logo': g.company.logo,
-        }
-        client_dict = {
-            'name': client.name,
-            'identifier': client.identifier,
-            'street': client.street,
-            'sector': client.sector,
-            'province': client.province,
-            'phone': client.phone,
-            'email': client.email,
-        }
-        pdf_path = generate_account_statement_pdf(company, client_dict, rows, totals, aging, overdue_pct)
-        return send_file(pdf_path, as_attachment=True, download_name=f'estado_cuenta_{client.id}.pdf')
+        # Rendered to a private temporary file, never under the static folder.
+        pdf_path = generate_account_statement_pdf(
+            company_dict(g.company), client_dict(client), rows, totals, aging, overdue_pct, date=now,
+        )
+        try:
+            with open(pdf_path, 'rb') as f:
+                mem = BytesIO(f.read())
+        finally:
+            os.remove(pdf_path)
+        return send_file(mem, mimetype='application/pdf', as_attachment=True,
+                         download_name=f'estado_cuenta_{client.id}.pdf')
     return render_template('estado_cuenta_detalle.html', client=client, rows=rows, total=totals, aging=aging, overdue_pct=overdue_pct)
 
 
+@app.post('/reportes/estado-cuentas/lote')
+def account_statement_batch():
+    """Queue statements for every client with an open balance."""
+    if session.get('role') not in PAYMENT_ROLES:
+        flash('Acceso restringido')
+        return redirect(url_for('account_statement_clients'))
+    email = request.form.get('email') == '1'
+    user = session.get('full_name') or session.get('username')
+    entry_id = log_export(user, 'zip', 'estados_cuenta', {'email': email}, 'queued')
+    enqueue_export(_statement_batch_job, current_company_id(), entry_id, email)
+    flash('Estados de cuenta en proceso, revise el historial en unos minutos')
+    return redirect(url_for('export_history'))
+
+
+def run_statement_batch(company_id, entry_id, email):
+    """Generate a statement batch and record its summary in ``ExportLog`` ``entry_id``."""
+    try:
+        result = generate_statements(
+            company_id, app.config.get('EXPORT_FOLDER', 'maint'), f'estados_cuenta_{entry_id}',
+            workers=app.config.get('STATEMENT_WORKERS', STATEMENT_WORKERS),
+            send=send_email if email else None,
+        )
+        entry = db.session.get(ExportLog, entry_id)
+        entry.status = 'success'
+        entry.message = (
+            f"{result['clients']} estados de cuenta por {result['balance']:,.2f}, "
+            f"{result['emailed']} enviados por correo"
+        )
+        if result['failed']:
+            entry.message += f", {len(result['failed'])} con error"
+        entry.file_path = result['path']
+        db.session.commit()
+        return result
+    except Exception as exc:
+        db.session.rollback()
+        entry = db.session.get(ExportLog, entry_id)
+        entry.status = 'fail'
+        entry.message = str(exc)
+        db.session.commit()
+        raise
+
+
+def _statement_batch_job(app_obj, company_id, entry_id, email):  # pragma: no cover - background
+    """Background task rendering a statement batch."""
+    with app_obj.app_context():
+        try:
+            run_statement_batch(company_id, entry_id, email)
+        except Exception:
+            app_obj.logger.exception('statement batch %s failed', entry_id)
+        finally:
+            db.session.remove()
+
+
 @app.route('/reportes/export')
 def export_reportes():
     role = session.get('role')
@@ -2545,12 +3017,158 @@ def export_reportes():
     return redirect(url_for('reportes'))
 
 
+def _parse_as_of(fecha):
+    """Return the last instant of ``fecha`` (YYYY-MM-DD) or ``None``."""
+    try:
+        day = datetime.strptime(fecha or '', '%Y-%m-%d')
+    except ValueError:
+        return None
+    return day.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+def _stock_as_of_rows(at, warehouse_id=None):
+    """Return as-of stock rows with product and warehouse details."""
+    levels = stock_as_of(current_company_id(), at, warehouse_id)
+    product_ids = {pid for _wid, pid in levels}
+    products = {
+        p.id: p
+        for p in company_query(Product)
+        .options(load_only(Product.id, Product.code, Product.name, Product.price))
+        .filter(Product.id.in_(product_ids))
+    }
+    warehouses = {w.id: w.name for w in company_query(Warehouse)}
+    rows = []
+    for (wid, pid), stock in levels.items():
+        product = products.get(pid)
+        if not product:
+            continue
+        rows.append({
+            'product_id': pid,
+            'code': product.code,
+            'name': product.name,
+            'warehouse_id': wid,
+            'warehouse': warehouses.get(wid, ''),
+            'stock': stock,
+            'price': product.price,
+            'value': stock * (product.price or 0),
+        })
+    rows.sort(key=lambda r: (r['name'], r['warehouse']))
+    return rows
+
+
+@app.get('/api/inventario/existencias')
+def api_stock_as_of():
+    """Return stock levels as of the end of ``fecha`` (YYYY-MM-DD)."""
+    at = _parse_as_of(request.args.get('fecha'))
+    if not at:
+        return {'error': 'Fecha inválida, use AAAA-MM-DD'}, 400
+    wid = request.args.get('warehouse_id', type=int)
+    rows = _stock_as_of_rows(at, wid)
+    return jsonify({
+        'fecha': at.strftime('%Y-%m-%d'),
+        'items': rows,
+        'total_value': sum(r['value'] for r in rows),
+    })
+
+
+@app.get('/api/inventario/movimientos')
+def api_movement_history():
+    """Movement history including archived movements, newest first."""
+    start = end = None
+    if request.args.get('desde'):
+        start = _parse_as_of(request.args['desde'])
+        if not start:
+            return {'error': 'Fecha inválida, use AAAA-MM-DD'}, 400
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if request.args.get('hasta'):
+        end = _parse_as_of(request.args['hasta'])
+        if not end:
+            return {'error': 'Fecha inválida, use AAAA-MM-DD'}, 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    stmt = movement_history(
+        current_company_id(),
+        warehouse_id=request.args.get('warehouse_id', type=int),
+        product_id=request.args.get('product_id', type=int),
+        start=start,
+        end=end,
+    )
+    rows = db.session.execute(stmt.limit(per_page).offset((page - 1) * per_page)).all()
+    return jsonify({
+        'page': page,
+        'per_page': per_page,
+        'items': [
+            {
+                'id': r.id,
+                'product_id': r.product_id,
+                'warehouse_id': r.warehouse_id,
+                'movement_type': r.movement_type,
+                'quantity': r.quantity,
+                'delta': r.delta,
+                'reference_type': r.reference_type,
+                'reference_id': r.reference_id,
+                'timestamp': r.timestamp.isoformat() if r.timestamp else None,
+                'archived': bool(r.archived),
+            }
+            for r in rows
+        ],
+    })
+
+
+@app.get('/api/inventario/valoracion')
+def api_inventory_valuation():
+    """Inventory value per warehouse at weighted-average cost."""
+    stock = func.coalesce(ProductStock.stock, 0)
+    rows = (
+        db.session.query(
+            Warehouse.id,
+            Warehouse.name,
+            func.coalesce(func.sum(stock), 0),
+            func.coalesce(func.sum(stock * func.coalesce(ProductStock.avg_cost, 0)), 0),
+        )
+        .join(ProductStock, ProductStock.warehouse_id == Warehouse.id)
+        .filter(ProductStock.company_id == current_company_id())
+        .group_by(Warehouse.id, Warehouse.name)
+        .order_by(Warehouse.name)
+        .all()
+    )
+    warehouses = [
+        {'id': wid, 'name': name, 'units': int(units), 'value': round(float(value), 2)}
+        for wid, name, units, value in rows
+    ]
+    return jsonify({
+        'warehouses': warehouses,
+        'total_value': round(sum(w['value'] for w in warehouses), 2),
+    })
+
+
 @app.route('/reportes/inventario/export')
 def export_inventory():
     role = session.get('role')
     if role not in ('admin', 'manager', 'contabilidad'):
         return '', 403
     company_id = current_company_id()
+    fecha = request.args.get('fecha')
+    if fecha:
+        at = _parse_as_of(fecha)
+        if not at:
+            return {'error': 'Fecha inválida, use AAAA-MM-DD'}, 400
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow([f"Existencias al {at.strftime('%Y-%m-%d')}"])
+        writer.writerow(['Código', 'Producto', 'Almacén', 'Stock', 'Precio', 'Valor'])
+        total = 0
+        for r in _stock_as_of_rows(at):
+            writer.writerow([r['code'] or '', r['name'] or '', r['warehouse'] or '', r['stock'],
+                             f"{r['price'] or 0:.2f}", f"{r['value']:.2f}"])
+            total += r['value']
+        writer.writerow(['', '', '', '', 'Total', f"{total:.2f}"])
+        mem = BytesIO()
+        mem.write(output.getvalue().encode('utf-8'))
+        mem.seek(0)
+        return send_file(mem, mimetype='text/csv', as_attachment=True,
+                         download_name=f"inventario_{at.strftime('%Y%m%d')}.csv")
+    cost = func.coalesce(ProductStock.avg_cost, 0)
     rows = (
         db.session.query(
             Product.code,
@@ -2558,6 +3176,8 @@ def export_inventory():
             Warehouse.name,
             ProductStock.stock,
             ProductStock.min_stock,
+            cost,
+            (func.coalesce(ProductStock.stock, 0) * cost).label('value'),
         )
         .join(ProductStock, Product.id == ProductStock.product_id)
         .join(Warehouse, ProductStock.warehouse_id == Warehouse.id)
@@ -2567,9 +3187,13 @@ def export_inventory():
     )
     output = StringIO()
     writer = csv.writer(output)
-    writer.writerow(['Código', 'Producto', 'Almacén', 'Stock', 'Mínimo'])
-    for code, name, wh, stock, min_stock in rows:
-        writer.writerow([code or '', name or '', wh or '', stock, min_stock])
+    writer.writerow(['Código', 'Producto', 'Almacén', 'Stock', 'Mínimo', 'Costo promedio', 'Valor'])
+    total = 0
+    for code, name, wh, stock, min_stock, avg_cost, value in rows:
+        writer.writerow([code or '', name or '', wh or '', stock, min_stock,
+                         f"{avg_cost:.2f}", f"{value:.2f}"])
+        total += value
+    writer.writerow(['', '', '', '', '', 'Total', f"{total:.2f}"])
     mem = BytesIO()
     mem.write(output.getvalue().encode('utf-8'))
     mem.seek(0)
@@ -2651,8 +3275,166 @@ def contab_dgii():
 
 @app.route('/api/recommendations')
 def api_recommendations():
-    """Return top product recommendations based on past orders."""
-    return jsonify({'products': recommend_products()})
+    """Return the tenant's best sellers, or with ``?product=`` the products
+    most often ordered together with the given ones."""
+    products = request.args.getlist('product')
+    if products:
+        return jsonify({'products': frequently_bought_together(current_company_id(), products)})
+    return jsonify({'products': recommend_products(current_company_id())})
+
+
+@app.post('/api/recommendations/refresh')
+def api_refresh_recommendations():
+    """Rescore the company's popularity cache from its whole order history."""
+    if session.get('role') not in ('admin', 'manager'):
+        return {'error': 'Acceso restringido'}, 403
+    scored = refresh_popularity(current_company_id(), force=True)
+    db.session.commit()
+    return jsonify({'scored': scored, 'products': recommend_products(current_company_id())})
+
+
+@app.route('/api/cotizaciones/<int:quotation_id>/recomendaciones')
+def api_quotation_recommendations(quotation_id):
+    """Products frequently bought together with those on a quotation."""
+    quotation = company_get(Quotation, quotation_id)
+    names = [item.product_name for item in quotation.items]
+    return jsonify({'products': frequently_bought_together(current_company_id(), names)})
+
+@app.cli.command('inventory-snapshot')
+@click.option('--period', type=click.Choice(PERIODS), default=None,
+              help='Skip companies that already have a snapshot in this period.')
+@click.option('--company', 'company_id', type=int, default=None)
+def inventory_snapshot_command(period, company_id):
+    """Store current stock levels for as-of inventory queries."""
+    count = take_snapshots(company_id, period)
+    click.echo(f'{count} existencias guardadas')
+
+
+@app.cli.command('inventory-archive')
+@click.option('--months', type=int, default=ARCHIVE_MONTHS, show_default=True,
+              help='Keep this many months of movements in the live table.')
+@click.option('--company', 'company_id', type=int, default=None)
+def inventory_archive_command(months, company_id):
+    """Move old inventory movements to the archive table."""
+    count = archive_movements(months, company_id)
+    click.echo(f'{count} movimientos archivados')
+
+
+@app.cli.command('inventory-reorder')
+@click.option('--company', 'company_id', type=int, default=None)
+@click.option('--lookback', type=int, default=None, help='Days of demand history to read.')
+@click.option('--lead-time', type=int, default=None, help='Replenishment lead time in days.')
+def inventory_reorder_command(company_id, lookback, lead_time):
+    """Recompute demand-based reorder points for the whole catalogue."""
+    count = compute_reorder_points(
+        company_id,
+        lookback_days=lookback or app.config.get('REORDER_LOOKBACK_DAYS'),
+        lead_time=lead_time or app.config.get('REORDER_LEAD_TIME_DAYS'),
+        cover_days=app.config.get('REORDER_COVER_DAYS'),
+    )
+    click.echo(f'{count} puntos de reorden calculados')
+
+
+@app.cli.command('balances-reconcile')
+@click.option('--company', 'company_id', type=int, default=None)
+@click.option('--check', is_flag=True, help='Only report drift, do not repair it.')
+def balances_reconcile_command(company_id, check):
+    """Verify stored invoice and client balances against payments."""
+    invoices, clients = reconcile_balances(company_id, repair=not check)
+    db.session.commit()
+    verb = 'con diferencias' if check else 'corregidos'
+    click.echo(f'{invoices} saldos de factura y {clients} saldos de cliente {verb}')
+
+
+@app.cli.command('recommendations-rebuild')
+@click.option('--company', 'company_id', type=int, default=None)
+def recommendations_rebuild_command(company_id):
+    """Recompute product popularity and co-occurrence from all orders."""
+    products, pairs = rebuild_recommendations(company_id)
+    db.session.commit()
+    click.echo(f'{products} productos y {pairs} pares recalculados')
+
+
+@app.cli.command('recommendations-refresh')
+@click.option('--company', 'company_id', type=int, default=None)
+@click.option('--force', is_flag=True, help='Rescore the whole order history.')
+def recommendations_refresh_command(company_id, force):
+    """Update the time-decayed popularity cache with new orders."""
+    scored = refresh_popularity(company_id, force=force)
+    db.session.commit()
+    click.echo(f'{scored} líneas de pedido puntuadas')
+
+
+@app.cli.command('statements')
+@click.option('--company', 'company_id', type=int, required=True)
+@click.option('--email', is_flag=True, help='Email each statement to its client.')
+@click.option('--workers', type=int, default=None, help='Rendering processes.')
+def statements_command(company_id, email, workers):
+    """Generate account statements for every client with an open balance."""
+    if workers:
+        app.config['STATEMENT_WORKERS'] = workers
+    entry = ExportLog(user='cli', company_id=company_id, formato='zip', tipo='estados_cuenta',
+                      filtros=json.dumps({'email': email}), status='queued')
+    db.session.add(entry)
+    db.session.commit()
+    result = run_statement_batch(company_id, entry.id, email)
+    click.echo(f"{result['clients']} estados de cuenta en {result['path']}, {result['emailed']} enviados")
+
+
+@app.cli.group('maintenance')
+def maintenance_cli():
+    """Periodic maintenance jobs."""
+
+
+@maintenance_cli.command('run')
+@click.option('--job', 'names', multiple=True, type=click.Choice(list(JOBS)),
+              help='Run only these jobs, even if not due.')
+def maintenance_run_command(names):
+    """Run due jobs once (or the given jobs unconditionally)."""
+    if names:
+        ran = [run_job(name).name for name in names]
+    else:
+        ran = run_due()
+    for name in ran:
+        job = db.session.get(MaintenanceJob, name)
+        click.echo(f'{name}: {job.last_status} en {job.last_duration:.3f}s - {job.last_message}')
+    if not ran:
+        click.echo('No hay tareas pendientes')
+
+
+@maintenance_cli.command('worker')
+@click.option('--tick', type=int, default=None, help='Seconds between checks.')
+def maintenance_worker_command(tick):
+    """Run due jobs forever; use instead of the in-process scheduler."""
+    start_scheduler(app, tick).wait()
+
+
+@app.cli.group('mail')
+def mail_cli():
+    """Outbound email queue."""
+
+
+@mail_cli.command('send')
+def mail_send_command():
+    """Deliver every due message in the outbox once."""
+    sent, failed = drain()
+    click.echo(f'{sent} correos enviados, {failed} con error')
+
+
+@mail_cli.command('worker')
+@click.option('--tick', type=int, default=None, help='Seconds between passes.')
+def mail_worker_command(tick):
+    """Deliver queued email forever; use instead of the in-process sender."""
+    start_sender(app, tick).wait()
+
+
+if os.environ.get('MAIL_SENDER') == '1':  # pragma: no cover - opt-in background thread
+    start_sender(app)
+
+
+if os.environ.get('MAINTENANCE_SCHEDULER') == '1':  # pragma: no cover - opt-in background thread
+    start_scheduler(app)
+
 
 if __name__ == '__main__':
     with app.app_context():
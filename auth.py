@@ -48,6 +48,7 @@ def reset_request():
             from app import send_email
             html = render_template('emails/password_reset.html', reset_url=reset_url)
             send_email(email, 'Restablecer contraseña', html)
+            db.session.commit()
         flash('Si el correo existe, se enviará un enlace de restablecimiento', 'login')
         return redirect(url_for('auth.login'))
     return render_template('reset_request.html', form=form)
@@ -0,0 +1,241 @@
+"""Stored receivable balances.
+
+``Invoice.balance_due`` (total minus payments) and ``Client.outstanding``
+(sum of the client's balances due) are kept up to date by mapper events, in
+the same flush, and so in the same transaction, as the payment or invoice
+change that moves them.  The events issue relative ``UPDATE`` statements
+(``balance_due = balance_due - :amount``) rather than writing values read
+into Python, so concurrent payments on one client never overwrite each
+other.  An invoice whose balance reaches zero is marked ``Pagada``.
+
+Writes that bypass the ORM (Core ``insert``/``update``) must adjust both
+columns themselves, e.g. with :func:`apply_payment_totals`.
+:func:`reconcile_balances` recomputes every stored balance in bulk and
+repairs any drift; it runs as a maintenance job.
+"""
+from __future__ import annotations
+
+from sqlalchemy import and_, bindparam, case, event, exists, func, select, update
+from sqlalchemy.orm import Session, attributes, object_session
+from sqlalchemy.orm.util import identity_key
+
+from models import db, Client, Invoice, Payment
+from receivables import EPSILON
+
+_invoices = Invoice.__table__
+_clients = Client.__table__
+
+
+def _touch(target, *keys):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('balances_stale', set()).update(keys)
+
+
+def _client_of(invoice_id):
+    return select(_invoices.c.client_id).where(_invoices.c.id == invoice_id).scalar_subquery()
+
+
+def _apply_payment(connection, invoice_id, amount):
+    """Reduce the balance of ``invoice_id`` and its client by ``amount``."""
+    remaining = _invoices.c.balance_due - amount
+    connection.execute(
+        update(_invoices)
+        .where(_invoices.c.id == invoice_id)
+        .values(
+            balance_due=remaining,
+            status=case((remaining <= EPSILON, 'Pagada'), else_='Pendiente'),
+        )
+    )
+    connection.execute(
+        update(_clients)
+        .where(_clients.c.id == _client_of(invoice_id))
+        .values(outstanding=_clients.c.outstanding - amount)
+    )
+
+
+def _adjust_client(connection, client_id, amount):
+    connection.execute(
+        update(_clients)
+        .where(_clients.c.id == client_id)
+        .values(outstanding=_clients.c.outstanding + amount)
+    )
+
+
+@event.listens_for(Payment, 'after_insert')
+def _payment_inserted(mapper, connection, target):
+    _apply_payment(connection, target.invoice_id, target.amount or 0)
+    _touch(target, ('invoice', target.invoice_id))
+
+
+@event.listens_for(Payment, 'after_delete')
+def _payment_deleted(mapper, connection, target):
+    _apply_payment(connection, target.invoice_id, -(target.amount or 0))
+    _touch(target, ('invoice', target.invoice_id))
+
+
+@event.listens_for(Payment, 'after_update')
+def _payment_updated(mapper, connection, target):
+    history = attributes.get_history(target, 'amount')
+    if history.deleted and history.added:
+        diff = (history.added[0] or 0) - (history.deleted[0] or 0)
+        _apply_payment(connection, target.invoice_id, diff)
+        _touch(target, ('invoice', target.invoice_id))
+
+
+@event.listens_for(Invoice, 'before_insert')
+def _invoice_inserting(mapper, connection, target):
+    if target.balance_due is None:
+        target.balance_due = target.total
+
+
+@event.listens_for(Invoice, 'after_insert')
+def _invoice_inserted(mapper, connection, target):
+    _adjust_client(connection, target.client_id, target.balance_due or 0)
+    _touch(target, ('client', target.client_id))
+
+
+@event.listens_for(Invoice, 'before_delete')
+def _invoice_deleting(mapper, connection, target):
+    # Payments cascade-delete first, so the stored balance is back to the total.
+    balance = select(_invoices.c.balance_due).where(_invoices.c.id == target.id).scalar_subquery()
+    connection.execute(
+        update(_clients)
+        .where(_clients.c.id == target.client_id)
+        .values(outstanding=_clients.c.outstanding - func.coalesce(balance, 0))
+    )
+    _touch(target, ('client', target.client_id))
+
+
+@event.listens_for(Invoice, 'after_update')
+def _invoice_updated(mapper, connection, target):
+    total = attributes.get_history(target, 'total')
+    if total.deleted and total.added:
+        diff = (total.added[0] or 0) - (total.deleted[0] or 0)
+        connection.execute(
+            update(_invoices)
+            .where(_invoices.c.id == target.id)
+            .values(balance_due=_invoices.c.balance_due + diff)
+        )
+        _adjust_client(connection, target.client_id, diff)
+        _touch(target, ('invoice', target.id), ('client', target.client_id))
+    moved = attributes.get_history(target, 'client_id')
+    if moved.deleted and moved.added:
+        balance = select(_invoices.c.balance_due).where(_invoices.c.id == target.id).scalar_subquery()
+        _adjust_client(connection, moved.deleted[0], -balance)
+        _adjust_client(connection, moved.added[0], balance)
+        _touch(target, ('client', moved.deleted[0]), ('client', moved.added[0]))
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale(session, flush_context):
+    """Expire in-memory copies of balances changed by SQL during the flush."""
+    for kind, pk in session.info.pop('balances_stale', ()):
+        model, attrs = (Invoice, ['balance_due', 'status']) if kind == 'invoice' else (Client, ['outstanding'])
+        obj = session.identity_map.get(identity_key(model, pk))
+        if obj is not None:
+            session.expire(obj, attrs)
+
+
+def apply_payment_totals(allocations):
+    """Apply Core-inserted ``(invoice_id, client_id, amount)`` payments.
+
+    Amounts are summed per invoice and per client and written with one
+    ``UPDATE`` per table.
+    """
+    per_invoice = {}
+    per_client = {}
+    for invoice_id, client_id, amount in allocations:
+        per_invoice[invoice_id] = per_invoice.get(invoice_id, 0) + amount
+        per_client[client_id] = per_client.get(client_id, 0) + amount
+    if not per_invoice:
+        return
+    remaining = _invoices.c.balance_due - bindparam('amount')
+    db.session.execute(
+        update(_invoices)
+        .where(_invoices.c.id == bindparam('invoice_id'))
+        .values(balance_due=remaining, status=case((remaining <= EPSILON, 'Pagada'), else_='Pendiente')),
+        [{'invoice_id': iid, 'amount': amount} for iid, amount in per_invoice.items()],
+    )
+    db.session.execute(
+        update(_clients)
+        .where(_clients.c.id == bindparam('client_id'))
+        .values(outstanding=_clients.c.outstanding - bindparam('amount')),
+        [{'client_id': cid, 'amount': amount} for cid, amount in per_client.items()],
+    )
+
+
+def _expected_invoice_balance():
+    paid = (
+        select(func.coalesce(func.sum(Payment.amount), 0))
+        .where(Payment.invoice_id == Invoice.id)
+        .scalar_subquery()
+    )
+    # Invoices marked paid before payments were recorded have no payment
+    # rows; they are settled, not owed in full.
+    legacy_paid = and_(Invoice.status == 'Pagada', ~exists().where(Payment.invoice_id == Invoice.id))
+    return case((legacy_paid, 0), else_=Invoice.total - paid)
+
+
+def _expected_client_outstanding():
+    return (
+        select(func.coalesce(func.sum(Invoice.balance_due), 0))
+        .where(Invoice.client_id == Client.id)
+        .scalar_subquery()
+    )
+
+
+def _drifted(column, expected):
+    return func.abs(func.coalesce(column, 0) - expected) > EPSILON
+
+
+def reconcile_balances(company_id=None, repair=True):
+    """Verify stored balances against payments; return ``(invoices, clients)`` drift counts.
+
+    With ``repair`` the drifted rows are rewritten with one ``UPDATE`` per
+    table (invoices first, so client totals are summed from corrected
+    balances).  Committing is left to the caller.
+    """
+    expected = _expected_invoice_balance()
+    inv_filter = [_drifted(Invoice.balance_due, expected)]
+    if company_id is not None:
+        inv_filter.append(Invoice.company_id == company_id)
+    if repair:
+        invoices = db.session.execute(
+            update(Invoice)
+            .where(*inv_filter)
+            .values(
+                balance_due=expected,
+                status=case((expected <= EPSILON, 'Pagada'), else_=Invoice.status),
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    else:
+        invoices = db.session.query(func.count(Invoice.id)).filter(*inv_filter).scalar()
+
+    outstanding = _expected_client_outstanding()
+    cli_filter = [_drifted(Client.outstanding, outstanding)]
+    if company_id is not None:
+        cli_filter.append(Client.company_id == company_id)
+    if repair:
+        clients = db.session.execute(
+            update(Client)
+            .where(*cli_filter)
+            .values(outstanding=outstanding)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.expire_all()
+    else:
+        clients = db.session.query(func.count(Client.id)).filter(*cli_filter).scalar()
+    return invoices, clients
+
+
+def top_debtors(company_id, limit=10):
+    """Clients with the largest outstanding totals, read from the stored column."""
+    return (
+        Client.query
+        .filter(Client.company_id == company_id, Client.outstanding > EPSILON)
+        .order_by(Client.outstanding.desc())
+        .limit(limit)
+        .all()
+    )
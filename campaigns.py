@@ -0,0 +1,177 @@
+"""Bulk quotation email campaigns.
+
+A campaign resends a set of quotations, given by id or by filters, to their
+clients.  :func:`run_campaign` loads the quotations with their clients and
+items in two queries, renders the PDFs in a process pool (WeasyPrint is CPU
+bound) and queues one message per quotation in the email outbox, from
+where :mod:`mailer` delivers them in batches over pooled SMTP connections.
+Each ``QuotationCampaignItem`` points at its outbox message, so the
+per-recipient outcome is simply the message's delivery status.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from flask import render_template
+from sqlalchemy.orm import joinedload, selectinload
+
+from mailer import drain, enqueue_email, get_pool
+from models import db, dom_now, Quotation, QuotationCampaign, QuotationCampaignItem
+from weasy_pdf import _client_to_dict, _item_to_dict, generate_pdf
+
+QUOTATION_FOOTER = (
+    "Condiciones: Esta cotización es válida por 30 días a partir de la fecha de emisión. "
+    "Los precios están sujetos a cambios sin previo aviso. "
+    "El ITBIS ha sido calculado conforme a la ley vigente."
+)
+CAMPAIGN_WORKERS = 4
+MAX_CAMPAIGN_QUOTATIONS = 500
+
+
+def campaign_quotations(company_id, ids=None, status=None, date_from=None, date_to=None, now=None):
+    """Query of the quotations selected by explicit ``ids`` or by filters.
+
+    ``status='vigente'`` excludes quotations past ``valid_until`` even when
+    the maintenance job has not marked them ``vencida`` yet.
+    """
+    query = Quotation.query.filter(Quotation.company_id == company_id)
+    if ids:
+        return query.filter(Quotation.id.in_(ids))
+    if status == 'vigente':
+        query = query.filter(Quotation.status == 'vigente', Quotation.valid_until >= (now or dom_now()))
+    elif status:
+        query = query.filter(Quotation.status == status)
+    if date_from:
+        query = query.filter(Quotation.date >= date_from)
+    if date_to:
+        query = query.filter(Quotation.date < date_to + timedelta(days=1))
+    return query
+
+
+def create_campaign(company_id, user_id, quotation_ids):
+    """Store a queued campaign for ``quotation_ids``; committing is left to the caller."""
+    campaign = QuotationCampaign(company_id=company_id, created_by=user_id, status='queued')
+    campaign.items = [QuotationCampaignItem(quotation_id=qid) for qid in quotation_ids]
+    db.session.add(campaign)
+    return campaign
+
+
+def _pdf_job(company, quotation, path):
+    args = (
+        'Cotización', company, _client_to_dict(quotation.client),
+        [_item_to_dict(i) for i in quotation.items],
+        quotation.subtotal, quotation.itbis, quotation.total,
+    )
+    kwargs = {
+        'seller': quotation.seller, 'payment_method': quotation.payment_method,
+        'bank': quotation.bank, 'doc_number': quotation.id, 'note': quotation.note,
+        'output_path': path, 'date': quotation.date, 'valid_until': quotation.valid_until,
+        'footer': QUOTATION_FOOTER,
+    }
+    return args, kwargs
+
+
+def _render(job):
+    args, kwargs = job
+    try:
+        return generate_pdf(*args, **kwargs), None
+    except Exception as exc:  # reported per recipient
+        return None, str(exc)[:255]
+
+
+def render_pdfs(jobs, workers=None):
+    """Render ``(args, kwargs)`` jobs, in a process pool when ``workers > 1``.
+
+    Returns ``(path, error)`` pairs in the order of ``jobs``.
+    """
+    workers = CAMPAIGN_WORKERS if workers is None else workers
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_render, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    return [_render(job) for job in jobs]
+
+
+def run_campaign(campaign_id, company, workers=None):
+    """Render and queue every message of a campaign; return the campaign.
+
+    ``company`` is the dict used for PDF headers.  Quotations whose client
+    has no email, or whose PDF fails to render, get an ``error`` instead of
+    a message.  The queued messages are delivered right away over the
+    pooled SMTP connections; failures are retried by the regular sender.
+    """
+    campaign = db.session.get(QuotationCampaign, campaign_id)
+    campaign.status = 'running'
+    db.session.commit()
+    quotations = {
+        q.id: q
+        for q in Quotation.query.options(joinedload(Quotation.client), selectinload(Quotation.items))
+        .filter(
+            Quotation.company_id == campaign.company_id,
+            Quotation.id.in_([item.quotation_id for item in campaign.items]),
+        )
+    }
+    pending = []
+    for item in campaign.items:
+        quotation = quotations.get(item.quotation_id)
+        if quotation is None:
+            item.error = 'Cotización no encontrada'
+        elif not quotation.client.email:
+            item.error = 'El cliente no tiene correo registrado'
+        else:
+            item.recipient = quotation.client.email
+            pending.append((item, quotation))
+
+    workdir = tempfile.mkdtemp(prefix=f'campana_{campaign_id}_')
+    try:
+        jobs = [
+            _pdf_job(company, q, os.path.join(workdir, f'cotizacion_{q.id}.pdf')) for _item, q in pending
+        ]
+        for (item, quotation), (path, error) in zip(pending, render_pdfs(jobs, workers)):
+            if error:
+                item.error = error
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            html = render_template('emails/quotation.html', client=quotation.client,
+                                   company=company, quotation=quotation)
+            item.email = enqueue_email(item.recipient, 'Cotización', html,
+                                       attachments=[(os.path.basename(path), data)])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    queued = sum(1 for item in campaign.items if item.email is not None)
+    campaign.status = 'done'
+    campaign.finished_at = dom_now()
+    campaign.message = f'{queued} de {len(campaign.items)} cotizaciones en cola de envío'
+    db.session.commit()
+    if queued and get_pool() is not None:
+        drain()
+    return campaign
+
+
+def campaign_report(campaign):
+    """Campaign state with the delivery outcome of every recipient."""
+    items = []
+    counts = {}
+    for item in sorted(campaign.items, key=lambda i: i.id):
+        if item.error:
+            status, error = 'error', item.error
+        elif item.email is None:
+            status, error = 'queued', None
+        else:
+            status, error = item.email.status, item.email.last_error
+        counts[status] = counts.get(status, 0) + 1
+        items.append({'quotation_id': item.quotation_id, 'recipient': item.recipient,
+                      'status': status, 'error': error})
+    return {
+        'id': campaign.id,
+        'status': campaign.status,
+        'message': campaign.message,
+        'created_at': campaign.created_at.isoformat() if campaign.created_at else None,
+        'finished_at': campaign.finished_at.isoformat() if campaign.finished_at else None,
+        'counts': counts,
+        'items': items,
+    }
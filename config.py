@@ -1,6 +1,16 @@
 import os
 import warnings
 
+try:
+    from dotenv import load_dotenv
+except ModuleNotFoundError:  # pragma: no cover
+    def load_dotenv(*args, **kwargs):
+        pass
+
+# The settings below are read from the environment when this module is
+# imported, so ``.env`` has to be loaded first.
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
 
 class BaseConfig:
     """Base configuration with safe defaults.
@@ -19,6 +29,21 @@ class BaseConfig:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Per-request SQL statistics (see query_stats.py)
+    SQL_STATS_HEADERS = os.environ.get('SQL_STATS_HEADERS') == '1'
+    SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 50))
+
+    # /metrics (see metrics.py); scrapers send ``Authorization: Bearer <token>``
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_RETENTION = int(os.environ.get('METRICS_RETENTION', 7 * 24 * 3600))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    MAIL_SERVER = os.environ.get('MAIL_SERVER')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
+
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///database.sqlite'
 
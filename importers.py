@@ -0,0 +1,271 @@
+"""Chunked CSV importers.
+
+Uploads are parsed as a stream and processed ``CHUNK_SIZE`` rows at a time:
+each chunk resolves the codes it mentions with a single query and writes its
+changes with bulk statements, so memory use and query count stay flat no
+matter how large the file is.
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+
+from sqlalchemy import bindparam, func, insert, update
+
+from models import db, dialect_insert, CATEGORIES, Product, ProductStock, InventoryMovement
+from references import allocate_references, reference_prefix
+
+CHUNK_SIZE = 1000
+TRUE_VALUES = ('1', 'true', 'si', 'sí', 'yes')
+
+_product = Product.__table__
+
+# ``Product.stock`` is the total over every warehouse; an import only moves
+# one warehouse's share of it.
+_shift_product = (
+    update(_product)
+    .where(_product.c.id == bindparam('p'))
+    .values(stock=func.coalesce(_product.c.stock, 0) + bindparam('delta'))
+)
+
+
+def csv_rows(stream):
+    """Return a ``DictReader`` decoding ``stream`` lazily as UTF-8."""
+    return csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+
+
+def iter_chunks(reader, size=None):
+    """Yield lists of ``(line_number, row)`` pairs of at most ``size`` rows."""
+    size = size or CHUNK_SIZE
+    chunk = []
+    for line, row in enumerate(reader, start=2):
+        chunk.append((line, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_products(company_id, reader, chunk_size=None, progress=None):
+    """Create or update products for ``company_id`` from CSV ``reader`` rows.
+
+    Each chunk is committed on its own; rows that cannot be imported are
+    skipped and reported as ``(line, message)`` tuples.  ``progress`` is
+    called with the number of rows processed after every chunk.
+    """
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    processed = 0
+    for chunk in iter_chunks(reader, chunk_size):
+        codes = {(row.get('code') or '').strip() for _line, row in chunk} - {''}
+        existing = {}
+        if codes:
+            existing = {
+                p.code: p
+                for p in db.session.query(
+                    Product.id, Product.code, Product.company_id, Product.name,
+                    Product.unit, Product.price, Product.reference,
+                ).filter(Product.code.in_(codes))
+            }
+        inserts = {}
+        updates = {}
+        for line, row in chunk:
+            code = (row.get('code') or '').strip()
+            if not code:
+                continue
+            current = existing.get(code)
+            if current is not None and current.company_id != company_id:
+                result['errors'].append((line, f'El código {code} pertenece a otra empresa'))
+                continue
+            values = inserts.get(code) or updates.get(code)
+            if values is None:
+                if current is not None:
+                    values = {
+                        'id': current.id,
+                        'name': current.name,
+                        'unit': current.unit,
+                        'price': current.price,
+                        'reference': current.reference,
+                    }
+                else:
+                    values = {'code': code, 'company_id': company_id, 'name': None,
+                              'unit': None, 'price': None, 'reference': None, 'category': None}
+            values = dict(values)
+            values['name'] = (row.get('name') or '').strip() or values['name']
+            values['unit'] = (row.get('unit') or '').strip() or values['unit']
+            try:
+                price = float(row.get('price') or 0)
+            except ValueError:
+                price = 0.0
+            values['price'] = price or values['price']
+            cat = row.get('category')
+            if cat in CATEGORIES:
+                values['category'] = cat
+            values['has_itbis'] = (row.get('has_itbis') or '').strip().lower() in TRUE_VALUES
+            if current is None:
+                missing = [label for key, label in (('name', 'nombre'), ('unit', 'unidad'), ('price', 'precio'))
+                           if not values[key]]
+                if missing:
+                    result['errors'].append((line, f"Faltan datos para {code}: {', '.join(missing)}"))
+                    continue
+                inserts[code] = values
+            else:
+                updates[code] = values
+        pending = {}
+        for values in (*inserts.values(), *updates.values()):
+            if not values['reference']:
+                pending.setdefault(reference_prefix(values['name']), []).append(values)
+        for prefix, group in pending.items():
+            for values, ref in zip(group, allocate_references(company_id, prefix, len(group))):
+                values['reference'] = ref
+        if inserts:
+            db.session.execute(insert(Product), list(inserts.values()))
+        if updates:
+            db.session.execute(update(Product), list(updates.values()))
+        db.session.commit()
+        result['created'] += len(inserts)
+        result['updated'] += len(updates)
+        processed += len(chunk)
+        if progress:
+            progress(processed)
+    return result
+
+
+def upsert_stock(company_id, warehouse_id, rows):
+    """Set ``ProductStock`` levels for ``rows`` of ``(product_id, stock, min_stock, cost)``.
+
+    Existing rows are updated through ``ON CONFLICT`` on ``uix_product_wh``;
+    ``min_stock`` and ``avg_cost`` are only overwritten when provided.
+    """
+    batches = {}
+    for product_id, stock, min_stock, cost in rows:
+        values = {'product_id': product_id, 'warehouse_id': warehouse_id,
+                  'stock': stock, 'company_id': company_id}
+        if min_stock is not None:
+            values['min_stock'] = min_stock
+        if cost is not None:
+            values['avg_cost'] = cost
+        batches.setdefault(tuple(c for c in values if c not in (
+            'product_id', 'warehouse_id', 'company_id')), []).append(values)
+    for columns, batch in batches.items():
+        stmt = dialect_insert(ProductStock)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['product_id', 'warehouse_id'],
+            set_={c: getattr(stmt.excluded, c) for c in columns},
+        )
+        db.session.execute(stmt, batch)
+
+
+def import_inventory(company_id, warehouse_id, user_id, reader, chunk_size=None, progress=None):
+    """Load stock levels for ``warehouse_id`` from CSV ``reader`` rows.
+
+    Validation runs over the whole file first, resolving codes with one query
+    per chunk; if any row is invalid nothing is written.  Otherwise stock
+    levels are upserted and ``entrada`` movements bulk-inserted chunk by
+    chunk inside a single transaction.  ``progress`` receives
+    ``(phase, rows)`` after every chunk.
+    """
+    errors = []
+    valid = []
+    processed = 0
+    for chunk in iter_chunks(reader, chunk_size):
+        codes = {(row.get('code') or '').strip() for _line, row in chunk} - {''}
+        products = {}
+        if codes:
+            products = dict(
+                db.session.query(Product.code, Product.id)
+                .filter(Product.company_id == company_id, Product.code.in_(codes))
+            )
+        for line, row in chunk:
+            code = (row.get('code') or '').strip()
+            if not code:
+                errors.append((line, 'Código faltante'))
+                continue
+            product_id = products.get(code)
+            if product_id is None:
+                errors.append((line, f'Producto {code} no encontrado'))
+                continue
+            try:
+                stock_qty = int(row.get('stock'))
+            except (TypeError, ValueError):
+                errors.append((line, f'Stock inválido para {code}'))
+                continue
+            min_val = row.get('min_stock')
+            try:
+                min_stock = int(min_val) if min_val not in (None, '') else None
+            except ValueError:
+                errors.append((line, f'Min stock inválido para {code}'))
+                continue
+            cost_val = (row.get('cost') or '').strip()
+            try:
+                cost = float(cost_val) if cost_val else None
+            except ValueError:
+                cost = -1
+            if cost is not None and cost < 0:
+                errors.append((line, f'Costo inválido para {code}'))
+                continue
+            valid.append((product_id, stock_qty, min_stock, cost))
+        processed += len(chunk)
+        if progress:
+            progress('validate', processed)
+    if errors:
+        return {'imported': 0, 'errors': errors}
+
+    size = chunk_size or CHUNK_SIZE
+    written = 0
+    try:
+        for start in range(0, len(valid), size):
+            batch = valid[start:start + size]
+            latest = {row[0]: row for row in batch}
+            levels = dict(
+                db.session.query(ProductStock.product_id, ProductStock.stock)
+                .filter(ProductStock.warehouse_id == warehouse_id, ProductStock.product_id.in_(latest))
+            )
+            before = dict(levels)
+            movements = []
+            for pid, qty, _min, cost in batch:
+                movements.append({
+                    'product_id': pid,
+                    'quantity': qty,
+                    'movement_type': 'entrada',
+                    'reference_type': 'import',
+                    'delta': qty - (levels.get(pid) or 0),
+                    'unit_cost': cost,
+                    'warehouse_id': warehouse_id,
+                    'company_id': company_id,
+                    'executed_by': user_id,
+                })
+                levels[pid] = qty
+            upsert_stock(company_id, warehouse_id, latest.values())
+            shifts = [
+                {'p': pid, 'delta': qty - (before.get(pid) or 0)}
+                for pid, qty, _min, _cost in latest.values()
+                if qty != (before.get(pid) or 0)
+            ]
+            if shifts:
+                db.session.execute(_shift_product, shifts)
+            minimums = [
+                {'id': pid, 'min_stock': min_stock}
+                for pid, _qty, min_stock, _cost in latest.values()
+                if min_stock is not None
+            ]
+            if minimums:
+                db.session.execute(update(Product), minimums)
+            db.session.execute(insert(InventoryMovement), movements)
+            written += len(batch)
+            if progress:
+                progress('write', written)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'imported': len(valid), 'errors': []}
+
+
+def write_errors(path, errors):
+    """Store row-level import errors as a CSV report."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Línea', 'Error'])
+        writer.writerows(errors)
+    return path
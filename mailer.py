@@ -0,0 +1,275 @@
+"""Outbound email queue.
+
+``enqueue_email`` only stores the message in the ``OutboundEmail`` outbox,
+so requests never wait for SMTP.  :func:`send_pending` delivers due
+messages in batches: rows are claimed with a conditional ``UPDATE`` that
+stamps them with a token and a lease (like maintenance jobs, so several
+senders never deliver a message twice), then sent over connections borrowed
+from an :class:`SMTPPool`, which keeps them open across batches instead of
+doing STARTTLS and login for every message.  Failed messages are retried
+with exponential backoff and marked ``failed`` after ``MAX_ATTEMPTS``.
+
+The sender runs as a maintenance job, as a thread started with
+``MAIL_SENDER=1`` or as ``flask mail worker``.
+"""
+from __future__ import annotations
+
+import queue
+import smtplib
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import selectinload
+
+from models import db, dom_now, OutboundAttachment, OutboundEmail
+
+SEND_BATCH = 50  # messages claimed per pass
+MAX_ATTEMPTS = 5
+RETRY_BASE = 60  # seconds before the first retry, doubled after every failure
+RETRY_MAX = 3600
+LEASE_SECONDS = 600  # a claimed row is released again if its sender dies
+POOL_SIZE = 2
+MESSAGES_PER_CONNECTION = 100  # reconnect after this many messages
+SENDER_TICK = 5  # seconds between passes of the sender thread
+
+
+def enqueue_email(to, subject, html, attachments=None):
+    """Add a message to the outbox; committing is left to the caller."""
+    email = OutboundEmail(recipient=to, subject=subject, html=html, status='pending')
+    for filename, data in attachments or []:
+        email.attachments.append(OutboundAttachment(filename=filename, data=data))
+    db.session.add(email)
+    return email
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX))
+
+
+def build_message(sender, email):
+    msg = MIMEMultipart()
+    msg['Subject'] = email.subject
+    msg['From'] = sender
+    msg['To'] = email.recipient
+    msg.attach(MIMEText(email.html, 'html'))
+    for attachment in email.attachments:
+        part = MIMEApplication(attachment.data, Name=attachment.filename)
+        part['Content-Disposition'] = f'attachment; filename="{attachment.filename}"'
+        msg.attach(part)
+    return msg
+
+
+class SMTPPool:
+    """Reusable SMTP connections.
+
+    ``connection()`` lends an open connection, creating one when none is
+    idle.  An idle connection is checked with ``NOOP`` before it is lent,
+    since the server may have closed it while it waited; a connection that
+    fails the check is discarded.  Connections are dropped after a network
+    error or after
+    ``max_messages`` uses; SMTP reply errors (a refused recipient) leave
+    the connection usable and it goes back to the pool.
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=POOL_SIZE,
+                 max_messages=MESSAGES_PER_CONNECTION, timeout=30):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.connects = 0
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            smtp.starttls()
+            smtp.login(self.username, self.password)
+        self.connects += 1
+        return [smtp, 0]
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn[0].quit()
+        except (smtplib.SMTPException, OSError):
+            conn[0].close()
+
+    @staticmethod
+    def _alive(conn):
+        try:
+            return conn[0].noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._alive(conn):
+                return conn
+            conn[0].close()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn[0]
+        except smtplib.SMTPServerDisconnected:
+            conn[0].close()
+            raise
+        except smtplib.SMTPException:  # a reply error; the session is still usable
+            self._release(conn)
+            raise
+        except OSError:
+            conn[0].close()
+            raise
+        conn[1] += 1
+        self._release(conn)
+
+    def _release(self, conn):
+        if conn[1] >= self.max_messages:
+            self._close(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._close(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(config=None):
+    """Return the process-wide pool for the configured server, or ``None``."""
+    config = config or current_app.config
+    if not config.get('MAIL_SERVER'):
+        return None
+    key = (config['MAIL_SERVER'], config.get('MAIL_PORT', 587), config.get('MAIL_USERNAME'))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SMTPPool(
+                key[0], key[1], config.get('MAIL_USERNAME'), config.get('MAIL_PASSWORD'),
+                size=config.get('MAIL_POOL_SIZE', POOL_SIZE),
+            )
+    return pool
+
+
+def _due(now):
+    # 'sending' rows are only due again once their lease has expired.
+    return db.and_(OutboundEmail.status.in_(('pending', 'sending')), OutboundEmail.next_attempt_at <= now)
+
+
+def _claim(now, limit):
+    token = uuid.uuid4().hex
+    ids = select(OutboundEmail.id).where(_due(now)).order_by(OutboundEmail.id).limit(limit)
+    db.session.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id.in_(ids), _due(now))
+        .values(status='sending', claim=token, next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return (
+        OutboundEmail.query.options(selectinload(OutboundEmail.attachments))
+        .filter(OutboundEmail.claim == token)
+        .order_by(OutboundEmail.id)
+        .all()
+    )
+
+
+def send_pending(pool=None, now=None, limit=None):
+    """Deliver one batch of due messages; return ``(sent, failed)`` counts."""
+    pool = pool or get_pool()
+    if pool is None:
+        return 0, 0
+    now = now or dom_now()
+    sender = current_app.config.get('MAIL_DEFAULT_SENDER') or current_app.config.get('MAIL_USERNAME')
+    emails = _claim(now, limit or SEND_BATCH)
+    sent = failed = 0
+    for email in emails:
+        email.claim = None
+        message = build_message(sender, email).as_string()
+        try:
+            with pool.connection() as smtp:
+                smtp.sendmail(sender, [email.recipient], message)
+        except (smtplib.SMTPException, OSError) as exc:
+            email.attempts += 1
+            email.last_error = str(exc)[:255]
+            if email.attempts >= current_app.config.get('MAIL_MAX_ATTEMPTS', MAX_ATTEMPTS):
+                email.status = 'failed'
+                current_app.logger.error('Email %s to %s failed: %s', email.id, email.recipient, exc)
+            else:
+                email.status = 'pending'
+                email.next_attempt_at = now + retry_delay(email.attempts)
+            failed += 1
+            continue
+        email.status = 'sent'
+        email.sent_at = dom_now()
+        sent += 1
+    db.session.commit()
+    return sent, failed
+
+
+def drain(pool=None, now=None):
+    """Send batches until no due message is left; return ``(sent, failed)``."""
+    totals = [0, 0]
+    while True:
+        sent, failed = send_pending(pool, now)
+        totals[0] += sent
+        totals[1] += failed
+        if not sent and not failed:
+            return tuple(totals)
+
+
+def outbox_status():
+    """Message counts per status and the oldest pending message."""
+    counts = dict(
+        db.session.query(OutboundEmail.status, func.count(OutboundEmail.id)).group_by(OutboundEmail.status)
+    )
+    oldest = db.session.query(func.min(OutboundEmail.created_at)).filter(
+        OutboundEmail.status.in_(('pending', 'sending'))
+    ).scalar()
+    return {
+        'counts': {status: counts.get(status, 0) for status in ('pending', 'sending', 'sent', 'failed')},
+        'oldest_pending': oldest.isoformat() if oldest else None,
+    }
+
+
+def start_sender(app, tick=None):
+    """Run :func:`drain` every ``tick`` seconds in a daemon thread."""
+    tick = tick or app.config.get('MAIL_SENDER_TICK', SENDER_TICK)
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(tick):
+            with app.app_context():
+                try:
+                    drain()
+                except Exception:  # pragma: no cover - keep the thread alive
+                    db.session.rollback()
+                    app.logger.exception('email sender pass failed')
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=loop, name='mailer', daemon=True)
+    thread.start()
+    return stop
@@ -0,0 +1,271 @@
+"""Periodic maintenance jobs.
+
+Housekeeping that used to piggyback on page views (expiring quotations on
+every ``/cotizaciones`` GET, low-stock notifications on every render) runs
+here instead, so list pages stay read-only.  Each job in ``JOBS`` has an
+interval; :func:`run_due` runs the jobs whose interval has elapsed and
+records start, duration and outcome in ``MaintenanceJob``.
+
+A job is claimed with a conditional ``UPDATE`` on its row before it runs, so
+several processes (web workers with the in-process scheduler enabled, or a
+``flask maintenance`` worker) never run the same job twice in one interval.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import delete, exists, insert, literal, or_, select, update
+
+from ai import rebuild_recommendations, refresh_popularity
+from balances import reconcile_balances
+from mailer import drain
+from movement_archive import ARCHIVE_MONTHS, archive_movements
+from models import (
+    db,
+    dialect_insert,
+    dom_now,
+    ExportLog,
+    MaintenanceJob,
+    Notification,
+    Product,
+    ProductStock,
+    Quotation,
+)
+from reorder import compute_reorder_points
+from stock_history import take_snapshots
+
+NOTIFICATION_RETENTION_DAYS = 30
+EXPORT_RETENTION_DAYS = 7
+PDF_RETENTION_HOURS = 24
+SCHEDULER_TICK = 60  # seconds between checks of the in-process scheduler
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def expire_quotations(now):
+    result = db.session.execute(
+        update(Quotation)
+        .where(Quotation.status == 'vigente', Quotation.valid_until < now)
+        .values(status='vencida')
+    )
+    return f'{result.rowcount} cotizaciones vencidas'
+
+
+def notify_low_stock(now):
+    message = literal('Stock bajo: ') + Product.name
+    src = (
+        select(ProductStock.company_id, message, literal(False), literal(now))
+        .join(Product, Product.id == ProductStock.product_id)
+        .where(
+            ProductStock.min_stock > 0,
+            ProductStock.stock <= ProductStock.min_stock,
+            ~exists().where(
+                Notification.company_id == ProductStock.company_id,
+                Notification.message == message,
+            ),
+        )
+        .distinct()
+    )
+    result = db.session.execute(
+        insert(Notification).from_select(['company_id', 'message', 'is_read', 'created_at'], src)
+    )
+    return f'{result.rowcount} notificaciones de stock bajo'
+
+
+def prune_notifications(now):
+    days = _config('NOTIFICATION_RETENTION_DAYS', NOTIFICATION_RETENTION_DAYS)
+    result = db.session.execute(
+        delete(Notification).where(
+            Notification.is_read.is_(True),
+            Notification.created_at < now - timedelta(days=days),
+        )
+    )
+    return f'{result.rowcount} notificaciones eliminadas'
+
+
+def _remove_old_files(folder, max_age):
+    """Delete files in ``folder`` not modified for ``max_age`` seconds."""
+    if not os.path.isdir(folder):
+        return []
+    limit = time.time() - max_age
+    removed = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+                    removed.append(entry.path)
+            except OSError:
+                continue
+    return removed
+
+
+def sweep_exports(now):
+    """Delete old export/import files in ``maint/`` and unlink them from the history."""
+    days = _config('EXPORT_RETENTION_DAYS', EXPORT_RETENTION_DAYS)
+    folder = _config('EXPORT_FOLDER', 'maint')
+    removed = _remove_old_files(folder, days * 86400)
+    if removed:
+        db.session.execute(
+            update(ExportLog).where(ExportLog.file_path.in_(removed)).values(file_path=None)
+        )
+    return f'{len(removed)} archivos eliminados de {folder}'
+
+
+def sweep_pdfs(now):
+    hours = _config('PDF_RETENTION_HOURS', PDF_RETENTION_HOURS)
+    removed = _remove_old_files(os.path.join(current_app.static_folder, 'pdfs'), hours * 3600)
+    return f'{len(removed)} PDF eliminados'
+
+
+def reconcile_receivables(now):
+    invoices, clients = reconcile_balances()
+    return f'{invoices} saldos de factura y {clients} saldos de cliente corregidos'
+
+
+def refresh_recommendations(now):
+    products, pairs = rebuild_recommendations()
+    return f'{products} productos y {pairs} pares recalculados'
+
+
+def score_popularity(now):
+    return f'{refresh_popularity(now=now)} líneas de pedido nuevas puntuadas'
+
+
+def snapshot_stock(now):
+    # A daily snapshot is also the first one of its month, so month-end
+    # queries need no separate monthly job.
+    return f'{take_snapshots(period="daily", now=now)} existencias guardadas'
+
+
+def archive_inventory(now):
+    months = _config('ARCHIVE_MONTHS', ARCHIVE_MONTHS)
+    return f'{archive_movements(months, now=now)} movimientos archivados'
+
+
+def reorder_points(now):
+    count = compute_reorder_points(
+        lookback_days=_config('REORDER_LOOKBACK_DAYS', None),
+        lead_time=_config('REORDER_LEAD_TIME_DAYS', None),
+        cover_days=_config('REORDER_COVER_DAYS', None),
+        now=now,
+    )
+    return f'{count} puntos de reorden calculados'
+
+
+def send_emails(now):
+    sent, failed = drain(now=now)
+    return f'{sent} correos enviados, {failed} con error'
+
+
+JOBS = {
+    'expire_quotations': (timedelta(minutes=15), expire_quotations),
+    'notify_low_stock': (timedelta(minutes=15), notify_low_stock),
+    'prune_notifications': (timedelta(days=1), prune_notifications),
+    'sweep_exports': (timedelta(hours=6), sweep_exports),
+    'sweep_pdfs': (timedelta(hours=1), sweep_pdfs),
+    'reconcile_balances': (timedelta(days=1), reconcile_receivables),
+    'send_emails': (timedelta(minutes=1), send_emails),
+    'rebuild_recommendations': (timedelta(days=1), refresh_recommendations),
+    'refresh_popularity': (timedelta(minutes=15), score_popularity),
+    'snapshot_stock': (timedelta(days=1), snapshot_stock),
+    'archive_movements': (timedelta(days=7), archive_inventory),
+    'compute_reorder_points': (timedelta(days=1), reorder_points),
+}
+
+
+def _claim(name, interval, now, force=False):
+    """Mark job ``name`` as started unless another run is recent; return success."""
+    db.session.execute(
+        dialect_insert(MaintenanceJob).on_conflict_do_nothing(index_elements=['name']),
+        {'name': name, 'runs': 0},
+    )
+    claim = update(MaintenanceJob).where(MaintenanceJob.name == name)
+    if not force:
+        claim = claim.where(or_(
+            MaintenanceJob.last_started_at.is_(None),
+            MaintenanceJob.last_started_at <= now - interval,
+        ))
+    claimed = db.session.execute(claim.values(last_started_at=now)).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+
+def run_job(name, now=None, force=True):
+    """Run one job and record its outcome; return the ``MaintenanceJob`` row.
+
+    Returns ``None`` when the job was not due (only with ``force=False``).
+    """
+    interval, func = JOBS[name]
+    now = now or dom_now()
+    if not _claim(name, interval, now, force):
+        return None
+    started = time.perf_counter()
+    try:
+        message = func(now)
+        db.session.commit()
+        status = 'success'
+    except Exception as exc:  # pragma: no cover - logged and recorded
+        db.session.rollback()
+        current_app.logger.exception('maintenance job %s failed', name)
+        message, status = str(exc), 'fail'
+    job = db.session.get(MaintenanceJob, name)
+    job.last_finished_at = dom_now()
+    job.last_duration = round(time.perf_counter() - started, 4)
+    job.last_status = status
+    job.last_message = (message or '')[:255]
+    job.runs = (job.runs or 0) + 1
+    db.session.commit()
+    return job
+
+
+def run_due(now=None):
+    """Run every job whose interval has elapsed; return the names that ran."""
+    now = now or dom_now()
+    return [name for name in JOBS if run_job(name, now, force=False)]
+
+
+def job_status():
+    """Return the recorded state of every job, in ``JOBS`` order."""
+    rows = {job.name: job for job in MaintenanceJob.query}
+    status = []
+    for name, (interval, _func) in JOBS.items():
+        job = rows.get(name)
+        status.append({
+            'name': name,
+            'interval_seconds': int(interval.total_seconds()),
+            'last_started_at': job.last_started_at.isoformat() if job and job.last_started_at else None,
+            'last_finished_at': job.last_finished_at.isoformat() if job and job.last_finished_at else None,
+            'last_duration': job.last_duration if job else None,
+            'last_status': job.last_status if job else None,
+            'last_message': job.last_message if job else None,
+            'runs': job.runs if job else 0,
+        })
+    return status
+
+
+def start_scheduler(app, tick=None):
+    """Run :func:`run_due` every ``tick`` seconds in a daemon thread."""
+    tick = tick or app.config.get('MAINTENANCE_TICK', SCHEDULER_TICK)
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(tick):
+            with app.app_context():
+                try:
+                    run_due()
+                except Exception:  # pragma: no cover - keep the thread alive
+                    db.session.rollback()
+                    app.logger.exception('maintenance scheduler tick failed')
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=loop, name='maintenance', daemon=True)
+    thread.start()
+    return stop
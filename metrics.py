@@ -0,0 +1,292 @@
+"""In-process metrics exported in the Prometheus text format.
+
+Counters and histograms are recorded into a per-thread shard, so the hot
+path takes no lock: a histogram observation is a bisect and two additions.
+Each process periodically (every ``FLUSH_INTERVAL`` seconds, and at exit)
+writes the sum of its shards to ``<METRICS_DIR>/<pid>-<token>.json``,
+replacing the file atomically; the random token keeps a later process that
+reuses the pid from overwriting an exited one's totals.  :func:`render` adds
+up the files of every process, so ``/metrics`` shows the totals of all web
+workers, job workers and PDF processes however requests were spread between
+them.  Files of processes that have exited are kept, as their counts are
+part of the totals, until they are ``RETENTION`` seconds old; live processes
+rewrite theirs on their next flush.  ``METRICS_DIR`` defaults to a directory
+under the system temporary folder.
+
+Forked children (gunicorn workers, process pools) start from empty shards so
+the parent's counts are not written twice.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import atexit
+import glob
+import json
+import multiprocessing.util
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FLUSH_INTERVAL = 5  # seconds
+RETENTION = 7 * 24 * 3600  # seconds a process file is kept after its last write
+
+# name: (type, help)
+METRICS = {
+    'tiendix_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'tiendix_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint.'),
+    'tiendix_request_db_seconds': ('histogram', 'Database time per HTTP request by endpoint.'),
+    'tiendix_db_queries_total': ('counter', 'SQL statements executed by HTTP requests by endpoint.'),
+    'tiendix_template_render_seconds': ('histogram', 'Template render time by template.'),
+    'tiendix_pdf_render_seconds': ('histogram', 'PDF render time by document type.'),
+    'tiendix_job_duration_seconds': ('histogram', 'Background export and batch job duration by job.'),
+    'tiendix_jobs_total': ('counter', 'Background jobs finished by job and outcome.'),
+    'tiendix_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).'),
+    'tiendix_queue_depth': ('gauge', 'Items in each work queue by state.'),
+}
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class _State:
+    def __init__(self):
+        self.directory = os.environ.get('METRICS_DIR') or os.path.join(
+            tempfile.gettempdir(), 'tiendix-metrics'
+        )
+        self.retention = RETENTION
+        self.reset()
+
+    def reset(self):
+        self.filename = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()  # only taken when a thread creates its shard
+        self.flushed_at = time.monotonic()
+
+
+_state = _State()
+
+
+def _shard():
+    shard = getattr(_state.local, 'shard', None)
+    if shard is None:
+        shard = _state.local.shard = _Shard()
+        with _state.lock:
+            _state.shards.append(shard)
+    return shard
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record one observation of a histogram."""
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    series = histograms.get(key)
+    if series is None:
+        series = histograms[key] = [0] * (len(BUCKETS) + 3)  # buckets, +Inf, sum, count
+    series[bisect_left(BUCKETS, seconds)] += 1
+    series[-2] += seconds
+    series[-1] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe the duration of the block in histogram ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def snapshot():
+    """Totals of this process as ``{'counters': [...], 'histograms': [...]}``."""
+    counters, histograms = {}, {}
+    for shard in list(_state.shards):
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, series in list(shard.histograms.items()):
+            total = histograms.setdefault(key, [0] * len(series))
+            for i, v in enumerate(list(series)):
+                total[i] += v
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+    }
+
+
+def flush(force=False):
+    """Write this process's totals for :func:`render`, at most every ``FLUSH_INTERVAL``."""
+    now = time.monotonic()
+    if not force and now - _state.flushed_at < FLUSH_INTERVAL:
+        return
+    _state.flushed_at = now
+    data = snapshot()
+    if not data['counters'] and not data['histograms']:
+        return
+    os.makedirs(_state.directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=_state.directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, os.path.join(_state.directory, _state.filename))
+
+
+def prune(now=None):
+    """Remove process files not written for ``RETENTION`` seconds."""
+    cutoff = (now or time.time()) - _state.retention
+    for path in glob.glob(os.path.join(_state.directory, '*.json')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:  # removed by another process
+            continue
+
+
+def _after_fork():
+    _state.reset()
+    # Process pool workers leave through os._exit, which skips atexit.
+    multiprocessing.util.Finalize(_state, flush, kwargs={'force': True}, exitpriority=10)
+
+
+os.register_at_fork(after_in_child=_state.reset)
+multiprocessing.util.register_after_fork(_state, lambda state: _after_fork())
+atexit.register(flush, force=True)
+
+
+def _collect():
+    counters, histograms = {}, {}
+    for path in glob.glob(os.path.join(_state.directory, '*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):  # being replaced or truncated
+            continue
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in data['histograms']:
+            total = histograms.setdefault((name, tuple(map(tuple, labels))), [0] * len(series))
+            for i, v in enumerate(series):
+                total[i] += v
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=()):
+    """Prometheus text exposition of every process's metrics.
+
+    ``gauges`` are ``(name, labels, value)`` readings taken at scrape time,
+    such as queue depths.
+    """
+    flush(force=True)
+    prune()
+    counters, histograms = _collect()
+    series = {}
+    for (name, labels), value in sorted(counters.items()):
+        series.setdefault(name, []).append(f'{name}{_labels(labels)} {_number(value)}')
+    for (name, labels), values in sorted(histograms.items()):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, '+Inf'), values):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(values[-2])}')
+        lines.append(f'{name}_count{_labels(labels)} {values[-1]}')
+    for name, labels, value in sorted(gauges, key=lambda g: (g[0], sorted(g[1].items()))):
+        series.setdefault(name, []).append(f'{name}{_labels(sorted(labels.items()))} {_number(value)}')
+    out = []
+    for name in sorted(series):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} {kind}')
+        out.extend(series[name])
+    return '\n'.join(out) + '\n'
+
+
+def run_job(fn, app_obj, *args):
+    """Run background job ``fn`` and record its duration and outcome."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        result = fn(app_obj, *args)
+        outcome = 'ok'
+        return result
+    finally:
+        job = getattr(fn, '__name__', 'job')
+        observe('tiendix_job_duration_seconds', time.perf_counter() - start, job=job)
+        inc('tiendix_jobs_total', job=job, outcome=outcome)
+        flush(force=True)
+
+
+def init_app(app):
+    """Time requests and templates of ``app``."""
+    from flask import before_render_template, g, request, template_rendered
+
+    if app.config.get('METRICS_DIR'):
+        _state.directory = app.config['METRICS_DIR']
+    if app.config.get('METRICS_RETENTION'):
+        _state.retention = app.config['METRICS_RETENTION']
+
+    def start():
+        g.metrics_start = time.perf_counter()
+
+    def finish(response):
+        start_time = g.pop('metrics_start', None)
+        if start_time is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        observe('tiendix_request_duration_seconds', time.perf_counter() - start_time, endpoint=endpoint)
+        inc('tiendix_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        stats = g.get('sql_stats')
+        if stats is not None:
+            observe('tiendix_request_db_seconds', stats.seconds, endpoint=endpoint)
+            inc('tiendix_db_queries_total', stats.count, endpoint=endpoint)
+        flush()
+        return response
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        starts = g.get('metrics_templates')
+        if starts:
+            observe('tiendix_template_render_seconds', time.perf_counter() - starts.pop(),
+                    template=template.name or 'string')
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start)
+    app.after_request(finish)
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
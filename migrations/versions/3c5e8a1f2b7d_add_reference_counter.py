@@ -0,0 +1,57 @@
+"""add reference counter
+
+Revision ID: 3c5e8a1f2b7d
+Revises: 1b60f7130a5a
+Create Date: 2025-03-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3c5e8a1f2b7d'
+down_revision = '1b60f7130a5a'
+branch_labels = None
+depends_on = None
+
+
+def _candidates(reference):
+    """Same prefix/number split as ``references.reference_candidates``."""
+    for size in range(1, 4):
+        prefix, suffix = reference[:size], reference[size:]
+        if prefix.isalnum() and prefix == prefix.upper() and suffix.isdigit():
+            yield prefix, int(suffix)
+
+
+def upgrade():
+    counter = op.create_table(
+        'reference_counter',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('prefix', sa.String(length=10), nullable=False),
+        sa.Column('last_value', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'prefix', name='uq_reference_counter_prefix'),
+    )
+
+    # Seed counters with the highest number already used per prefix.
+    conn = op.get_bind()
+    last = {}
+    rows = conn.execute(sa.text(
+        "SELECT company_id, reference FROM product WHERE reference IS NOT NULL"
+    ))
+    for company_id, reference in rows:
+        for prefix, number in _candidates(reference):
+            key = (company_id, prefix)
+            if number > last.get(key, 0):
+                last[key] = number
+    if last:
+        op.bulk_insert(counter, [
+            {'company_id': company_id, 'prefix': prefix, 'last_value': number}
+            for (company_id, prefix), number in last.items()
+        ])
+
+
+def downgrade():
+    op.drop_table('reference_counter')
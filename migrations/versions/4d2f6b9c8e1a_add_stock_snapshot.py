@@ -0,0 +1,44 @@
+"""add stock snapshot and signed movement delta
+
+Revision ID: 4d2f6b9c8e1a
+Revises: 3c5e8a1f2b7d
+Create Date: 2025-03-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4d2f6b9c8e1a'
+down_revision = '3c5e8a1f2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('inventory_movement', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('delta', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_inventory_movement_wh_time', ['company_id', 'warehouse_id', 'timestamp'])
+
+    op.create_table(
+        'stock_snapshot',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('stock', sa.Integer(), nullable=False),
+        sa.Column('taken_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouse.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_stock_snapshot_lookup', 'stock_snapshot', ['company_id', 'warehouse_id', 'taken_at'])
+
+
+def downgrade():
+    op.drop_index('ix_stock_snapshot_lookup', table_name='stock_snapshot')
+    op.drop_table('stock_snapshot')
+    with op.batch_alter_table('inventory_movement', schema=None) as batch_op:
+        batch_op.drop_index('ix_inventory_movement_wh_time')
+        batch_op.drop_column('delta')
@@ -0,0 +1,48 @@
+"""add inventory movement archive
+
+Revision ID: 5e7a9c3d1f4b
+Revises: 4d2f6b9c8e1a
+Create Date: 2025-03-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5e7a9c3d1f4b'
+down_revision = '4d2f6b9c8e1a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'inventory_movement_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('movement_type', sa.String(length=10), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=True),
+        sa.Column('reference_type', sa.String(length=20), nullable=True),
+        sa.Column('reference_id', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('warehouse_id', sa.Integer(), nullable=True),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('executed_by', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id'], ),
+        sa.ForeignKeyConstraint(['executed_by'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouse.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_inventory_movement_archive_wh_time',
+        'inventory_movement_archive',
+        ['company_id', 'warehouse_id', 'timestamp'],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_inventory_movement_archive_wh_time', table_name='inventory_movement_archive')
+    op.drop_table('inventory_movement_archive')
@@ -0,0 +1,50 @@
+"""add stock transfer documents
+
+Revision ID: 6f8b1d4e2a9c
+Revises: 5e7a9c3d1f4b
+Create Date: 2025-03-24 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '6f8b1d4e2a9c'
+down_revision = '5e7a9c3d1f4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'stock_transfer',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('origin_id', sa.Integer(), nullable=False),
+        sa.Column('dest_id', sa.Integer(), nullable=False),
+        sa.Column('note', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('created_by', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id'], ),
+        sa.ForeignKeyConstraint(['created_by'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['dest_id'], ['warehouse.id'], ),
+        sa.ForeignKeyConstraint(['origin_id'], ['warehouse.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'stock_transfer_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('transfer_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+        sa.ForeignKeyConstraint(['transfer_id'], ['stock_transfer.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('stock_transfer_item')
+    op.drop_table('stock_transfer')
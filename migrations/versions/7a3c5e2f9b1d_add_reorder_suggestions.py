@@ -0,0 +1,29 @@
+"""add reorder suggestions to product stock
+
+Revision ID: 7a3c5e2f9b1d
+Revises: 6f8b1d4e2a9c
+Create Date: 2025-03-31 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7a3c5e2f9b1d'
+down_revision = '6f8b1d4e2a9c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_stock', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('demand_rate', sa.Float(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('reorder_point', sa.Integer(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('reorder_qty', sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('product_stock', schema=None) as batch_op:
+        batch_op.drop_column('reorder_qty')
+        batch_op.drop_column('reorder_point')
+        batch_op.drop_column('demand_rate')
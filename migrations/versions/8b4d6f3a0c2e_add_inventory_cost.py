@@ -0,0 +1,33 @@
+"""add movement unit cost and weighted-average stock cost
+
+Revision ID: 8b4d6f3a0c2e
+Revises: 7a3c5e2f9b1d
+Create Date: 2025-04-07 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8b4d6f3a0c2e'
+down_revision = '7a3c5e2f9b1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('inventory_movement', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_cost', sa.Float(), nullable=True))
+    with op.batch_alter_table('inventory_movement_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_cost', sa.Float(), nullable=True))
+    with op.batch_alter_table('product_stock', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('avg_cost', sa.Float(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('product_stock', schema=None) as batch_op:
+        batch_op.drop_column('avg_cost')
+    with op.batch_alter_table('inventory_movement_archive', schema=None) as batch_op:
+        batch_op.drop_column('unit_cost')
+    with op.batch_alter_table('inventory_movement', schema=None) as batch_op:
+        batch_op.drop_column('unit_cost')
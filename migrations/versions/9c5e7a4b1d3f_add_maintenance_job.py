@@ -0,0 +1,33 @@
+"""add maintenance job runs
+
+Revision ID: 9c5e7a4b1d3f
+Revises: 8b4d6f3a0c2e
+Create Date: 2025-04-14 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9c5e7a4b1d3f'
+down_revision = '8b4d6f3a0c2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'maintenance_job',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('last_started_at', sa.DateTime(), nullable=True),
+        sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+        sa.Column('last_duration', sa.Float(), nullable=True),
+        sa.Column('last_status', sa.String(length=20), nullable=True),
+        sa.Column('last_message', sa.String(length=255), nullable=True),
+        sa.Column('runs', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade():
+    op.drop_table('maintenance_job')
@@ -0,0 +1,43 @@
+"""add stored invoice and client balances
+
+Revision ID: ad6f8b5c2e4a
+Revises: 9c5e7a4b1d3f
+Create Date: 2025-04-21 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'ad6f8b5c2e4a'
+down_revision = '9c5e7a4b1d3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('balance_due', sa.Float(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_invoice_company_client_balance', ['company_id', 'client_id', 'balance_due'])
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('outstanding', sa.Float(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_client_company_outstanding', ['company_id', 'outstanding'])
+    # Invoices marked paid before payments were recorded have no payment rows.
+    op.execute(
+        "UPDATE invoice SET balance_due = CASE WHEN status = 'Pagada' AND NOT EXISTS "
+        "(SELECT 1 FROM payment WHERE payment.invoice_id = invoice.id) THEN 0 ELSE total - COALESCE("
+        "(SELECT SUM(amount) FROM payment WHERE payment.invoice_id = invoice.id), 0) END"
+    )
+    op.execute(
+        "UPDATE client SET outstanding = COALESCE("
+        "(SELECT SUM(balance_due) FROM invoice WHERE invoice.client_id = client.id), 0)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.drop_index('ix_client_company_outstanding')
+        batch_op.drop_column('outstanding')
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('ix_invoice_company_client_balance')
+        batch_op.drop_column('balance_due')
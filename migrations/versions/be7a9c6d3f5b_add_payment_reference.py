@@ -0,0 +1,29 @@
+"""add payment reference and lookup indexes
+
+Revision ID: be7a9c6d3f5b
+Revises: ad6f8b5c2e4a
+Create Date: 2025-04-28 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'be7a9c6d3f5b'
+down_revision = 'ad6f8b5c2e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reference', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_payment_company_reference', ['company_id', 'reference'])
+        batch_op.create_index(batch_op.f('ix_payment_invoice_id'), ['invoice_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payment_invoice_id'))
+        batch_op.drop_index('ix_payment_company_reference')
+        batch_op.drop_column('reference')
@@ -0,0 +1,51 @@
+"""add email outbox
+
+Revision ID: cf8b0d7e4a6c
+Revises: be7a9c6d3f5b
+Create Date: 2025-05-05 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'cf8b0d7e4a6c'
+down_revision = 'be7a9c6d3f5b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbound_email',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=120), nullable=False),
+        sa.Column('subject', sa.String(length=200), nullable=False),
+        sa.Column('html', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claim', sa.String(length=32), nullable=True),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_outbound_email_due', 'outbound_email', ['status', 'next_attempt_at'])
+    op.create_table(
+        'outbound_attachment',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email_id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=200), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['email_id'], ['outbound_email.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_outbound_attachment_email_id'), 'outbound_attachment', ['email_id'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_outbound_attachment_email_id'), table_name='outbound_attachment')
+    op.drop_table('outbound_attachment')
+    op.drop_index('ix_outbound_email_due', table_name='outbound_email')
+    op.drop_table('outbound_email')
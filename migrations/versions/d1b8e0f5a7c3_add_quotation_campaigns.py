@@ -0,0 +1,53 @@
+"""add quotation campaigns
+
+Revision ID: d1b8e0f5a7c3
+Revises: cf8b0d7e4a6c
+Create Date: 2025-05-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd1b8e0f5a7c3'
+down_revision = 'cf8b0d7e4a6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'quotation_campaign',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('message', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id']),
+        sa.ForeignKeyConstraint(['created_by'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'quotation_campaign_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('campaign_id', sa.Integer(), nullable=False),
+        sa.Column('quotation_id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=120), nullable=True),
+        sa.Column('email_id', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['campaign_id'], ['quotation_campaign.id']),
+        sa.ForeignKeyConstraint(['quotation_id'], ['quotation.id']),
+        sa.ForeignKeyConstraint(['email_id'], ['outbound_email.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        op.f('ix_quotation_campaign_item_campaign_id'), 'quotation_campaign_item', ['campaign_id']
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_quotation_campaign_item_campaign_id'), table_name='quotation_campaign_item')
+    op.drop_table('quotation_campaign_item')
+    op.drop_table('quotation_campaign')
@@ -0,0 +1,60 @@
+"""add product recommendations
+
+Revision ID: e2c9f1a6b8d4
+Revises: d1b8e0f5a7c3
+Create Date: 2025-05-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e2c9f1a6b8d4'
+down_revision = 'd1b8e0f5a7c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'product_popularity',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('product', sa.String(length=120), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'product', name='uq_product_popularity'),
+    )
+    op.create_index('ix_product_popularity_rank', 'product_popularity', ['company_id', 'quantity'])
+    op.create_table(
+        'product_affinity',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('product', sa.String(length=120), nullable=False),
+        sa.Column('other', sa.String(length=120), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'product', 'other', name='uq_product_affinity'),
+    )
+    # Fill both tables from the existing orders.
+    op.execute(
+        "INSERT INTO product_popularity (company_id, product, quantity, orders) "
+        "SELECT company_id, product_name, SUM(quantity), COUNT(DISTINCT order_id) "
+        "FROM order_item GROUP BY company_id, product_name"
+    )
+    op.execute(
+        "INSERT INTO product_affinity (company_id, product, other, orders) "
+        "SELECT a.company_id, a.product_name, b.product_name, COUNT(DISTINCT a.order_id) "
+        "FROM order_item a JOIN order_item b "
+        "ON b.order_id = a.order_id AND b.product_name <> a.product_name "
+        "GROUP BY a.company_id, a.product_name, b.product_name"
+    )
+
+
+def downgrade():
+    op.drop_table('product_affinity')
+    op.drop_index('ix_product_popularity_rank', table_name='product_popularity')
+    op.drop_table('product_popularity')
@@ -0,0 +1,44 @@
+"""add product scores
+
+Revision ID: f3d0a2b7c9e5
+Revises: e2c9f1a6b8d4
+Create Date: 2025-05-26 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3d0a2b7c9e5'
+down_revision = 'e2c9f1a6b8d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'product_score',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('product', sa.String(length=120), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'product', name='uq_product_score'),
+    )
+    op.create_index('ix_product_score_rank', 'product_score', ['company_id', 'score'])
+    op.create_table(
+        'popularity_cache',
+        sa.Column('company_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('last_item_id', sa.Integer(), nullable=False),
+        sa.Column('pending_ids', sa.Text(), nullable=False, server_default=''),
+        sa.Column('scored_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['company_info.id']),
+        sa.PrimaryKeyConstraint('company_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('popularity_cache')
+    op.drop_index('ix_product_score_rank', table_name='product_score')
+    op.drop_table('product_score')
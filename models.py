@@ -9,15 +9,37 @@ from zoneinfo import ZoneInfo
 db = SQLAlchemy()
 migrate = Migrate()
 
+# Product categories, shared by the forms and the CSV importer
+CATEGORIES = (
+    'Alimentos y Bebidas',
+    'Productos Industriales / Materiales',
+    'Minerales',
+    'Salud y Cuidado Personal',
+    'Electrónica y Tecnología',
+    'Hogar y Construcción',
+    'Energía Renovable',
+    'Otros',
+)
+
 
 def dom_now():
     """Return current datetime in Dominican Republic timezone (naive)."""
     return datetime.now(ZoneInfo("America/Santo_Domingo")).replace(tzinfo=None)
 
+
+def dialect_insert(model):
+    """Return an ``INSERT`` for ``model`` supporting ``ON CONFLICT`` clauses."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
 class Client(db.Model):
     __table_args__ = (
         db.UniqueConstraint('identifier', 'company_id', name='uq_client_identifier_company'),
         db.UniqueConstraint('email', 'company_id', name='uq_client_email_company'),
+        db.Index('ix_client_company_outstanding', 'company_id', 'outstanding'),
     )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -29,6 +51,7 @@ class Client(db.Model):
     sector = db.Column(db.String(120))
     province = db.Column(db.String(120))
     is_final_consumer = db.Column(db.Boolean, default=True)
+    outstanding = db.Column(db.Float, nullable=False, default=0.0, server_default='0')  # see balances.py
     company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
 
 class Product(db.Model):
@@ -49,6 +72,16 @@ class Product(db.Model):
         """Return True if product stock is at or below its minimum level."""
         return self.stock <= self.min_stock
 
+class ReferenceCounter(db.Model):
+    """Last reference number handed out per company and name prefix."""
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'prefix', name='uq_reference_counter_prefix'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    prefix = db.Column(db.String(10), nullable=False)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
 class Quotation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
@@ -119,6 +152,9 @@ class OrderItem(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
 
 class Invoice(db.Model):
+    __table_args__ = (
+        db.Index('ix_invoice_company_client_balance', 'company_id', 'client_id', 'balance_due'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
@@ -126,6 +162,7 @@ class Invoice(db.Model):
     subtotal = db.Column(db.Float, nullable=False)
     itbis = db.Column(db.Float, nullable=False)
     total = db.Column(db.Float, nullable=False)
+    balance_due = db.Column(db.Float, nullable=False, server_default='0')  # total minus payments
     ncf = db.Column(db.String(20), unique=True)
     seller = db.Column(db.String(120))
     payment_method = db.Column(db.String(20))
@@ -142,10 +179,14 @@ class Invoice(db.Model):
     payments = db.relationship('Payment', cascade='all, delete-orphan', back_populates='invoice')
 
 class Payment(db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_company_reference', 'company_id', 'reference'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.DateTime, default=dom_now)
+    reference = db.Column(db.String(64))  # bank transaction id, used to skip re-imported rows
     company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
     invoice = db.relationship('Invoice', back_populates='payments')
 
@@ -165,10 +206,15 @@ class InvoiceItem(db.Model):
 
 
 class InventoryMovement(db.Model):
+    __table_args__ = (
+        db.Index('ix_inventory_movement_wh_time', 'company_id', 'warehouse_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     movement_type = db.Column(db.String(10), nullable=False)  # entrada o salida
+    delta = db.Column(db.Integer)  # signed change applied to the warehouse stock
+    unit_cost = db.Column(db.Float)  # purchase cost of entradas, when known
     reference_type = db.Column(db.String(20))
     reference_id = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, default=dom_now)
@@ -180,6 +226,67 @@ class InventoryMovement(db.Model):
     user = db.relationship('User')
 
 
+class StockTransfer(db.Model):
+    """Transfer document moving many products between two warehouses.
+
+    Its id is the ``reference_id`` of the movements it generates.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    origin_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
+    dest_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
+    note = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=dom_now)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+
+    origin = db.relationship('Warehouse', foreign_keys=[origin_id])
+    dest = db.relationship('Warehouse', foreign_keys=[dest_id])
+    items = db.relationship('StockTransferItem', cascade='all, delete-orphan')
+
+
+class StockTransferItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transfer_id = db.Column(db.Integer, db.ForeignKey('stock_transfer.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+
+    product = db.relationship('Product')
+
+
+class InventoryMovementArchive(db.Model):
+    """Movements moved out of ``inventory_movement`` by the archival job."""
+    __table_args__ = (
+        db.Index('ix_inventory_movement_archive_wh_time', 'company_id', 'warehouse_id', 'timestamp'),
+    )
+    id = db.Column(db.Integer, primary_key=True)  # original InventoryMovement.id
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    movement_type = db.Column(db.String(10), nullable=False)
+    delta = db.Column(db.Integer)
+    unit_cost = db.Column(db.Float)
+    reference_type = db.Column(db.String(20))
+    reference_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'))
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    executed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    archived_at = db.Column(db.DateTime, default=dom_now)
+
+
+class StockSnapshot(db.Model):
+    """Stock level of a product in a warehouse at ``taken_at``."""
+    __table_args__ = (
+        db.Index('ix_stock_snapshot_lookup', 'company_id', 'warehouse_id', 'taken_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    taken_at = db.Column(db.DateTime, nullable=False, default=dom_now)
+
+
 class Warehouse(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -194,10 +301,20 @@ class ProductStock(db.Model):
     warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
     stock = db.Column(db.Integer, default=0)
     min_stock = db.Column(db.Integer, default=0)
+    # Suggestions computed from demand history by ``reorder.compute_reorder_points``.
+    demand_rate = db.Column(db.Float, default=0)
+    reorder_point = db.Column(db.Integer, default=0)
+    reorder_qty = db.Column(db.Integer, default=0)
+    avg_cost = db.Column(db.Float, default=0)  # weighted-average unit cost
     company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
     __table_args__ = (db.UniqueConstraint('product_id', 'warehouse_id', name='uix_product_wh'),)
     product = db.relationship('Product')
 
+    @property
+    def needs_reorder(self) -> bool:
+        """Return True if stock is at or below the suggested reorder point."""
+        return bool(self.reorder_point) and (self.stock or 0) <= self.reorder_point
+
 
 class CompanyInfo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -274,6 +391,112 @@ class NcfLog(db.Model):
     changed_at = db.Column(db.DateTime, default=dom_now)
 
 
+class MaintenanceJob(db.Model):
+    """Last run of a periodic job from ``maintenance.JOBS``."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)  # seconds
+    last_status = db.Column(db.String(20))
+    last_message = db.Column(db.String(255))
+    runs = db.Column(db.Integer, nullable=False, default=0)
+
+
+class OutboundEmail(db.Model):
+    """Message waiting in the email outbox; delivered by ``mailer.py``."""
+    __table_args__ = (
+        db.Index('ix_outbound_email_due', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=dom_now)
+    claim = db.Column(db.String(32))  # token of the sender that holds the row
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=dom_now)
+    sent_at = db.Column(db.DateTime)
+    attachments = db.relationship('OutboundAttachment', cascade='all, delete-orphan')
+
+
+class OutboundAttachment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('outbound_email.id'), nullable=False, index=True)
+    filename = db.Column(db.String(200), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class QuotationCampaign(db.Model):
+    """Bulk resend of quotations by email; see ``campaigns.py``."""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=dom_now)
+    finished_at = db.Column(db.DateTime)
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, fail
+    message = db.Column(db.String(255))
+    items = db.relationship('QuotationCampaignItem', cascade='all, delete-orphan')
+
+
+class QuotationCampaignItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('quotation_campaign.id'), nullable=False, index=True)
+    quotation_id = db.Column(db.Integer, db.ForeignKey('quotation.id'), nullable=False)
+    recipient = db.Column(db.String(120))
+    email_id = db.Column(db.Integer, db.ForeignKey('outbound_email.id'))
+    error = db.Column(db.String(255))
+    email = db.relationship('OutboundEmail')
+
+
+class ProductPopularity(db.Model):
+    """Units sold and orders per product name; maintained by ``ai.py``."""
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'product', name='uq_product_popularity'),
+        db.Index('ix_product_popularity_rank', 'company_id', 'quantity'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    product = db.Column(db.String(120), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProductAffinity(db.Model):
+    """Sparse co-occurrence matrix: orders containing both ``product`` and ``other``.
+
+    Pairs are stored in both directions, so the row of a product is a range
+    scan on the unique index.
+    """
+    __table_args__ = (db.UniqueConstraint('company_id', 'product', 'other', name='uq_product_affinity'),)
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    product = db.Column(db.String(120), nullable=False)
+    other = db.Column(db.String(120), nullable=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProductScore(db.Model):
+    """Time-decayed popularity of a company's top products; see ``ai.py``."""
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'product', name='uq_product_score'),
+        db.Index('ix_product_score_rank', 'company_id', 'score'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
+    product = db.Column(db.String(120), nullable=False)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+
+class PopularityCache(db.Model):
+    """Refresh state of a company's ``ProductScore`` rows."""
+    company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), primary_key=True, autoincrement=False)
+    last_item_id = db.Column(db.Integer, nullable=False, default=0)  # newest OrderItem scored
+    pending_ids = db.Column(db.Text, nullable=False, default='')  # missing ids below it, comma-separated
+    scored_at = db.Column(db.DateTime, nullable=False)  # scores are decayed to this time
+
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company_info.id'), nullable=False)
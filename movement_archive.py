@@ -0,0 +1,134 @@
+"""Archival of old inventory movements.
+
+``archive_movements`` moves movements older than a cutoff out of
+``inventory_movement`` into ``inventory_movement_archive``, one company at a
+time.  Before anything is moved the stock as of the cutoff is stored as a
+``StockSnapshot`` baseline, so as-of queries after the cutoff never need the
+archived rows.  The live table, and therefore the recent-movements panel of
+the inventory report, only keeps the recent window.
+
+``movement_history`` is the read path for movement listings: it combines
+both tables so callers do not need to know where a row lives.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import delete, insert, literal, select, union_all
+
+from models import (
+    db,
+    dom_now,
+    CompanyInfo,
+    InventoryMovement,
+    InventoryMovementArchive,
+    StockSnapshot,
+)
+from stock_history import stock_as_of
+
+ARCHIVE_MONTHS = 12
+ARCHIVE_BATCH = 5000
+
+COLUMNS = (
+    'id', 'product_id', 'quantity', 'movement_type', 'delta', 'unit_cost', 'reference_type',
+    'reference_id', 'timestamp', 'warehouse_id', 'company_id', 'executed_by',
+)
+
+
+def archive_cutoff(months, now=None):
+    """Return the first instant of the month ``months`` months before ``now``."""
+    now = now or dom_now()
+    index = now.year * 12 + now.month - 1 - months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _store_baseline(company_id, cutoff):
+    exists = db.session.query(StockSnapshot.id).filter(
+        StockSnapshot.company_id == company_id,
+        StockSnapshot.taken_at == cutoff,
+    ).first()
+    if exists:
+        return
+    rows = [
+        {'company_id': company_id, 'warehouse_id': wid, 'product_id': pid,
+         'stock': stock, 'taken_at': cutoff}
+        for (wid, pid), stock in stock_as_of(company_id, cutoff).items()
+    ]
+    if rows:
+        db.session.execute(insert(StockSnapshot), rows)
+
+
+def _archive_company(company_id, cutoff, batch_size):
+    m = InventoryMovement
+    old = (m.company_id == company_id, m.timestamp < cutoff)
+    if not db.session.query(m.id).filter(*old).first():
+        return 0
+    _store_baseline(company_id, cutoff)
+    db.session.commit()
+
+    moved = 0
+    while True:
+        ids = [
+            mid for (mid,) in db.session.query(m.id).filter(*old).order_by(m.id).limit(batch_size)
+        ]
+        if not ids:
+            break
+        src = select(*(getattr(m, c) for c in COLUMNS), literal(dom_now(), db.DateTime)).where(
+            m.id.in_(ids)
+        )
+        db.session.execute(
+            insert(InventoryMovementArchive).from_select(list(COLUMNS) + ['archived_at'], src)
+        )
+        db.session.execute(delete(m).where(m.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+    return moved
+
+
+def archive_movements(months=None, company_id=None, now=None, batch_size=None):
+    """Archive movements older than ``months`` months and return how many moved.
+
+    Each batch is copied and deleted in one transaction, so an interrupted
+    run leaves every movement in exactly one of the two tables and can simply
+    be started again.
+    """
+    months = ARCHIVE_MONTHS if months is None else months
+    batch_size = batch_size or ARCHIVE_BATCH
+    cutoff = archive_cutoff(months, now)
+    if company_id is not None:
+        company_ids = [company_id]
+    else:
+        company_ids = [cid for (cid,) in db.session.query(CompanyInfo.id).order_by(CompanyInfo.id)]
+    return sum(_archive_company(cid, cutoff, batch_size) for cid in company_ids)
+
+
+def movement_history(company_id, warehouse_id=None, product_id=None, start=None, end=None):
+    """Return a select over live and archived movements of one company.
+
+    The archive is skipped when ``start`` is newer than every archived row.
+    Rows are ordered newest first; callers add ``limit``/``offset``.
+    """
+    archived_until = (
+        db.session.query(db.func.max(InventoryMovementArchive.timestamp))
+        .filter(InventoryMovementArchive.company_id == company_id)
+        .scalar()
+    )
+    models = [InventoryMovement]
+    if archived_until is not None and (start is None or start <= archived_until):
+        models.append(InventoryMovementArchive)
+
+    parts = []
+    for m in models:
+        stmt = select(*(getattr(m, c) for c in COLUMNS), literal(m is InventoryMovementArchive).label('archived'))
+        stmt = stmt.where(m.company_id == company_id)
+        if warehouse_id is not None:
+            stmt = stmt.where(m.warehouse_id == warehouse_id)
+        if product_id is not None:
+            stmt = stmt.where(m.product_id == product_id)
+        if start is not None:
+            stmt = stmt.where(m.timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(m.timestamp <= end)
+        parts.append(stmt)
+    combined = union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+    return select(combined).order_by(combined.c.timestamp.desc(), combined.c.id.desc())
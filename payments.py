@@ -0,0 +1,277 @@
+"""Recording and bulk application of customer payments.
+
+A payment names an invoice (by id or NCF) or a client (by id or identifier).
+:func:`apply_payments` allocates a batch of payments to open invoices: a
+payment for an invoice settles that invoice first, and whatever is left, as
+well as payments that only name a client, goes to the client's open
+invoices oldest first.  Each batch resolves its NCFs, identifiers, bank
+references and open balances with one query apiece, bulk-inserts the
+``Payment`` rows and updates the stored balances with
+:func:`balances.apply_payment_totals`, so the statement count per batch does
+not depend on how many payments it holds.
+"""
+from __future__ import annotations
+
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from balances import apply_payment_totals
+from importers import iter_chunks
+from models import db, dom_now, Client, Invoice, Payment
+from receivables import EPSILON
+
+PAYMENT_BATCH = 2000
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+class PaymentError(Exception):
+    """Raised with the list of ``(line, message)`` validation errors."""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} pagos con errores')
+        self.errors = errors
+
+
+def payment_items(chunk):
+    """Turn ``(line, row)`` CSV pairs into payment items.
+
+    Columns: ``ncf`` or ``client`` (RNC/cédula), ``amount`` and optionally
+    ``date`` and ``reference``.
+    """
+    for line, row in chunk:
+        yield {
+            'line': line,
+            'ncf': (row.get('ncf') or '').strip(),
+            'identifier': (row.get('client') or '').strip(),
+            'amount': (row.get('amount') or '').strip(),
+            'date': (row.get('date') or '').strip(),
+            'reference': (row.get('reference') or '').strip(),
+        }
+
+
+def _parse_date(value, now):
+    if not value:
+        return now
+    if isinstance(value, datetime):
+        return value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _to_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return -1
+
+
+def _parse(items, now):
+    """Return ``(payments, errors)`` with the fields of each item validated."""
+    parsed = []
+    errors = []
+    for n, item in enumerate(items, start=1):
+        line = item.get('line', n)
+        try:
+            amount = round(float(item.get('amount')), 2)
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0:
+            errors.append((line, 'Monto inválido'))
+            continue
+        date = _parse_date(item.get('date'), now)
+        if date is None:
+            errors.append((line, f"Fecha inválida: {item.get('date')}"))
+            continue
+        parsed.append({
+            'line': line,
+            'amount': amount,
+            'date': date,
+            'reference': (item.get('reference') or '').strip()[:64] or None,
+            'invoice_id': _to_id(item.get('invoice_id')),
+            'ncf': (item.get('ncf') or '').strip() or None,
+            'client_id': _to_id(item.get('client_id')),
+            'identifier': (item.get('identifier') or '').strip() or None,
+        })
+    return parsed, errors
+
+
+def _lookup(company_id, parsed):
+    """Resolve invoices, clients and known references with one query each."""
+    def values(key):
+        return {p[key] for p in parsed if p[key] is not None}
+
+    invoice_ids, ncfs = values('invoice_id'), values('ncf')
+    invoices = {}
+    if invoice_ids or ncfs:
+        query = db.session.query(Invoice.id, Invoice.ncf, Invoice.client_id).filter(
+            Invoice.company_id == company_id,
+            db.or_(Invoice.id.in_(invoice_ids), Invoice.ncf.in_(ncfs)),
+        )
+        for iid, ncf, client_id in query:
+            invoices[('id', iid)] = invoices[('ncf', ncf)] = (iid, client_id)
+
+    client_ids, identifiers = values('client_id'), values('identifier')
+    clients = {}
+    if client_ids or identifiers:
+        query = db.session.query(Client.id, Client.identifier).filter(
+            Client.company_id == company_id,
+            db.or_(Client.id.in_(client_ids), Client.identifier.in_(identifiers)),
+        )
+        for cid, identifier in query:
+            clients[('id', cid)] = clients[('identifier', identifier)] = cid
+
+    references = values('reference')
+    known = set()
+    if references:
+        known = {
+            ref for (ref,) in db.session.query(Payment.reference).filter(
+                Payment.company_id == company_id, Payment.reference.in_(references)
+            )
+        }
+    return invoices, clients, known
+
+
+def _open_balances(company_id, client_ids):
+    """Return ``({client_id: deque of [invoice_id, balance]}, {invoice_id: entry})``, oldest first."""
+    queues = {}
+    entries = {}
+    if not client_ids:
+        return queues, entries
+    query = (
+        db.session.query(Invoice.id, Invoice.client_id, Invoice.balance_due)
+        .filter(
+            Invoice.company_id == company_id,
+            Invoice.client_id.in_(client_ids),
+            Invoice.balance_due > EPSILON,
+        )
+        .order_by(Invoice.client_id, Invoice.date, Invoice.id)
+    )
+    for iid, client_id, balance in query:
+        entry = [iid, balance]
+        queues.setdefault(client_id, deque()).append(entry)
+        entries[iid] = entry
+    return queues, entries
+
+
+def _take(entry, remaining, allocations):
+    amount = round(min(entry[1], remaining), 2)
+    entry[1] -= amount
+    allocations.append((entry[0], amount))
+    return remaining - amount
+
+
+def apply_payments(company_id, items, now=None):
+    """Allocate a batch of payment ``items`` to open invoices.
+
+    Items are dicts with ``amount``, one of ``invoice_id``, ``ncf``,
+    ``client_id`` or ``identifier``, and optionally ``date``, ``reference``
+    and ``line``.  Invalid items and items whose ``reference`` was already
+    imported are reported in ``errors`` and skipped; amounts exceeding the
+    open balance are reported in ``unapplied``.  Committing is left to the
+    caller.
+    """
+    now = now or dom_now()
+    parsed, errors = _parse(items, now)
+    invoices, clients, known = _lookup(company_id, parsed)
+
+    targets = []
+    for p in parsed:
+        if p['reference'] in known:
+            errors.append((p['line'], f"Referencia {p['reference']} ya aplicada"))
+            continue
+        if p['invoice_id'] is not None or p['ncf']:
+            key = ('id', p['invoice_id']) if p['invoice_id'] is not None else ('ncf', p['ncf'])
+            found = invoices.get(key)
+            if found is None:
+                errors.append((p['line'], f"Factura {p['ncf'] or p['invoice_id']} no encontrada"))
+                continue
+            invoice_id, client_id = found
+        elif p['client_id'] is not None or p['identifier']:
+            key = ('id', p['client_id']) if p['client_id'] is not None else ('identifier', p['identifier'])
+            invoice_id, client_id = None, clients.get(key)
+            if client_id is None:
+                errors.append((p['line'], f"Cliente {p['identifier'] or p['client_id']} no encontrado"))
+                continue
+        else:
+            errors.append((p['line'], 'Indique la factura o el cliente'))
+            continue
+        if p['reference']:
+            known.add(p['reference'])
+        targets.append((p, invoice_id, client_id))
+
+    queues, entries = _open_balances(company_id, {client_id for _p, _i, client_id in targets})
+    rows = []
+    totals = []
+    unapplied = []
+    applied = 0
+    for p, invoice_id, client_id in targets:
+        allocations = []
+        remaining = p['amount']
+        entry = entries.get(invoice_id)
+        if entry is not None and entry[1] > EPSILON:
+            remaining = _take(entry, remaining, allocations)
+        queue = queues.get(client_id, ())
+        while queue and remaining > EPSILON:
+            if queue[0][1] <= EPSILON:
+                queue.popleft()
+                continue
+            remaining = _take(queue[0], remaining, allocations)
+        if not allocations:
+            errors.append((p['line'], 'Sin facturas pendientes'))
+            continue
+        applied += 1
+        if remaining > EPSILON:
+            unapplied.append((p['line'], round(remaining, 2)))
+        for iid, amount in allocations:
+            rows.append({
+                'invoice_id': iid, 'amount': amount, 'date': p['date'],
+                'reference': p['reference'], 'company_id': company_id,
+            })
+            totals.append((iid, client_id, amount))
+
+    if rows:
+        db.session.execute(insert(Payment), rows)
+        apply_payment_totals(totals)
+    return {
+        'applied': applied,
+        'payments': [{'invoice_id': r['invoice_id'], 'amount': r['amount']} for r in rows],
+        'amount': round(sum(r['amount'] for r in rows), 2),
+        'unapplied': unapplied,
+        'errors': sorted(errors, key=lambda e: e[0]),
+    }
+
+
+def record_payments(company_id, items, now=None):
+    """Apply API payments all-or-nothing; raise :class:`PaymentError` on any error."""
+    result = apply_payments(company_id, items, now)
+    if result['errors']:
+        raise PaymentError(result['errors'])
+    return result
+
+
+def import_payments(company_id, reader, chunk_size=None, progress=None):
+    """Apply a bank file of payments, committing every ``PAYMENT_BATCH`` rows.
+
+    Rows that cannot be applied are skipped and reported; since already
+    imported references are skipped, a failed run can be started again with
+    the same file.  ``progress`` is called with the rows processed so far.
+    """
+    result = {'applied': 0, 'amount': 0.0, 'unapplied': [], 'errors': []}
+    processed = 0
+    for chunk in iter_chunks(reader, chunk_size or PAYMENT_BATCH):
+        batch = apply_payments(company_id, payment_items(chunk))
+        db.session.commit()
+        result['applied'] += batch['applied']
+        result['amount'] = round(result['amount'] + batch['amount'], 2)
+        result['unapplied'].extend(batch['unapplied'])
+        result['errors'].extend(batch['errors'])
+        processed += len(chunk)
+        if progress:
+            progress(processed)
+    return result
@@ -0,0 +1,149 @@
+"""Per-request SQL statistics and N+1 detection.
+
+Engine events time every statement executed while statistics are being
+collected and group the statements by shape: the SQL with parameters,
+literals and ``IN`` lists collapsed.  A lazy load issued once per row of a
+listing is then a single shape executed once per row, and any shape
+repeated ``N_PLUS_ONE`` times or more in one request is reported as a
+likely N+1.
+
+:func:`init_app` collects statistics for every request.  In debug mode (or
+with ``SQL_STATS_HEADERS``) responses carry ``X-SQL-Queries``,
+``X-SQL-Time`` (milliseconds) and ``X-SQL-Repeated`` headers.  Otherwise a
+request with a likely N+1, or more than ``SQL_QUERY_BUDGET`` statements, is
+logged as one JSON line.  :func:`count_queries` collects the same
+statistics around any block of code; tests use it for query budgets.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import re
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+N_PLUS_ONE = 5  # executions of one shape in a request that look like a loop
+QUERY_BUDGET = 50
+
+_current: ContextVar["QueryStats | None"] = ContextVar('query_stats', default=None)
+
+_PARAMS = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def statement_shape(statement):
+    """``statement`` with parameters, literals and ``IN`` lists collapsed."""
+    shape = _PARAMS.sub('?', statement)
+    shape = _LITERALS.sub('?', shape)
+    shape = _IN_LIST.sub('(?)', shape)
+    return ' '.join(shape.split())
+
+
+class QueryStats:
+    """Statements executed while collecting, with their total time."""
+
+    __slots__ = ('count', 'seconds', 'statements', 'parent')
+
+    def __init__(self, parent=None):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.parent = parent
+
+    def record(self, statement, seconds):
+        stats = self
+        while stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            stats.statements[statement] += 1
+            stats = stats.parent
+
+    def shapes(self):
+        """Executions per statement shape."""
+        shapes = Counter()
+        for statement, n in self.statements.items():
+            shapes[statement_shape(statement)] += n
+        return shapes
+
+    def repeated(self, threshold=N_PLUS_ONE):
+        """Shapes executed at least ``threshold`` times, most frequent first."""
+        return [(shape, n) for shape, n in self.shapes().most_common() if n >= threshold]
+
+    def as_dict(self, threshold=N_PLUS_ONE):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.seconds * 1000, 1),
+            'repeated': [{'count': n, 'sql': shape[:300]} for shape, n in self.repeated(threshold)],
+        }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get('query_stats_start')
+    if stats is not None and starts:
+        stats.record(statement, time.perf_counter() - starts.pop())
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements executed by this thread inside the block.
+
+    Requests handled inside the block (e.g. by the test client) count
+    towards it as well.
+    """
+    stats = QueryStats(_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def init_app(app):
+    """Collect statistics for every request of ``app``."""
+
+    def start():
+        g.sql_stats = QueryStats(_current.get())
+        _current.set(g.sql_stats)
+
+    def report(response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        threshold = app.config.get('SQL_N_PLUS_ONE', N_PLUS_ONE)
+        if app.debug or app.config.get('SQL_STATS_HEADERS'):
+            response.headers['X-SQL-Queries'] = str(stats.count)
+            response.headers['X-SQL-Time'] = f'{stats.seconds * 1000:.1f}'
+            response.headers['X-SQL-Repeated'] = str(len(stats.repeated(threshold)))
+        elif stats.count > app.config.get('SQL_QUERY_BUDGET', QUERY_BUDGET) or stats.repeated(threshold):
+            app.logger.warning('sql %s', json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                **stats.as_dict(threshold),
+            }, ensure_ascii=False))
+        return response
+
+    def stop(exc):
+        stats = g.pop('sql_stats', None)
+        if stats is not None:
+            _current.set(stats.parent)
+
+    # First, so the company lookups of the other hooks are counted too.
+    app.before_request_funcs.setdefault(None, []).insert(0, start)
+    app.after_request(report)
+    app.teardown_request(stop)
@@ -0,0 +1,124 @@
+"""Accounts-receivable balances and aging.
+
+Balances are read from ``Invoice.balance_due``, kept up to date by
+:mod:`balances`.  :func:`aging_query` groups a tenant's open balances by
+client in one query, with a ``CASE`` per ``AGING_BUCKETS`` entry, so no
+invoice row is loaded into Python and payments are not read at all.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+from sqlalchemy import case, func, or_
+
+from models import db, Client, Invoice
+
+TERMS_DAYS = 30  # invoices are due this many days after issue
+AGING_BUCKETS = (
+    ('0-30', 30),
+    ('31-60', 60),
+    ('61-90', 90),
+    ('91-120', 120),
+    ('121+', None),
+)
+EPSILON = 0.005  # ignore balances below half a cent left by float rounding
+
+
+def open_invoices(company_id, client_id=None):
+    """Query of ``(Invoice, balance)`` for invoices with an outstanding balance."""
+    balance = Invoice.balance_due.label('balance')
+    query = (
+        db.session.query(Invoice, balance)
+        .filter(Invoice.company_id == company_id, Invoice.balance_due > EPSILON)
+    )
+    if client_id is not None:
+        query = query.filter(Invoice.client_id == client_id)
+    return query
+
+
+def _bucket_columns(balance, as_of):
+    """Sum expressions per bucket; an invoice ``n`` days old counts in the first limit >= n."""
+    columns = []
+    lower = None
+    for label, days in AGING_BUCKETS:
+        conds = []
+        if days is not None:
+            conds.append(Invoice.date > as_of - timedelta(days=days + 1))
+        if lower is not None:
+            conds.append(Invoice.date <= as_of - timedelta(days=lower + 1))
+        columns.append(
+            func.coalesce(func.sum(case((db.and_(*conds), balance), else_=0) if conds else balance), 0)
+            .label(label)
+        )
+        lower = days
+    return columns
+
+
+def aging_query(company_id, as_of, q=None, client_id=None):
+    """Grouped query with one row per client owing money.
+
+    Columns: ``client_id``, ``name``, ``identifier``, ``email``, one column
+    per ``AGING_BUCKETS`` label, ``overdue`` (past ``TERMS_DAYS``),
+    ``balance`` and ``invoices`` (open invoice count).
+    """
+    balance = Invoice.balance_due
+    total = func.sum(balance)
+    query = (
+        db.session.query(
+            Client.id.label('client_id'),
+            Client.name,
+            Client.identifier,
+            Client.email,
+            *_bucket_columns(balance, as_of),
+            func.coalesce(
+                func.sum(case((Invoice.date < as_of - timedelta(days=TERMS_DAYS), balance), else_=0)), 0
+            ).label('overdue'),
+            total.label('balance'),
+            func.count(Invoice.id).label('invoices'),
+        )
+        .select_from(Invoice)
+        .join(Client, Client.id == Invoice.client_id)
+        .filter(Invoice.company_id == company_id, balance > EPSILON)
+        .group_by(Client.id, Client.name, Client.identifier, Client.email)
+    )
+    if client_id is not None:
+        query = query.filter(Invoice.client_id == client_id)
+    if q:
+        like = f'%{q}%'
+        query = query.filter(or_(Client.name.ilike(like), Client.identifier.ilike(like)))
+    return query.order_by(total.desc(), Client.name)
+
+
+def aging_row(row):
+    data = {
+        'client_id': row.client_id,
+        'name': row.name,
+        'identifier': row.identifier,
+        'buckets': {label: round(float(getattr(row, label) or 0), 2) for label, _days in AGING_BUCKETS},
+        'overdue': round(float(row.overdue or 0), 2),
+        'balance': round(float(row.balance or 0), 2),
+        'invoices': row.invoices,
+    }
+    return data
+
+
+def aging_totals(company_id, as_of, q=None):
+    """Tenant-wide totals per bucket, from the same grouped query."""
+    sub = aging_query(company_id, as_of, q).order_by(None).subquery()
+    labels = [label for label, _days in AGING_BUCKETS] + ['overdue', 'balance']
+    row = db.session.query(
+        *[func.coalesce(func.sum(sub.c[label]), 0) for label in labels],
+        func.count(sub.c.client_id),
+    ).one()
+    totals = {label: round(float(value), 2) for label, value in zip(labels, row)}
+    totals['clients'] = row[-1]
+    return totals
+
+
+def client_aging(company_id, client_id, as_of):
+    """Return ``(buckets, balance, overdue)`` for one client."""
+    row = aging_query(company_id, as_of, client_id=client_id).first()
+    if not row:
+        return {label: 0 for label, _days in AGING_BUCKETS}, 0, 0
+    data = aging_row(row)
+    return data['buckets'], data['balance'], data['overdue']
@@ -0,0 +1,161 @@
+"""Product reference numbering backed by per-prefix counters.
+
+References are the first three alphanumeric characters of the product name
+followed by a zero-padded sequence (``PRO001``).  The last number used for
+each ``(company, prefix)`` lives in ``ReferenceCounter`` and is advanced with
+a single conditional ``UPDATE`` so concurrent requests never hand out the
+same reference and no request has to scan the product table.
+"""
+from __future__ import annotations
+
+from sqlalchemy import case, update
+
+from models import db, dialect_insert, Product, ReferenceCounter
+
+
+def reference_prefix(name: str) -> str:
+    prefix = ''.join(ch for ch in (name or '').upper() if ch.isalnum())[:3]
+    return prefix or 'REF'
+
+
+def _format(prefix, number):
+    return f"{prefix}{number:03d}"
+
+
+def reference_candidates(reference):
+    """Return the ``(prefix, number)`` pairs a reference may count towards."""
+    pairs = []
+    for size in range(1, 4):
+        prefix, suffix = reference[:size], reference[size:]
+        if prefix.isalnum() and prefix == prefix.upper() and suffix.isdigit():
+            pairs.append((prefix, int(suffix)))
+    return pairs
+
+
+def _raise_counters(company_id, pairs):
+    """Move counters up to at least the given numbers, creating them if needed."""
+    if not pairs:
+        return
+    stmt = dialect_insert(ReferenceCounter)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id', 'prefix'],
+        set_={'last_value': case(
+            (stmt.excluded.last_value > ReferenceCounter.last_value, stmt.excluded.last_value),
+            else_=ReferenceCounter.last_value,
+        )},
+    )
+    db.session.execute(stmt, [
+        {'company_id': company_id, 'prefix': prefix, 'last_value': number}
+        for prefix, number in pairs
+    ])
+
+
+def _last_used(company_id, prefix):
+    """Highest number of the ``prefix`` sequence among existing references."""
+    refs = (
+        db.session.query(Product.reference)
+        .filter(Product.company_id == company_id, Product.reference.like(f"{prefix}%"))
+    )
+    numbers = [
+        int(ref[len(prefix):])
+        for (ref,) in refs
+        if ref and ref.startswith(prefix) and ref[len(prefix):].isdigit()
+    ]
+    return max(numbers) if numbers else 0
+
+
+def _seed_counter(company_id, prefix):
+    """Create the counter for ``prefix`` from the references already in use.
+
+    Only runs the first time a prefix is seen for a company, e.g. for data
+    created before the counters existed.
+    """
+    _raise_counters(company_id, [(prefix, _last_used(company_id, prefix))])
+
+
+def _counter_filter(company_id, prefix):
+    return (ReferenceCounter.company_id == company_id, ReferenceCounter.prefix == prefix)
+
+
+def _counter_value(company_id, prefix):
+    return (
+        db.session.query(ReferenceCounter.last_value)
+        .filter(*_counter_filter(company_id, prefix))
+        .scalar()
+    )
+
+
+def peek_reference(company_id, name):
+    """Return the next reference for ``name`` without reserving it.
+
+    Read-only: a prefix without a counter yet is numbered from the
+    references already in use, and its counter is created on first claim.
+    """
+    prefix = reference_prefix(name)
+    last = _counter_value(company_id, prefix)
+    if last is None:
+        last = _last_used(company_id, prefix)
+    return _format(prefix, last + 1)
+
+
+def allocate_references(company_id, prefix, count=1):
+    """Reserve ``count`` consecutive references for ``prefix``."""
+    stmt = (
+        update(ReferenceCounter)
+        .where(*_counter_filter(company_id, prefix))
+        .values(last_value=ReferenceCounter.last_value + count)
+        .returning(ReferenceCounter.last_value)
+    )
+    last = db.session.execute(stmt).scalar()
+    if last is None:
+        _seed_counter(company_id, prefix)
+        last = db.session.execute(stmt).scalar_one()
+    return [_format(prefix, n) for n in range(last - count + 1, last + 1)]
+
+
+def next_reference(company_id, name):
+    """Reserve and return the next reference for a product called ``name``."""
+    return allocate_references(company_id, reference_prefix(name))[0]
+
+
+def claim_reference(company_id, name, reference):
+    """Reserve a reference submitted by a form and return the one to store.
+
+    A reference in the ``name`` sequence (as suggested by ``peek_reference``)
+    is claimed atomically; if another request took it first, the next free
+    one is returned instead.  An older number of the sequence is kept when
+    no product uses it.  Custom references are kept as typed and only move
+    the counters past them.
+    """
+    prefix = reference_prefix(name)
+    suffix = reference[len(prefix):] if reference.startswith(prefix) else ''
+    if not suffix.isdigit():
+        _raise_counters(company_id, reference_candidates(reference))
+        return reference
+    number = int(suffix)
+    stmt = (
+        update(ReferenceCounter)
+        .where(*_counter_filter(company_id, prefix), ReferenceCounter.last_value < number)
+        .values(last_value=number)
+    )
+    if db.session.execute(stmt).rowcount:
+        return reference
+    last = _counter_value(company_id, prefix)
+    if last is None:
+        _seed_counter(company_id, prefix)
+        if db.session.execute(stmt).rowcount:
+            return reference
+        last = _counter_value(company_id, prefix)
+    # The counter's own value was just handed out, possibly to a product not
+    # committed yet, so only numbers below it are checked against products.
+    if number < last and not _reference_taken(company_id, reference):
+        return reference
+    return next_reference(company_id, name)
+
+
+def _reference_taken(company_id, reference):
+    return db.session.query(
+        db.session.query(Product.id)
+        .filter(Product.company_id == company_id, Product.reference == reference)
+        .exists()
+    ).scalar()
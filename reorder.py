@@ -0,0 +1,148 @@
+"""Demand-based reorder points.
+
+``compute_reorder_points`` reads the daily demand of every product and
+warehouse in two grouped queries and computes rates, variability and
+suggested reorder levels for the whole catalogue with NumPy:
+
+* order lines (``OrderItem`` quantities at the order's warehouse), and
+* other ``salida`` movements (manual exits); transfers are not demand, and
+  order movements are already counted through their order lines.
+
+For each product/warehouse with mean daily demand ``d`` and standard
+deviation ``s`` over the lookback window (days without demand count as
+zero)::
+
+    reorder_point = ceil(d * lead_time + z * s * sqrt(lead_time))
+    reorder_qty   = ceil(d * cover_days)
+
+Results are stored on the existing ``ProductStock`` rows (``demand_rate``,
+``reorder_point``, ``reorder_qty``) with one bulk ``UPDATE``, so inventory
+listings can filter on ``stock <= reorder_point``.  Demand at a warehouse
+where the product has no stock row is not stored; it would need a stock
+row of its own, which only stock movements create.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import bindparam, func, or_, update
+
+from models import db, dom_now, InventoryMovement, Order, OrderItem, Product, ProductStock
+
+LOOKBACK_DAYS = 90
+LEAD_TIME_DAYS = 7
+COVER_DAYS = 30
+SERVICE_Z = 1.65  # ~95% service level
+
+NOT_DEMAND = ('transfer', 'Order')
+
+
+def _movement_demand(since, company_id):
+    m = InventoryMovement
+    day = func.date(m.timestamp)
+    query = (
+        db.session.query(m.company_id, m.product_id, m.warehouse_id, day, func.sum(m.quantity))
+        .filter(
+            m.movement_type == 'salida',
+            m.warehouse_id.isnot(None),
+            m.timestamp >= since,
+            or_(m.reference_type.is_(None), m.reference_type.notin_(NOT_DEMAND)),
+        )
+        .group_by(m.company_id, m.product_id, m.warehouse_id, day)
+    )
+    if company_id is not None:
+        query = query.filter(m.company_id == company_id)
+    return query.all()
+
+
+def _order_demand(since, company_id):
+    day = func.date(Order.date)
+    query = (
+        db.session.query(Order.company_id, Product.id, Order.warehouse_id, day, func.sum(OrderItem.quantity))
+        .join(Order, OrderItem.order_id == Order.id)
+        .join(Product, (Product.code == OrderItem.code) & (Product.company_id == OrderItem.company_id))
+        .filter(Order.date >= since, Order.warehouse_id.isnot(None))
+        .group_by(Order.company_id, Product.id, Order.warehouse_id, day)
+    )
+    if company_id is not None:
+        query = query.filter(Order.company_id == company_id)
+    return query.all()
+
+
+def demand_stats(rows, since, days):
+    """Return ``(company, product, warehouse, mean, std)`` arrays for daily demand rows.
+
+    ``rows`` are ``(company_id, product_id, warehouse_id, day, quantity)``
+    tuples, possibly with several rows for the same key and day.
+    """
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0), np.zeros(0)
+    company, product, warehouse, day, qty = zip(*rows)
+    company = np.asarray(company, dtype=np.int64)
+    product = np.asarray(product, dtype=np.int64)
+    warehouse = np.asarray(warehouse, dtype=np.int64)
+    qty = np.asarray(qty, dtype=np.float64)
+    offset = (np.asarray([str(d)[:10] for d in day], dtype='datetime64[D]')
+              - np.datetime64(since.date(), 'D')).astype(np.int64)
+    offset = np.clip(offset, 0, days - 1)
+
+    keys, key_idx = np.unique(
+        np.stack([company, product, warehouse], axis=1), axis=0, return_inverse=True
+    )
+    key_idx = key_idx.reshape(-1)
+    # Combine rows for the same key and day before squaring.
+    cells, cell_idx = np.unique(key_idx * days + offset, return_inverse=True)
+    daily = np.bincount(cell_idx.reshape(-1), weights=qty)
+    cell_key = cells // days
+    total = np.bincount(cell_key, weights=daily, minlength=len(keys))
+    total_sq = np.bincount(cell_key, weights=daily * daily, minlength=len(keys))
+    mean = total / days
+    std = np.sqrt(np.maximum(total_sq / days - mean * mean, 0))
+    return keys[:, 0], keys[:, 1], keys[:, 2], mean, std
+
+
+_stock = ProductStock.__table__
+
+_store = (
+    update(_stock)
+    .where(
+        _stock.c.company_id == bindparam('c'),
+        _stock.c.product_id == bindparam('p'),
+        _stock.c.warehouse_id == bindparam('w'),
+    )
+    .values(demand_rate=bindparam('rate'), reorder_point=bindparam('point'), reorder_qty=bindparam('qty'))
+)
+
+
+def compute_reorder_points(company_id=None, lookback_days=None, lead_time=None,
+                           cover_days=None, z=None, now=None):
+    """Recompute reorder suggestions and return how many were stored."""
+    days = lookback_days or LOOKBACK_DAYS
+    lead_time = lead_time or LEAD_TIME_DAYS
+    cover_days = cover_days or COVER_DAYS
+    z = SERVICE_Z if z is None else z
+    now = now or dom_now()
+    since = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    rows = _movement_demand(since, company_id) + _order_demand(since, company_id)
+    company, product, warehouse, mean, std = demand_stats(rows, since, days)
+    reorder_point = np.ceil(mean * lead_time + z * std * np.sqrt(lead_time)).astype(np.int64)
+    reorder_qty = np.ceil(mean * cover_days).astype(np.int64)
+
+    reset = update(ProductStock).values(demand_rate=0, reorder_point=0, reorder_qty=0)
+    if company_id is not None:
+        reset = reset.where(ProductStock.company_id == company_id)
+    db.session.execute(reset)
+    stored = 0
+    if len(product):
+        stored = db.session.execute(_store, [
+            {
+                'c': int(c), 'p': int(p), 'w': int(w),
+                'rate': round(float(d), 4), 'point': int(r), 'qty': int(q),
+            }
+            for c, p, w, d, r, q in zip(company, product, warehouse, mean, reorder_point, reorder_qty)
+        ]).rowcount
+    db.session.commit()
+    return stored
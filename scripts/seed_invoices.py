@@ -1,85 +1,373 @@
+"""Deterministic bulk generator of multi-tenant datasets for load tests.
+
+Creates companies with users, warehouses, clients and products, then sales
+history in batches: for every invoice a converted quotation, its order, the
+invoice itself with payments (full, partial or none) and the stock exits of
+the order, plus open quotations.  Stored balances (``Invoice.balance_due``,
+``Client.outstanding``), warehouse stock and the recommendation tables are
+consistent with the generated rows.
+
+Values are drawn with NumPy from a seeded generator, so the same
+:class:`SeedConfig` always produces the same dataset.  Primary keys are
+assigned up front (continuing after existing rows) so parents and children
+are written with Core ``executemany`` inserts and no round trips; each batch
+is one transaction.  Skew settings give Zipf-like popularity to clients,
+products and companies (``0`` means uniform)::
+
+    python scripts/seed_invoices.py --invoices 1000000 --companies 20 \\
+        --product-skew 1.1 --client-skew 0.8 --seed 7
+"""
 from __future__ import annotations
-import random
+
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timedelta
-from app import app, db, Invoice, InvoiceItem, Client, Product
-from models import CompanyInfo
 
-# Minimal stand-in for ``faker`` to avoid external dependency.
-WORDS = [
-    "alpha",
-    "bravo",
-    "charlie",
-    "delta",
-    "echo",
-    "foxtrot",
-]
+import numpy as np
+from sqlalchemy import bindparam, func, insert, text, update
+from werkzeug.security import generate_password_hash
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import CATEGORIES, ITBIS_RATE, UNITS, app, db
+from ai import rebuild_recommendations, refresh_popularity
+from models import (
+    Client,
+    CompanyInfo,
+    InventoryMovement,
+    Invoice,
+    InvoiceItem,
+    Order,
+    OrderItem,
+    Payment,
+    Product,
+    ProductStock,
+    Quotation,
+    QuotationItem,
+    User,
+    Warehouse,
+    dom_now,
+)
+from receivables import EPSILON
 
-class SimpleFaker:
-    """Very small subset of Faker interface used for seeding tests."""
+# Tables whose ids the generator assigns itself.
+KEYED = (CompanyInfo, User, Warehouse, Client, Product, Quotation, Order, Invoice)
 
-    def word(self) -> str:
-        return random.choice(WORDS)
 
-    def name(self) -> str:
-        return f"Cliente {random.randint(1, 9999)}"
+@dataclass
+class SeedConfig:
+    invoices: int = 100_000  # across all companies
+    companies: int = 1
+    clients: int = 100  # per company
+    products: int = 50  # per company
+    warehouses: int = 2  # per company
+    lines: float = 2.5  # mean lines per document
+    days: int = 730  # history length
+    client_skew: float = 0.0  # Zipf exponents; 0 is uniform
+    product_skew: float = 0.0
+    company_skew: float = 0.0
+    paid_ratio: float = 0.6  # invoices paid in full
+    partial_ratio: float = 0.15  # invoices with a partial payment
+    open_quotations: float = 0.1  # vigente quotations per invoice
+    batch: int = 10_000  # invoices per transaction
+    seed: int = 0
+    now: datetime = field(default_factory=dom_now)
+    recommendations: bool = True  # rebuild the recommendation tables at the end
 
-    def date_time_between(self, start_date: str = "-2y", end_date: str = "now"):
-        end = datetime.now()
-        start = end - timedelta(days=730)
-        delta = end - start
-        return start + timedelta(seconds=random.randint(0, int(delta.total_seconds())))
 
+def _zipf(n, skew):
+    weights = np.arange(1, n + 1, dtype=float) ** -skew
+    return weights / weights.sum()
 
-fake = SimpleFaker()
 
+def _insert(model, rows):
+    if rows:
+        db.session.execute(insert(model.__table__), rows)
+    return len(rows)
 
-def seed_invoices(n: int = 100_000) -> None:
-    """Seed the database with ``n`` invoices for stress tests."""
-    with app.app_context():
-        db.create_all()
-        company = CompanyInfo.query.first()
-        if not company:
-            company = CompanyInfo(name='DemoCo', street='-', sector='-', province='-', phone='-', rnc='-')
-            db.session.add(company)
-            db.session.commit()
-        # ensure some products
-        products = Product.query.filter_by(company_id=company.id).all()
-        if not products:
-            for i in range(10):
-                p = Product(code=f'P{i}', name=fake.word(), unit='Unidad', price=random.uniform(5, 100),
-                            category='Alimentos y Bebidas', company_id=company.id)
-                db.session.add(p)
-            db.session.commit()
-            products = Product.query.filter_by(company_id=company.id).all()
-        # create clients
-        clients = Client.query.filter_by(company_id=company.id).all()
-        if not clients:
-            clients = [Client(name=fake.name(), company_id=company.id) for _ in range(100)]
-            db.session.add_all(clients)
+
+class _Generator:
+    def __init__(self, config):
+        self.config = config
+        self.rng = np.random.default_rng(config.seed)
+        self.next_id = {
+            model: (db.session.query(func.max(model.id)).scalar() or 0) + 1 for model in KEYED
+        }
+        self.counts = dict.fromkeys(
+            ['companies', 'clients', 'products', 'quotations', 'orders', 'invoices', 'payments',
+             'items', 'movements'], 0,
+        )
+        self.password = generate_password_hash('seed')
+
+    def ids(self, model, n):
+        start = self.next_id[model]
+        self.next_id[model] = start + n
+        return np.arange(start, start + n)
+
+    def dates(self, n, days):
+        seconds = self.rng.integers(0, max(days, 1) * 86400, n)
+        return (np.datetime64(self.config.now, 's') - seconds.astype('timedelta64[s]')).tolist()
+
+    # Master data -----------------------------------------------------
+
+    def company(self, n):
+        cfg = self.config
+        cid = int(self.ids(CompanyInfo, 1)[0])
+        _insert(CompanyInfo, [{
+            'id': cid, 'name': f'Empresa {n}', 'street': f'Calle {n}', 'sector': 'Centro',
+            'province': 'Santo Domingo', 'phone': '809-555-0000', 'rnc': f'1{cid:08d}',
+            'ncf_final': 1, 'ncf_fiscal': 1,
+        }])
+        user = int(self.ids(User, 1)[0])
+        _insert(User, [{'id': user, 'username': f'seed{cid}', 'password': self.password,
+                        'first_name': 'Seed', 'last_name': str(cid), 'role': 'manager', 'company_id': cid}])
+        warehouses = self.ids(Warehouse, cfg.warehouses)
+        _insert(Warehouse, [{'id': int(w), 'name': f'Almacén {k + 1}', 'company_id': cid}
+                            for k, w in enumerate(warehouses)])
+        clients = self.ids(Client, cfg.clients)
+        final = self.rng.random(cfg.clients) < 0.7
+        _insert(Client, [{
+            'id': int(c), 'name': f'Cliente {k + 1}', 'identifier': f'{cid:03d}{k + 1:08d}',
+            'email': f'cliente{k + 1}@empresa{cid}.example', 'phone': '809-555-0100',
+            'street': 'Av. Principal', 'sector': 'Centro', 'province': 'Santo Domingo',
+            'is_final_consumer': bool(f), 'outstanding': 0, 'company_id': cid,
+        } for k, (c, f) in enumerate(zip(clients, final.tolist()))])
+        products = self.ids(Product, cfg.products)
+        prices = np.round(self.rng.uniform(5, 500, cfg.products), 2)
+        categories = self.rng.integers(0, len(CATEGORIES), cfg.products)
+        units = self.rng.integers(0, len(UNITS), cfg.products)
+        catalog = {
+            'id': products,
+            'code': [f'E{cid}-P{k + 1:05d}' for k in range(cfg.products)],
+            'name': [f'Producto {k + 1}' for k in range(cfg.products)],
+            'price': prices,
+            'category': [CATEGORIES[k] for k in categories.tolist()],
+            'unit': [UNITS[k] for k in units.tolist()],
+        }
+        _insert(Product, [{
+            'id': int(p), 'code': code, 'name': name, 'unit': unit, 'price': float(price),
+            'category': category, 'has_itbis': True, 'stock': 0, 'min_stock': 5, 'company_id': cid,
+        } for p, code, name, unit, price, category in zip(
+            products.tolist(), catalog['code'], catalog['name'], catalog['unit'], prices.tolist(),
+            catalog['category'])])
+        db.session.commit()
+        self.counts['companies'] += 1
+        self.counts['clients'] += cfg.clients
+        self.counts['products'] += cfg.products
+        return {
+            'id': cid, 'user': user, 'warehouses': warehouses, 'clients': clients, 'final': final,
+            'catalog': catalog, 'client_p': _zipf(cfg.clients, cfg.client_skew),
+            'product_p': _zipf(cfg.products, cfg.product_skew),
+            'outstanding': np.zeros(cfg.clients),
+            'sold': np.zeros((cfg.products, cfg.warehouses), dtype=np.int64),
+        }
+
+    # Documents -------------------------------------------------------
+
+    def lines(self, company, n):
+        """Return ``(doc, product, quantity)`` arrays for ``n`` documents."""
+        per_doc = 1 + self.rng.poisson(max(self.config.lines - 1, 0), n)
+        doc = np.repeat(np.arange(n), per_doc)
+        product = self.rng.choice(len(company['product_p']), doc.size, p=company['product_p'])
+        quantity = self.rng.integers(1, 10, doc.size)
+        return doc, product, quantity
+
+    @staticmethod
+    def item_rows(company, parent_key, parents, doc, product, quantity):
+        catalog = company['catalog']
+        return [{
+            parent_key: int(parents[d]), 'code': catalog['code'][p], 'product_name': catalog['name'][p],
+            'unit': catalog['unit'][p], 'unit_price': float(catalog['price'][p]), 'quantity': int(q),
+            'discount': 0.0, 'category': catalog['category'][p], 'has_itbis': True,
+            'company_id': company['id'],
+        } for d, p, q in zip(doc.tolist(), product.tolist(), quantity.tolist())]
+
+    def totals(self, company, n, product, quantity, doc):
+        subtotal = np.round(np.bincount(doc, company['catalog']['price'][product] * quantity, minlength=n), 2)
+        itbis = np.round(subtotal * ITBIS_RATE, 2)
+        return subtotal, itbis, subtotal + itbis
+
+    def sales(self, company, n):
+        cfg, rng, cid = self.config, self.rng, company['id']
+        client = rng.choice(len(company['clients']), n, p=company['client_p'])
+        warehouse = rng.integers(0, len(company['warehouses']), n)
+        dates = self.dates(n, cfg.days)
+        doc, product, quantity = self.lines(company, n)
+        subtotal, itbis, total = self.totals(company, n, product, quantity, doc)
+        quotations, orders, invoices = self.ids(Quotation, n), self.ids(Order, n), self.ids(Invoice, n)
+
+        draw = rng.random(n)
+        paid = np.where(draw < cfg.paid_ratio, total,
+                        np.where(draw < cfg.paid_ratio + cfg.partial_ratio,
+                                 np.round(total * rng.uniform(0.1, 0.9, n), 2), 0))
+        balance = np.round(total - paid, 2)
+        paid_after = rng.integers(0, 60, n)
+        final = company['final'][client]
+        np.add.at(company['outstanding'], client, balance)
+        np.add.at(company['sold'], (product, warehouse[doc]), quantity)
+
+        clients = company['clients'][client].tolist()
+        wids = company['warehouses'][warehouse].tolist()
+        day = timedelta(days=1)
+        _insert(Quotation, [{
+            'id': int(q), 'client_id': c, 'date': d - day, 'valid_until': d + 29 * day,
+            'subtotal': float(s), 'itbis': float(i), 'total': float(t), 'seller': 'Vendedor',
+            'payment_method': 'Transferencia', 'status': 'convertida', 'company_id': cid, 'warehouse_id': w,
+        } for q, c, d, s, i, t, w in zip(quotations.tolist(), clients, dates, subtotal, itbis, total, wids)])
+        _insert(Order, [{
+            'id': o, 'client_id': c, 'quotation_id': q, 'date': d, 'status': 'Entregado',
+            'subtotal': float(s), 'itbis': float(i), 'total': float(t), 'seller': 'Vendedor',
+            'payment_method': 'Transferencia', 'warehouse_id': w, 'company_id': cid,
+        } for o, q, c, d, s, i, t, w in zip(
+            orders.tolist(), quotations.tolist(), clients, dates, subtotal, itbis, total, wids)])
+        _insert(Invoice, [{
+            'id': inv, 'client_id': c, 'order_id': o, 'date': d, 'subtotal': float(s), 'itbis': float(i),
+            'total': float(t), 'balance_due': float(b), 'ncf': f"{'B02' if f else 'B01'}{inv:08d}",
+            'seller': 'Vendedor', 'payment_method': 'Transferencia',
+            'invoice_type': 'Consumidor Final' if f else 'Crédito Fiscal',
+            'status': 'Pagada' if b <= EPSILON else 'Pendiente', 'warehouse_id': w, 'company_id': cid,
+        } for inv, o, c, d, s, i, t, b, f, w in zip(
+            invoices.tolist(), orders.tolist(), clients, dates, subtotal, itbis, total, balance.tolist(),
+            final.tolist(), wids)])
+        now = cfg.now
+        payments = _insert(Payment, [{
+            'invoice_id': inv, 'amount': float(a), 'date': min(d + int(k) * day, now),
+            'reference': f'SEED-{inv}', 'company_id': cid,
+        } for inv, a, d, k in zip(invoices.tolist(), paid.tolist(), dates, paid_after.tolist()) if a > 0])
+        items = _insert(QuotationItem, self.item_rows(company, 'quotation_id', quotations, doc, product, quantity))
+        items += _insert(OrderItem, self.item_rows(company, 'order_id', orders, doc, product, quantity))
+        items += _insert(InvoiceItem, self.item_rows(company, 'invoice_id', invoices, doc, product, quantity))
+        pids = company['catalog']['id']
+        movements = _insert(InventoryMovement, [{
+            'product_id': int(pids[p]), 'quantity': int(q), 'movement_type': 'salida', 'delta': -int(q),
+            'reference_type': 'Order', 'reference_id': int(orders[d]), 'timestamp': dates[d],
+            'warehouse_id': wids[d], 'company_id': cid, 'executed_by': company['user'],
+        } for d, p, q in zip(doc.tolist(), product.tolist(), quantity.tolist())])
+        for key, value in (('quotations', n), ('orders', n), ('invoices', n), ('payments', payments),
+                           ('items', items), ('movements', movements)):
+            self.counts[key] += value
+
+    def open_quotations(self, company, n):
+        if n <= 0:
+            return
+        client = self.rng.choice(len(company['clients']), n, p=company['client_p'])
+        dates = self.dates(n, 25)
+        doc, product, quantity = self.lines(company, n)
+        subtotal, itbis, total = self.totals(company, n, product, quantity, doc)
+        quotations = self.ids(Quotation, n)
+        _insert(Quotation, [{
+            'id': q, 'client_id': c, 'date': d, 'valid_until': d + timedelta(days=30),
+            'subtotal': float(s), 'itbis': float(i), 'total': float(t), 'seller': 'Vendedor',
+            'status': 'vigente', 'company_id': company['id'],
+        } for q, c, d, s, i, t in zip(
+            quotations.tolist(), company['clients'][client].tolist(), dates, subtotal, itbis, total)])
+        self.counts['items'] += _insert(
+            QuotationItem, self.item_rows(company, 'quotation_id', quotations, doc, product, quantity))
+        self.counts['quotations'] += n
+
+    def close(self, company):
+        """Store client balances, stock levels and the opening stock entries."""
+        cid, cfg = company['id'], self.config
+        clients = Client.__table__
+        db.session.execute(
+            update(clients).where(clients.c.id == bindparam('cid')).values(outstanding=bindparam('amount')),
+            [{'cid': int(c), 'amount': round(float(a), 2)}
+             for c, a in zip(company['clients'], company['outstanding']) if a > EPSILON],
+        )
+        sold = company['sold']
+        opening = sold + self.rng.integers(20, 500, sold.shape)
+        stock = opening - sold
+        pids, wids = company['catalog']['id'], company['warehouses']
+        start = cfg.now - timedelta(days=cfg.days + 1)
+        _insert(ProductStock, [{
+            'product_id': int(pids[p]), 'warehouse_id': int(wids[w]), 'stock': int(stock[p, w]),
+            'min_stock': 5, 'avg_cost': round(float(company['catalog']['price'][p]) * 0.6, 2), 'company_id': cid,
+        } for p in range(sold.shape[0]) for w in range(sold.shape[1])])
+        self.counts['movements'] += _insert(InventoryMovement, [{
+            'product_id': int(pids[p]), 'quantity': int(opening[p, w]), 'movement_type': 'entrada',
+            'delta': int(opening[p, w]), 'unit_cost': round(float(company['catalog']['price'][p]) * 0.6, 2),
+            'reference_type': 'Inicial', 'timestamp': start, 'warehouse_id': int(wids[w]),
+            'company_id': cid, 'executed_by': company['user'],
+        } for p in range(sold.shape[0]) for w in range(sold.shape[1])])
+        products = Product.__table__
+        db.session.execute(
+            update(products).where(products.c.id == bindparam('pid')).values(stock=bindparam('total')),
+            [{'pid': int(p), 'total': int(s)} for p, s in zip(pids, stock.sum(axis=1))],
+        )
+        last = self.next_id[Invoice]
+        db.session.execute(
+            update(CompanyInfo).where(CompanyInfo.id == cid).values(ncf_final=last, ncf_fiscal=last)
+        )
+        db.session.commit()
+
+    def sync_sequences(self):
+        """Move PostgreSQL sequences past the ids assigned here."""
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return
+        for model in KEYED:
+            table = model.__table__.name
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"
+            ))
+        db.session.commit()
+
+
+def generate(config=None, progress=None):
+    """Generate a dataset in the current app context; return row counts per kind."""
+    config = config or SeedConfig()
+    gen = _Generator(config)
+    shares = gen.rng.multinomial(config.invoices, _zipf(config.companies, config.company_skew))
+    for n, invoices in enumerate(shares.tolist(), start=1):
+        company = gen.company(n)
+        for start in range(0, invoices, config.batch):
+            gen.sales(company, min(config.batch, invoices - start))
             db.session.commit()
-        for _ in range(n):
-            client = random.choice(clients)
-            inv = Invoice(client_id=client.id, order_id=1, subtotal=0, itbis=0, total=0,
-                          invoice_type='Pagada', company_id=company.id,
-                          date=fake.date_time_between(start_date='-2y', end_date='now'))
-            db.session.add(inv)
-            db.session.flush()
-            total = 0
-            for _ in range(random.randint(1, 4)):
-                prod = random.choice(products)
-                qty = random.randint(1, 5)
-                line_total = prod.price * qty
-                total += line_total
-                db.session.add(InvoiceItem(invoice_id=inv.id, code=prod.code, product_name=prod.name,
-                                            unit=prod.unit, unit_price=prod.price, quantity=qty,
-                                            category=prod.category, company_id=company.id))
-            inv.subtotal = total
-            inv.itbis = round(total * 0.18, 2)
-            inv.total = inv.subtotal + inv.itbis
+            if progress:
+                progress(company['id'], min(start + config.batch, invoices), invoices)
+        gen.open_quotations(company, int(invoices * config.open_quotations))
+        gen.close(company)
+    gen.sync_sequences()
+    if config.recommendations:
+        rebuild_recommendations()
+        refresh_popularity(now=config.now, force=True)
         db.session.commit()
-        print(f"Seeded {n} invoices")
+    return gen.counts
+
+
+def seed_invoices(n: int = 100_000, **options) -> dict:
+    """Seed a company with ``n`` invoices and their related documents."""
+    with app.app_context():
+        db.create_all()
+        counts = generate(SeedConfig(invoices=n, **options))
+        db.session.remove()
+    return counts
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    for f in fields(SeedConfig):
+        if f.name in ('now', 'recommendations'):
+            continue
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=type(f.default), default=f.default)
+    parser.add_argument('--no-recommendations', action='store_true')
+    args = vars(parser.parse_args(argv))
+    config = SeedConfig(recommendations=not args.pop('no_recommendations'), **args)
+    began = time.perf_counter()
+
+    def progress(company_id, done, total):
+        print(f'empresa {company_id}: {done}/{total} facturas', flush=True)
+
+    with app.app_context():
+        db.create_all()
+        counts = generate(config, progress)
+    elapsed = time.perf_counter() - began
+    rows = sum(counts.values())
+    print(', '.join(f'{v} {k}' for k, v in counts.items()))
+    print(f'{rows} filas en {elapsed:.1f}s ({rows / elapsed * 60:,.0f} filas/min)')
 
 
 if __name__ == '__main__':
-    seed_invoices()
+    main()
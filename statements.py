@@ -0,0 +1,196 @@
+"""Batch account statements for every client with an open balance.
+
+:func:`statement_data` gathers what all statements of a tenant need in
+three queries: the grouped aging row per client
+(:func:`receivables.aging_query`), the client details, and every open
+invoice ordered by client.  Rendering with FPDF is CPU bound, so
+:func:`render_statements` spreads it over worker processes; each statement
+goes to its own file, so parallel renders never share a path.
+:func:`generate_statements` packs the PDFs and a summary CSV into one zip
+and emails each statement to clients with an address.
+"""
+from __future__ import annotations
+
+import csv
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from itertools import groupby
+
+from account_pdf import generate_account_statement_pdf
+from models import db, dom_now, Client, CompanyInfo, Invoice, Order
+from receivables import EPSILON, TERMS_DAYS, aging_query, aging_row
+
+STATEMENT_WORKERS = 4
+SUMMARY_HEADER = ['Cliente', 'RNC', 'Email', 'Facturas', 'Saldo', 'Vencido', 'Archivo', 'Correo']
+
+
+def company_dict(company):
+    return {
+        'name': company.name,
+        'street': company.street,
+        'phone': company.phone,
+        'rnc': company.rnc,
+        'logo': company.logo,
+    }
+
+
+def client_dict(client):
+    return {
+        'name': client.name,
+        'identifier': client.identifier,
+        'street': client.street,
+        'sector': client.sector,
+        'province': client.province,
+        'phone': client.phone,
+        'email': client.email,
+    }
+
+
+def statement_row(invoice_id, ncf, order_id, customer_po, date, note, total, balance):
+    due = date + timedelta(days=TERMS_DAYS)
+    return {
+        'document': ncf or f'FAC-{invoice_id}',
+        'order': customer_po or order_id,
+        'date': date.strftime('%d/%m/%Y'),
+        'due': due.strftime('%d/%m/%Y'),
+        'info': note or '',
+        'amount': total,
+        'balance': balance,
+    }
+
+
+def statement_data(company_id, as_of, client_ids=None):
+    """Return one payload dict per client owing money, largest balance first."""
+    aging = {row.client_id: aging_row(row) for row in aging_query(company_id, as_of)}
+    if client_ids is not None:
+        wanted = set(client_ids)
+        aging = {cid: data for cid, data in aging.items() if cid in wanted}
+    if not aging:
+        return []
+    clients = {
+        c.id: c for c in Client.query.filter(Client.company_id == company_id, Client.id.in_(list(aging)))
+    }
+    invoices = (
+        db.session.query(
+            Invoice.client_id, Invoice.id, Invoice.ncf, Invoice.order_id, Order.customer_po,
+            Invoice.date, Invoice.note, Invoice.total, Invoice.balance_due,
+        )
+        .outerjoin(Order, Order.id == Invoice.order_id)
+        .filter(
+            Invoice.company_id == company_id,
+            Invoice.client_id.in_(list(aging)),
+            Invoice.balance_due > EPSILON,
+        )
+        .order_by(Invoice.client_id, Invoice.date, Invoice.id)
+    )
+    rows = {
+        client_id: [statement_row(*inv[1:]) for inv in group]
+        for client_id, group in groupby(invoices.yield_per(1000), key=lambda inv: inv[0])
+    }
+    payloads = []
+    for client_id, data in aging.items():
+        balance = data['balance']
+        payloads.append({
+            'client_id': client_id,
+            'client': client_dict(clients[client_id]),
+            'rows': rows.get(client_id, []),
+            'total': balance,
+            'aging': data['buckets'],
+            'overdue': data['overdue'],
+            'overdue_pct': data['overdue'] / balance * 100 if balance else 0,
+        })
+    return payloads
+
+
+def _render(job):
+    company, payload, path, date = job
+    return generate_account_statement_pdf(
+        company, payload['client'], payload['rows'], payload['total'],
+        payload['aging'], payload['overdue_pct'], output_path=path, date=date,
+    )
+
+
+def render_statements(company, payloads, folder, date=None, workers=None):
+    """Render ``payloads`` into ``folder``; return the file paths in order.
+
+    With more than one worker the PDFs are rendered in a process pool.
+    """
+    workers = STATEMENT_WORKERS if workers is None else workers
+    jobs = [
+        (company, p, os.path.join(folder, f"estado_cuenta_{p['client_id']}.pdf"), date)
+        for p in payloads
+    ]
+    if workers > 1 and len(jobs) > 1:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_render, jobs, chunksize=chunksize))
+    return [_render(job) for job in jobs]
+
+
+def statement_email(company, payload):
+    return (
+        f"<p>Estimado(a) {payload['client']['name']},</p>"
+        f"<p>Adjuntamos su estado de cuenta con {company['name']}. "
+        f"Saldo pendiente: RD$ {payload['total']:,.2f}.</p>"
+    )
+
+
+def generate_statements(company_id, folder, name, as_of=None, workers=None, send=None, client_ids=None):
+    """Render all statements of ``company_id`` into ``folder/name``.zip.
+
+    ``send`` (usually ``send_email``) is called once per client with an
+    email address and must return a true value when the message was queued.  Returns a summary dict with ``clients``, ``emailed``,
+    ``failed`` (client names whose email could not be queued), ``balance``
+    and ``path``.
+    """
+    as_of = as_of or dom_now()
+    company = company_dict(db.session.get(CompanyInfo, company_id))
+    payloads = statement_data(company_id, as_of, client_ids)
+    os.makedirs(folder, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix=f'{name}_', dir=folder)
+    try:
+        paths = render_statements(company, payloads, workdir, as_of, workers)
+        summary = StringIO()
+        writer = csv.writer(summary)
+        writer.writerow(SUMMARY_HEADER)
+        emailed, failed = 0, []
+        zip_path = os.path.join(folder, f'{name}.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for payload, path in zip(payloads, paths):
+                filename = os.path.basename(path)
+                archive.write(path, filename)
+                status = ''
+                email = payload['client']['email']
+                if send and email:
+                    try:
+                        with open(path, 'rb') as f:
+                            queued = send(email, 'Estado de cuenta', statement_email(company, payload),
+                                          attachments=[(filename, f.read())])
+                    except Exception:  # pragma: no cover - reported in the summary
+                        queued = None
+                    if queued:
+                        emailed += 1
+                        status = 'enviado'
+                    else:  # e.g. mail is not configured
+                        failed.append(payload['client']['name'])
+                        status = 'error'
+                writer.writerow([
+                    payload['client']['name'], payload['client']['identifier'] or '', email or '',
+                    len(payload['rows']), f"{payload['total']:.2f}", f"{payload['overdue']:.2f}",
+                    filename, status,
+                ])
+            archive.writestr('resumen.csv', summary.getvalue())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'clients': len(payloads),
+        'emailed': emailed,
+        'failed': failed,
+        'balance': round(sum(p['total'] for p in payloads), 2),
+        'path': zip_path,
+    }
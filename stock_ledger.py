@@ -0,0 +1,218 @@
+"""Atomic stock mutations.
+
+Every change to ``ProductStock`` goes through :func:`apply_movements`, which
+never reads a stock level into Python and writes it back.  Outgoing stock is
+taken with a guarded ``UPDATE ... SET stock = stock - :q WHERE stock >= :q``
+so concurrent sales cannot oversell or lose updates; incoming stock is added
+with an ``INSERT ... ON CONFLICT`` upsert.  The denormalized ``Product.stock``
+is adjusted by relative updates and the ``InventoryMovement`` rows are
+bulk-inserted in the same transaction.  Committing (or rolling back on
+error) is left to the caller.
+
+Entries carrying a ``unit_cost`` also fold that cost into the warehouse's
+weighted-average cost (``ProductStock.avg_cost``) within the same upsert, so
+the average is always consistent with the stock it values.  Exits and
+uncosted entries leave the average unchanged.
+"""
+from __future__ import annotations
+
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import bindparam, case, func, insert, select, update
+
+from models import db, dialect_insert, InventoryMovement, Product, ProductStock
+
+StockLine = namedtuple(
+    'StockLine',
+    ['product_id', 'warehouse_id', 'quantity', 'movement_type', 'reference_id', 'unit_cost'],
+    defaults=(None, None),
+)
+
+ADJUST_RETRIES = 5
+
+
+class StockError(Exception):
+    """Raised when a stock operation cannot be applied."""
+
+
+class InsufficientStock(StockError):
+    def __init__(self, product_id, warehouse_id, quantity):
+        super().__init__(f'Stock insuficiente para producto {product_id} en almacén {warehouse_id}')
+        self.product_id = product_id
+        self.warehouse_id = warehouse_id
+        self.quantity = quantity
+
+
+_stock = ProductStock.__table__
+_product = Product.__table__
+
+_take = (
+    update(_stock)
+    .where(
+        _stock.c.company_id == bindparam('c'),
+        _stock.c.product_id == bindparam('p'),
+        _stock.c.warehouse_id == bindparam('w'),
+        _stock.c.stock >= bindparam('q'),
+    )
+    .values(stock=_stock.c.stock - bindparam('q'))
+)
+
+_swap = (
+    update(_stock)
+    .where(
+        _stock.c.company_id == bindparam('c'),
+        _stock.c.product_id == bindparam('p'),
+        _stock.c.warehouse_id == bindparam('w'),
+        _stock.c.stock == bindparam('old'),
+    )
+    .values(stock=bindparam('new'))
+)
+
+_shift_product = (
+    update(_product)
+    .where(_product.c.id == bindparam('p'))
+    .values(stock=func.coalesce(_product.c.stock, 0) + bindparam('delta'))
+)
+
+
+def _add(company_id, totals):
+    stmt = dialect_insert(ProductStock)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['product_id', 'warehouse_id'],
+        set_={'stock': func.coalesce(ProductStock.stock, 0) + stmt.excluded.stock},
+    )
+    db.session.execute(stmt, [
+        {'product_id': pid, 'warehouse_id': wid, 'stock': qty, 'company_id': company_id}
+        for (pid, wid), qty in totals
+    ])
+
+
+def _add_costed(company_id, totals):
+    """Add ``((product_id, warehouse_id), (quantity, value))`` entries at cost.
+
+    Stock without a known cost (a NULL or zero ``avg_cost``, e.g. from before
+    costing was tracked) takes the incoming cost instead of averaging it down.
+    """
+    stmt = dialect_insert(ProductStock)
+    old_stock = func.coalesce(ProductStock.stock, 0)
+    old_cost = func.coalesce(ProductStock.avg_cost, 0)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['product_id', 'warehouse_id'],
+        set_={
+            'stock': old_stock + new.stock,
+            'avg_cost': case(
+                (old_stock <= 0, new.avg_cost),
+                (old_cost <= 0, new.avg_cost),
+                else_=(old_stock * old_cost + new.stock * new.avg_cost) / (old_stock + new.stock),
+            ),
+        },
+    )
+    db.session.execute(stmt, [
+        {'product_id': pid, 'warehouse_id': wid, 'stock': qty, 'avg_cost': value / qty,
+         'company_id': company_id}
+        for (pid, wid), (qty, value) in totals
+    ])
+
+
+def _set(company_id, product_id, warehouse_id, quantity):
+    """Set an absolute stock level and return the previous one.
+
+    Uses compare-and-swap so a concurrent change between reading and
+    writing is detected and retried instead of silently overwritten.
+    """
+    for _attempt in range(ADJUST_RETRIES):
+        old = db.session.execute(
+            select(_stock.c.stock).where(
+                _stock.c.company_id == company_id,
+                _stock.c.product_id == product_id,
+                _stock.c.warehouse_id == warehouse_id,
+            )
+        ).scalar()
+        if old is None:
+            stmt = dialect_insert(ProductStock).on_conflict_do_nothing(
+                index_elements=['product_id', 'warehouse_id'],
+            )
+            inserted = db.session.execute(stmt, {
+                'product_id': product_id, 'warehouse_id': warehouse_id,
+                'stock': quantity, 'company_id': company_id,
+            }).rowcount
+            if inserted:
+                return 0
+            continue
+        swapped = db.session.execute(_swap, {
+            'c': company_id, 'p': product_id, 'w': warehouse_id, 'old': old, 'new': quantity,
+        }).rowcount
+        if swapped:
+            return old
+    raise StockError(f'No se pudo ajustar el stock del producto {product_id}')
+
+
+def apply_movements(company_id, user_id, lines, reference_type=None, reference_id=None):
+    """Apply ``StockLine`` changes atomically within the current transaction.
+
+    ``movement_type`` is ``entrada`` (add), ``salida`` (take, failing with
+    :class:`InsufficientStock` if not enough is available) or ``ajuste``
+    (set an absolute level).  Lines touching the same product and warehouse
+    are combined, and rows are locked in a stable order to avoid deadlocks
+    between concurrent multi-SKU operations.  Returns the movement rows
+    inserted.
+    """
+    lines = [StockLine(*line) for line in lines]
+    takes = defaultdict(int)
+    adds = defaultdict(int)
+    costed = defaultdict(lambda: [0, 0.0])
+    for line in lines:
+        key = (line.product_id, line.warehouse_id)
+        if line.movement_type == 'salida':
+            takes[key] += line.quantity
+        elif line.movement_type == 'entrada':
+            if line.unit_cost is not None and line.quantity > 0:
+                costed[key][0] += line.quantity
+                costed[key][1] += line.quantity * line.unit_cost
+            else:
+                adds[key] += line.quantity
+
+    product_delta = defaultdict(int)
+    for (pid, wid), qty in sorted(takes.items()):
+        taken = db.session.execute(_take, {'c': company_id, 'p': pid, 'w': wid, 'q': qty}).rowcount
+        if not taken:
+            raise InsufficientStock(pid, wid, qty)
+        product_delta[pid] -= qty
+    if adds:
+        _add(company_id, sorted(adds.items()))
+        for (pid, _wid), qty in adds.items():
+            product_delta[pid] += qty
+    if costed:
+        _add_costed(company_id, sorted(costed.items()))
+        for (pid, _wid), (qty, _value) in costed.items():
+            product_delta[pid] += qty
+
+    movements = []
+    for line in lines:
+        quantity = line.quantity
+        delta = -quantity if line.movement_type == 'salida' else quantity
+        if line.movement_type == 'ajuste':
+            old = _set(company_id, line.product_id, line.warehouse_id, line.quantity)
+            delta = line.quantity - old
+            quantity = abs(delta)
+            product_delta[line.product_id] += delta
+        movements.append({
+            'product_id': line.product_id,
+            'quantity': quantity,
+            'movement_type': line.movement_type,
+            'delta': delta,
+            'unit_cost': line.unit_cost,
+            'reference_type': reference_type,
+            'reference_id': line.reference_id if line.reference_id is not None else reference_id,
+            'warehouse_id': line.warehouse_id,
+            'company_id': company_id,
+            'executed_by': user_id,
+        })
+
+    deltas = [{'p': pid, 'delta': delta} for pid, delta in sorted(product_delta.items()) if delta]
+    if deltas:
+        db.session.execute(_shift_product, deltas)
+    if movements:
+        db.session.execute(insert(InventoryMovement), movements)
+    return movements
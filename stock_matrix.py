@@ -0,0 +1,152 @@
+"""Product × warehouse stock matrix and cached warehouse sales totals.
+
+``stock_matrix`` pivots ``ProductStock`` into one row per product with a
+column per warehouse using conditional aggregation, so a page of the matrix
+is a single grouped query regardless of how many warehouses exist.
+
+``warehouse_sales`` returns ``sum(Invoice.total)`` per warehouse from one
+grouped query and keeps the result per company for ``TTL`` seconds.  The
+entry is dropped when a transaction touching ``Invoice`` commits, the same
+way :mod:`tenant_cache` handles company rows; invoices committed by other
+worker processes show up once the entry expires.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session
+
+from models import db, Invoice, Product, ProductStock, Warehouse
+
+TTL = 30
+MAX_PER_PAGE = 200
+
+_sales: dict[int, tuple[float, dict]] = {}
+_lock = threading.Lock()
+
+
+def warehouse_sales(company_id):
+    """Return ``{warehouse_id: invoiced total}`` for ``company_id``."""
+    now = time.monotonic()
+    entry = _sales.get(company_id)
+    if entry and now - entry[0] < TTL:
+        return entry[1]
+    totals = {
+        wid: float(total or 0)
+        for wid, total in db.session.query(Invoice.warehouse_id, func.sum(Invoice.total))
+        .filter(Invoice.company_id == company_id)
+        .group_by(Invoice.warehouse_id)
+    }
+    with _lock:
+        _sales[company_id] = (now, totals)
+    return totals
+
+
+def invalidate_sales(company_id=None):
+    with _lock:
+        if company_id is None:
+            _sales.clear()
+        else:
+            _sales.pop(company_id, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_invoice_changes(session, flush_context):
+    changed = session.info.setdefault('sales_cache_dirty', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Invoice):
+            changed.add(obj.company_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    for company_id in session.info.pop('sales_cache_dirty', ()):
+        invalidate_sales(company_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('sales_cache_dirty', None)
+
+
+def matrix_query(company_id, warehouses, q=None, category=None, imbalanced=False):
+    """Grouped query yielding one row per product with a ``w<id>`` column per warehouse."""
+    stock = func.coalesce(ProductStock.stock, 0)
+    cells = [
+        func.sum(case((ProductStock.warehouse_id == w.id, stock), else_=0)).label(f'w{w.id}')
+        for w in warehouses
+    ]
+    total = func.coalesce(func.sum(stock), 0)
+    query = (
+        db.session.query(Product.id, Product.code, Product.name, *cells, total.label('total'))
+        .outerjoin(
+            ProductStock,
+            (ProductStock.product_id == Product.id) & (ProductStock.company_id == company_id),
+        )
+        .filter(Product.company_id == company_id)
+        .group_by(Product.id, Product.code, Product.name)
+    )
+    if q:
+        like = f'%{q}%'
+        query = query.filter(or_(Product.name.ilike(like), Product.code.ilike(like)))
+    if category:
+        query = query.filter(Product.category == category)
+    if imbalanced:
+        # Stocked somewhere but missing or empty in at least one warehouse.
+        query = query.having(
+            total > 0,
+            or_(func.count(ProductStock.id) < len(warehouses), func.min(stock) == 0),
+        )
+    return query.order_by(Product.name, Product.id)
+
+
+def _row(row, warehouses):
+    return {
+        'product_id': row.id,
+        'code': row.code,
+        'name': row.name,
+        'stock': {w.id: int(getattr(row, f'w{w.id}') or 0) for w in warehouses},
+        'total': int(row.total or 0),
+    }
+
+
+def company_warehouses(company_id):
+    return Warehouse.query.filter_by(company_id=company_id).order_by(Warehouse.name).all()
+
+
+def stock_matrix(company_id, page=1, per_page=50, **filters):
+    """Return one page of the matrix plus warehouse headers and sales totals."""
+    warehouses = company_warehouses(company_id)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    rows = (
+        matrix_query(company_id, warehouses, **filters)
+        .limit(per_page + 1)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    sales = warehouse_sales(company_id)
+    return {
+        'warehouses': [
+            {'id': w.id, 'name': w.name, 'sales_total': sales.get(w.id, 0.0)} for w in warehouses
+        ],
+        'rows': [_row(r, warehouses) for r in rows[:per_page]],
+        'page': page,
+        'per_page': per_page,
+        'has_next': len(rows) > per_page,
+    }
+
+
+def iter_matrix(company_id, warehouses, batch=1000, **filters):
+    """Yield every matrix row, reading ``batch`` products at a time."""
+    query = matrix_query(company_id, warehouses, **filters)
+    offset = 0
+    while True:
+        rows = query.limit(batch).offset(offset).all()
+        for r in rows:
+            yield _row(r, warehouses)
+        if len(rows) < batch:
+            break
+        offset += batch
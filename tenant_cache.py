@@ -0,0 +1,92 @@
+"""Per-process cache of tenant (``CompanyInfo``) snapshots.
+
+Nearly every request needs the active company for the layout, PDFs and
+exports.  Instead of querying ``CompanyInfo`` each time, request helpers read
+an immutable snapshot from this cache.  Entries are invalidated explicitly
+when a company row changes in this process; other worker processes only see
+the change once their entry expires, after ``TTL`` seconds.  Snapshots
+therefore hold display settings only: NCF counters change with every
+invoice and are always read from the row itself.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import inc
+from models import CompanyInfo
+
+TTL = 30
+
+_cache: dict[int, tuple[float, "CompanySnapshot"]] = {}
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class CompanySnapshot:
+    """Read-only copy of the columns of a ``CompanyInfo`` row."""
+
+    id: int
+    name: str
+    street: str
+    sector: str
+    province: str
+    phone: str
+    rnc: str
+    website: str | None = None
+    logo: str | None = None
+
+    @classmethod
+    def from_model(cls, company: CompanyInfo) -> "CompanySnapshot":
+        return cls(**{f.name: getattr(company, f.name) for f in fields(cls)})
+
+
+def get_company(company_id):
+    """Return the cached snapshot for ``company_id`` or ``None``."""
+    if not company_id:
+        return None
+    now = time.monotonic()
+    entry = _cache.get(company_id)
+    if entry and now - entry[0] < TTL:
+        inc('tiendix_cache_requests_total', cache='company', result='hit')
+        return entry[1]
+    inc('tiendix_cache_requests_total', cache='company', result='miss')
+    company = CompanyInfo.query.get(company_id)
+    if not company:
+        return None
+    snapshot = CompanySnapshot.from_model(company)
+    with _lock:
+        _cache[company_id] = (now, snapshot)
+    return snapshot
+
+
+def invalidate_company(company_id=None) -> None:
+    """Drop one tenant snapshot, or every snapshot when no id is given."""
+    with _lock:
+        if company_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(company_id, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_company_changes(session, flush_context):
+    changed = session.info.setdefault('tenant_cache_dirty', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CompanyInfo) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    for company_id in session.info.pop('tenant_cache_dirty', ()):
+        invalidate_company(company_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('tenant_cache_dirty', None)
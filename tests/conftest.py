@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import tenant_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_tenant_cache():
+    """Every test database reuses company id 1; don't serve the last test's snapshot."""
+    tenant_cache.invalidate_company()
+    yield
+    tenant_cache.invalidate_company()
@@ -1,8 +1,390 @@
-from locust import HttpUser, task, between
+"""Load tests for the quotation → order → invoice workflow.
 
-class ReportUser(HttpUser):
+Run against a server seeded with ``scripts/seed_invoices.py`` (its manager
+for company 1 is ``seed1``/``seed``)::
+
+    locust -f tests/locustfile.py --host http://localhost:5000
+    locust -f tests/locustfile.py --host http://localhost:5000 --headless \\
+        -u 50 -r 5 --run-time 5m --results results/v1.json --label v1
+    python tests/locustfile.py compare results/v1.json results/v2.json
+
+Each role logs in as its own user class.  ``CompanyUser`` (regular staff)
+searches clients and writes quotations.  ``ManagerUser`` runs full sales
+(quotation → order → invoice → PDF), adjusts stock and exports reports.
+``AdminUser`` selects the company and reads reports and admin pages.
+
+When the test starts, a setup hook uses the manager account to prepare the
+data through the application's own endpoints:
+
+* ``CARGA-*`` products with plenty of stock in the first warehouse,
+* the ``company`` role user,
+* one client per simulated user, created through ``/api/clients``.
+
+Requests with ids in the URL are grouped by name (``/facturas/[id]/pdf``).
+In headless mode, ``--results`` writes latency percentiles per endpoint to
+a JSON file, and ``compare`` diffs two such files.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from gevent.lock import Semaphore
+from locust import HttpUser, between, events, task
+from locust.clients import HttpSession
+from locust.runners import MasterRunner, WorkerRunner
+
+CATALOG_SIZE = 8
+CATALOG_STOCK = 1_000_000
+CSRF_MAX_AGE = 1800  # seconds; Flask-WTF tokens expire after an hour
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+_CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+_QUOTATION = re.compile(r'/cotizaciones/(\d+)/convertir')
+_ORDER = re.compile(r'/pedidos/(\d+)/facturar')
+_INVOICE = re.compile(r'/facturas/(\d+)/pdf')
+
+catalog = {'products': [], 'warehouse_id': None}
+_setup_lock = Semaphore()
+
+
+@events.init_command_line_parser.add_listener
+def _add_arguments(parser):
+    group = parser.add_argument_group('Tiendix')
+    group.add_argument('--company-id', type=int, default=1, env_var='LOCUST_COMPANY_ID',
+                       help='Company the admin selects')
+    group.add_argument('--manager-user', default='seed1', env_var='LOCUST_MANAGER_USER')
+    group.add_argument('--manager-password', default='seed', env_var='LOCUST_MANAGER_PASSWORD')
+    group.add_argument('--company-user', default='carga', env_var='LOCUST_COMPANY_USER',
+                       help='Created by the setup hook when missing')
+    group.add_argument('--company-password', default='carga', env_var='LOCUST_COMPANY_PASSWORD')
+    group.add_argument('--admin-user', default='admin', env_var='LOCUST_ADMIN_USER')
+    group.add_argument('--admin-password', default=os.environ.get('ADMIN_PASSWORD', '363636'),
+                       env_var='LOCUST_ADMIN_PASSWORD')
+    group.add_argument('--results', default='', env_var='LOCUST_RESULTS',
+                       help='JSON file for per-endpoint latency percentiles')
+    group.add_argument('--label', default='', env_var='LOCUST_LABEL',
+                       help='Version label stored in the results file')
+
+
+class Session:
+    """Login and CSRF handling shared by the setup hook and the users."""
+
+    def __init__(self, client):
+        self.client = client
+        self.token_at = 0
+
+    def refresh_token(self, url='/clientes'):
+        resp = self.client.get(url, name='csrf')
+        match = _CSRF.search(resp.text)
+        if match:
+            self.client.headers['X-CSRFToken'] = match.group(1)
+        self.token_at = time.monotonic()
+
+    def login(self, username, password, report=True):
+        resp = self.client.get('/login', name='/login')
+        match = _CSRF.search(resp.text)
+        data = {'username': username, 'password': password}
+        if match:
+            data['csrf_token'] = match.group(1)
+            self.client.headers['X-CSRFToken'] = match.group(1)
+        self.token_at = time.monotonic()
+        with self.client.post('/login', data=data, name='/login', allow_redirects=False,
+                              catch_response=True) as resp:
+            if resp.status_code != 302:
+                if report:
+                    resp.failure(f'login failed for {username}')
+                else:
+                    resp.success()
+                return False
+        return True
+
+    def submit(self, url, data, name, expect):
+        """POST a form; success is a redirect whose target passes ``expect``."""
+        if time.monotonic() - self.token_at > CSRF_MAX_AGE:
+            self.refresh_token()
+        with self.client.post(url, data=data, name=name, allow_redirects=False,
+                              catch_response=True) as resp:
+            location = resp.headers.get('Location', '')
+            if resp.status_code != 302 or not expect(location):
+                resp.failure(f'{resp.status_code} → {location or "no redirect"}')
+                return False
+        return True
+
+    def latest(self, url, name, pattern):
+        """Id of the first ``pattern`` link on a filtered listing (newest first)."""
+        match = pattern.search(self.client.get(url, name=name).text)
+        return int(match.group(1)) if match else None
+
+
+def _http(environment):
+    return HttpSession(environment.host, environment.events.request, user=None)
+
+
+def _prepare(environment):
+    """Create the load catalog, its stock and the company user, once."""
+    with _setup_lock:
+        if catalog['products']:
+            return
+        options = environment.parsed_options
+        s = Session(_http(environment))
+        if not s.login(options.manager_user, options.manager_password):
+            raise RuntimeError('El usuario manager no pudo iniciar sesión')
+        s.refresh_token()
+        matrix = s.client.get('/api/inventario/matriz', params={'q': 'CARGA-', 'per_page': 100},
+                              name='/api/inventario/matriz').json()
+        if not matrix['warehouses']:
+            s.submit('/almacenes', {'name': 'Almacén carga'}, '/almacenes', lambda loc: True)
+        existing = {row['code'] for row in matrix['rows']}
+        for n in range(1, CATALOG_SIZE + 1):
+            code = f'CARGA-{n:02d}'
+            if code not in existing:
+                s.submit('/productos', {'code': code, 'name': f'Producto carga {n:02d}', 'unit': 'Unidad',
+                                        'price': 100 * n, 'has_itbis': 'y'}, '/productos', lambda loc: True)
+        matrix = s.client.get('/api/inventario/matriz', params={'q': 'CARGA-', 'per_page': 100},
+                              name='/api/inventario/matriz').json()
+        warehouse_id = matrix['warehouses'][0]['id']
+        for row in matrix['rows']:
+            missing = CATALOG_STOCK - row['stock'].get(str(warehouse_id), 0)
+            if missing > 0:
+                s.submit('/inventario/ajustar',
+                         {'product_id': row['product_id'], 'warehouse_id': warehouse_id,
+                          'quantity': missing, 'movement_type': 'entrada'},
+                         '/inventario/ajustar', lambda loc: 'ajustar' not in loc)
+        if not Session(_http(environment)).login(options.company_user, options.company_password, report=False):
+            s.submit('/ajustes/usuarios/agregar',
+                     {'username': options.company_user, 'password': options.company_password,
+                      'first_name': 'Usuario', 'last_name': 'Carga'},
+                     '/ajustes/usuarios/agregar', lambda loc: 'agregar' not in loc)
+        catalog['warehouse_id'] = warehouse_id
+        catalog['products'] = [row['product_id'] for row in matrix['rows']]
+
+
+@events.test_start.add_listener
+def _on_test_start(environment, **kwargs):
+    if not isinstance(environment.runner, MasterRunner):
+        _prepare(environment)
+
+
+class TiendixUser(HttpUser):
+    abstract = True
     wait_time = between(1, 5)
+    username_option = password_option = None
+
+    def on_start(self):
+        _prepare(self.environment)
+        options = self.environment.parsed_options
+        self.s = Session(self.client)
+        if not self.s.login(getattr(options, self.username_option), getattr(options, self.password_option)):
+            self.stop()
+            return
+        self.after_login(options)
+
+    def after_login(self, options):
+        self.s.refresh_token()
+        self.identifier = f'CARGA-{uuid.uuid4().hex[:10]}'
+        resp = self.client.post('/api/clients', name='/api/clients', json={
+            'name': 'Cliente carga', 'last_name': self.identifier, 'type': 'final',
+            'identifier': self.identifier,
+        })
+        self.client_id = resp.json()['id'] if resp.ok else None
+
+    def create_quotation(self):
+        products = random.sample(catalog['products'], k=min(3, len(catalog['products'])))
+        return self.s.submit('/cotizaciones/nueva', {
+            'client_id': self.client_id,
+            'warehouse_id': catalog['warehouse_id'],
+            'product_id[]': products,
+            'product_quantity[]': [random.randint(1, 5) for _ in products],
+            'product_discount[]': [0 for _ in products],
+            'payment_method': 'Efectivo',
+        }, '/cotizaciones/nueva', lambda loc: loc.endswith('/cotizaciones'))
+
+    def latest_quotation(self):
+        return self.s.latest(f'/cotizaciones?client={self.identifier}&status=vigente',
+                             '/cotizaciones?client=[cliente]', _QUOTATION)
 
-    @task
-    def view_reports(self):
+    @task(4)
+    def search_clients(self):
+        self.client.get(f'/clientes?q=Cliente {random.randint(1, 99)}', name='/clientes?q=[texto]')
+
+
+class CompanyUser(TiendixUser):
+    """Sales staff: client lookups and quotations."""
+    weight = 6
+    username_option, password_option = 'company_user', 'company_password'
+
+    @task(3)
+    def list_quotations(self):
+        self.client.get('/cotizaciones')
+
+    @task(2)
+    def quotation_form(self):
+        self.client.get('/cotizaciones/nueva')
+
+    @task(3)
+    def new_quotation(self):
+        if self.client_id:
+            self.create_quotation()
+
+    @task(1)
+    def quotation_pdf(self):
+        if self.client_id and (quotation_id := self.latest_quotation()):
+            self.client.get(f'/cotizaciones/{quotation_id}/pdf', name='/cotizaciones/[id]/pdf')
+
+    @task(2)
+    def inventory(self):
+        self.client.get('/inventario')
+
+
+class ManagerUser(TiendixUser):
+    """Managers close sales, move stock and export reports."""
+    weight = 3
+    username_option, password_option = 'manager_user', 'manager_password'
+
+    @task(4)
+    def sale(self):
+        if not self.client_id or not self.create_quotation():
+            return
+        quotation_id = self.latest_quotation()
+        if not quotation_id or not self.s.submit(
+            f'/cotizaciones/{quotation_id}/convertir', {'warehouse_id': catalog['warehouse_id']},
+            '/cotizaciones/[id]/convertir', lambda loc: '/pedidos' in loc,
+        ):
+            return
+        order_id = self.s.latest(f'/pedidos?q={self.identifier}', '/pedidos?q=[cliente]', _ORDER)
+        if not order_id:
+            return
+        with self.client.get(f'/pedidos/{order_id}/facturar', name='/pedidos/[id]/facturar',
+                             allow_redirects=False, catch_response=True) as resp:
+            if '/facturas' not in resp.headers.get('Location', ''):
+                resp.failure('la factura no se generó')
+                return
+        invoice_id = self.s.latest(f'/facturas?q={self.identifier}', '/facturas?q=[cliente]', _INVOICE)
+        if invoice_id:
+            self.client.get(f'/facturas/{invoice_id}/pdf', name='/facturas/[id]/pdf')
+
+    @task(2)
+    def adjust_stock(self):
+        self.s.submit('/inventario/ajustar', {
+            'product_id': random.choice(catalog['products']), 'warehouse_id': catalog['warehouse_id'],
+            'quantity': random.randint(1, 20), 'movement_type': 'entrada',
+        }, '/inventario/ajustar', lambda loc: 'ajustar' not in loc)
+
+    @task(2)
+    def reports(self):
         self.client.get('/reportes')
+
+    @task(1)
+    def aging(self):
+        self.client.get('/api/reportes/antiguedad')
+
+    @task(1)
+    def export(self):
+        since = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        self.client.get(f'/reportes/export?formato=csv&fecha_inicio={since}',
+                        name='/reportes/export?formato=csv')
+
+
+class AdminUser(TiendixUser):
+    """Administrators review a tenant's reports and the admin pages."""
+    weight = 1
+    username_option, password_option = 'admin_user', 'admin_password'
+
+    def after_login(self, options):
+        self.client.get(f'/admin/companies/select/{options.company_id}', name='/admin/companies/select/[id]')
+        self.s.refresh_token()
+
+    @task(3)
+    def reports(self):
+        self.client.get('/reportes?ajax=1', name='/reportes?ajax=1')
+
+    @task(1)
+    def export(self):
+        since = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        self.client.get(f'/reportes/export?formato=xlsx&fecha_inicio={since}',
+                        name='/reportes/export?formato=xlsx')
+
+    @task(1)
+    def stock_matrix(self):
+        self.client.get('/api/inventario/matriz')
+
+    @task(1)
+    def maintenance(self):
+        self.client.get('/admin/mantenimiento')
+
+    @task(1)
+    def outbox(self):
+        self.client.get('/admin/correos')
+
+
+def summarize(stats):
+    """Per-endpoint request counts and latency percentiles in milliseconds."""
+    endpoints = {}
+    for (name, method), entry in sorted(stats.entries.items()):
+        if not entry.num_requests:
+            continue
+        row = {
+            'requests': entry.num_requests,
+            'failures': entry.num_failures,
+            'rps': round(entry.total_rps, 2),
+            'avg': round(entry.avg_response_time, 1),
+            'max': round(entry.max_response_time, 1),
+        }
+        for p in PERCENTILES:
+            row[f'p{int(p * 100)}'] = entry.get_response_time_percentile(p)
+        endpoints[f'{method} {name}'] = row
+    return endpoints
+
+
+@events.quitting.add_listener
+def _write_results(environment, **kwargs):
+    options = environment.parsed_options
+    path = getattr(options, 'results', '') if options else ''
+    if not path or isinstance(environment.runner, WorkerRunner):
+        return
+    results = {
+        'label': options.label,
+        'host': environment.host,
+        'users': options.num_users,
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'endpoints': summarize(environment.stats),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(old_path, new_path, tolerance=0.2, out=sys.stdout):
+    """Print p50/p95 changes per endpoint; return the endpoints whose p95
+    grew by more than ``tolerance``."""
+    with open(old_path) as f:
+        old = json.load(f)['endpoints']
+    with open(new_path) as f:
+        new = json.load(f)['endpoints']
+    regressions = []
+    out.write(f'{"endpoint":50} {"p50":>16} {"p95":>16}\n')
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            out.write(f'{name:50} {"solo en " + ("nuevo" if name in new else "anterior"):>33}\n')
+            continue
+        a, b = old[name], new[name]
+        out.write(f'{name:50} {a["p50"]:>7} → {b["p50"]:<6} {a["p95"]:>7} → {b["p95"]:<6}\n')
+        if a['p95'] and b['p95'] > a['p95'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'compare':
+        sys.exit('uso: python tests/locustfile.py compare ANTERIOR.json NUEVO.json [TOLERANCIA]')
+    slower = compare(sys.argv[2], sys.argv[3], float(sys.argv[4]) if len(sys.argv) > 4 else 0.2)
+    if slower:
+        print('p95 más lento en: ' + ', '.join(slower))
+    sys.exit(1 if slower else 0)
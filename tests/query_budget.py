@@ -0,0 +1,25 @@
+"""Query budget assertions for endpoint tests.
+
+``assert_query_budget(client, '/facturas', 5)`` fails when the request runs
+more than 5 SQL statements, or repeats one statement shape often enough to
+look like an N+1 (see :mod:`query_stats`), and lists the statements run.
+"""
+from query_stats import N_PLUS_ONE, count_queries
+
+
+def _describe(stats):
+    return '\n'.join(f'  {n} x {shape}' for shape, n in stats.shapes().most_common())
+
+
+def assert_query_budget(client, url, max_queries, repeat_threshold=N_PLUS_ONE, **kwargs):
+    """GET ``url`` (``method='post'`` etc. via kwargs) within ``max_queries``; return the response."""
+    method = kwargs.pop('method', 'get')
+    with count_queries() as stats:
+        resp = getattr(client, method)(url, **kwargs)
+    assert resp.status_code < 400, f'{url}: HTTP {resp.status_code}'
+    assert stats.count <= max_queries, (
+        f'{url}: {stats.count} queries, budget {max_queries}\n{_describe(stats)}'
+    )
+    repeated = stats.repeated(repeat_threshold)
+    assert not repeated, f'{url}: likely N+1\n{_describe(stats)}'
+    return resp
@@ -0,0 +1,70 @@
+"""Minimal local SMTP server for tests.
+
+Speaks enough SMTP for ``smtplib`` (no TLS or AUTH) and records every
+message it accepts.  ``fail_next`` makes the next N ``RCPT`` commands fail
+with a temporary 451 reply, to exercise retries.
+"""
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self._reply('220 stub ESMTP')
+        sender, recipients = None, []
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self._reply('250 stub')
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(' <>'), []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                if server.fail_next:
+                    server.fail_next -= 1
+                    self._reply('451 Try again later')
+                else:
+                    recipients.append(command.split(':', 1)[1].strip(' <>'))
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                server.messages.append((sender, recipients, b''.join(lines).decode()))
+                self._reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self.port = self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,126 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db, _migrate_legacy_schema
+from models import CompanyInfo, User, Client, Order, Invoice, Payment
+from balances import reconcile_balances, top_debtors
+
+
+def _invoice(comp_id, client_id, total):
+    order = Order(client_id=client_id, subtotal=total, itbis=0, total=total, company_id=comp_id)
+    db.session.add(order); db.session.flush()
+    inv = Invoice(client_id=client_id, order_id=order.id, subtotal=total, itbis=0, total=total,
+                  invoice_type='Consumidor Final', company_id=comp_id)
+    db.session.add(inv); db.session.flush()
+    return inv
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        ana = Client(name='Ana', company_id=comp.id)
+        beto = Client(name='Beto', company_id=comp.id)
+        db.session.add_all([user, ana, beto])
+        db.session.flush()
+        _invoice(comp.id, ana.id, 100)
+        _invoice(comp.id, ana.id, 250)
+        _invoice(comp.id, beto.id, 80)
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _balances():
+    return (
+        {c.name: c.outstanding for c in Client.query},
+        {i.id: (i.balance_due, i.status) for i in Invoice.query},
+    )
+
+
+def test_balances_follow_payments_and_invoices(client):
+    with app.app_context():
+        assert _balances()[0] == {'Ana': 350, 'Beto': 80}
+        db.session.add(Payment(invoice_id=2, amount=50, company_id=1))
+        db.session.commit()
+        inv = db.session.get(Invoice, 2)
+        assert inv.balance_due == 200 and inv.status == 'Pendiente'
+        assert db.session.get(Client, 1).outstanding == 300
+        pay = Payment(invoice_id=1, amount=100, company_id=1)
+        db.session.add(pay)
+        db.session.commit()
+        assert db.session.get(Invoice, 1).status == 'Pagada'
+        db.session.delete(pay)
+        db.session.commit()
+        assert _balances()[1][1] == (100, 'Pendiente')
+        db.session.delete(db.session.get(Invoice, 2))
+        db.session.commit()
+        assert _balances()[0] == {'Ana': 100, 'Beto': 80}
+        assert reconcile_balances(repair=False) == (0, 0)
+
+
+def test_pay_invoice_records_remaining_balance(client):
+    with app.app_context():
+        db.session.add(Payment(invoice_id=2, amount=50, company_id=1))
+        db.session.commit()
+    client.post('/facturas/2/pagar')
+    with app.app_context():
+        assert db.session.query(db.func.sum(Payment.amount)).filter_by(invoice_id=2).scalar() == 250
+        assert _balances()[0] == {'Ana': 100, 'Beto': 80}
+        assert _balances()[1][2] == (0, 'Pagada')
+
+
+def test_reconcile_repairs_drift(client):
+    with app.app_context():
+        db.session.execute(db.update(Invoice).where(Invoice.id == 3).values(balance_due=5))
+        db.session.execute(db.insert(Payment).values(invoice_id=1, amount=40, company_id=1))
+        db.session.commit()
+        assert reconcile_balances(repair=False) == (2, 1)
+        assert reconcile_balances() == (2, 1)
+        db.session.commit()
+        assert _balances()[0] == {'Ana': 310, 'Beto': 80}
+        assert reconcile_balances(repair=False) == (0, 0)
+
+
+def test_legacy_paid_invoices_without_payments_are_settled(client):
+    with app.app_context():
+        # A database from before stored balances: invoice 1 was marked paid
+        # without recording a payment, invoice 2 was partly paid.
+        db.session.execute(db.update(Invoice).where(Invoice.id == 1).values(status='Pagada'))
+        db.session.execute(db.insert(Payment).values(invoice_id=2, amount=50, company_id=1))
+        for stmt in (
+            'DROP INDEX ix_invoice_company_client_balance',
+            'DROP INDEX ix_client_company_outstanding',
+            'ALTER TABLE invoice DROP COLUMN balance_due',
+            'ALTER TABLE client DROP COLUMN outstanding',
+        ):
+            db.session.execute(db.text(stmt))
+        db.session.commit()
+        _migrate_legacy_schema()
+        db.session.expire_all()
+        assert _balances() == (
+            {'Ana': 200, 'Beto': 80},
+            {1: (0, 'Pagada'), 2: (200, 'Pendiente'), 3: (80, 'Pendiente')},
+        )
+        assert reconcile_balances(repair=False) == (0, 0)
+
+
+def test_top_debtors(client):
+    with app.app_context():
+        assert [c.name for c in top_debtors(1)] == ['Ana', 'Beto']
+    data = client.get('/api/reportes/deudores?limit=1').get_json()
+    assert data == [{'client_id': 1, 'name': 'Ana', 'identifier': None, 'outstanding': 350}]
@@ -1,6 +1,27 @@
+"""Benchmarks of the hot endpoints against a seeded invoice database.
+
+The dataset size comes from ``BENCH_INVOICES`` (2000 by default, so the
+module stays quick in the regular suite; use 100000 or 1000000 for real
+measurements).  ``BENCH_DB`` keeps the seeded SQLite file between runs, so a
+large dataset is only generated once.
+
+With ``BENCH_ENFORCE=1`` each benchmark's mean is checked against
+``benchmark_baseline.json`` for the same dataset size and fails above
+``BENCH_TOLERANCE`` (default 3) times the stored value, or ``MIN_LIMIT`` for
+millisecond endpoints dominated by timer noise.  The regular suite only
+checks that the endpoints work, since absolute timings depend on the
+machine.  ``BENCH_UPDATE_BASELINE=1`` writes the measured means back as the
+new baseline.  pytest-benchmark's own ``--benchmark-autosave`` /
+``--benchmark-compare-fail=mean:20%`` work on top of this for finer
+run-to-run comparisons.
+"""
+import json
 import os
 import sys
+from datetime import timedelta
+from pathlib import Path
 import pytest
+from sqlalchemy import create_engine
 
 try:  # Skip entire module if plugin unavailable
     import pytest_benchmark  # noqa: F401
@@ -9,26 +30,158 @@ except Exception:  # pragma: no cover
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from app import app, db
-from models import Invoice
+from models import (
+    Client, Invoice, Order, OrderItem, Product, Quotation, QuotationItem, User, Warehouse, dom_now,
+)
 from scripts.seed_invoices import seed_invoices
 
+BENCH_INVOICES = int(os.environ.get('BENCH_INVOICES', 2000))
+BENCH_ROUNDS = int(os.environ.get('BENCH_ROUNDS', 5))
+BENCH_TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', 3))
+BENCH_ENFORCE = os.environ.get('BENCH_ENFORCE') == '1'
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+MIN_LIMIT = 0.05  # seconds
+
+RECENT = (dom_now() - timedelta(days=30)).strftime('%Y-%m-%d')
+ENDPOINTS = [
+    ('reportes', '/reportes'),
+    ('reportes_ajax', '/reportes?ajax=1'),
+    # A month of invoices keeps exports under MAX_EXPORT_ROWS at 1M invoices.
+    ('export_csv', f'/reportes/export?formato=csv&fecha_inicio={RECENT}'),
+    ('export_xlsx', f'/reportes/export?formato=xlsx&fecha_inicio={RECENT}'),
+    ('facturas', '/facturas'),
+    ('inventario', '/inventario'),
+    ('clientes_buscar', '/clientes?q=Cliente 1'),
+    ('cotizacion_nueva', '/cotizaciones/nueva'),
+    ('factura_pdf', '/facturas/1/pdf'),
+    ('cotizacion_pdf', '/cotizaciones/1/pdf'),
+    ('pedido_pdf', '/pedidos/1/pdf'),
+]
+
+
+def _quotation(company_id, client_id, products):
+    q = Quotation(client_id=client_id, valid_until=dom_now() + timedelta(days=30),
+                  subtotal=0, itbis=0, total=0, company_id=company_id)
+    for p in products:
+        q.items.append(QuotationItem(code=p.code, product_name=p.name, unit=p.unit, unit_price=p.price,
+                                     quantity=1, company_id=company_id))
+        q.subtotal += p.price
+    q.itbis = round(q.subtotal * 0.18, 2)
+    q.total = q.subtotal + q.itbis
+    db.session.add(q)
+    db.session.flush()
+    return q
+
+
+def _order(source):
+    """Copy of order ``source`` with its items, still to be invoiced."""
+    order = Order(client_id=source.client_id, subtotal=source.subtotal, itbis=source.itbis,
+                  total=source.total, warehouse_id=source.warehouse_id, company_id=source.company_id)
+    for item in source.items:
+        order.items.append(OrderItem(code=item.code, product_name=item.product_name, unit=item.unit,
+                                     unit_price=item.unit_price, quantity=item.quantity,
+                                     company_id=item.company_id))
+    db.session.add(order)
+    db.session.flush()
+    return order
+
+
+def _prepare():
+    """Add the user the benchmarks log in with."""
+    if User.query.filter_by(username='bench').first():
+        return
+    user = User(username='bench', first_name='B', last_name='', role='manager',
+                company_id=Client.query.order_by(Client.id).first().company_id)
+    user.set_password('pass')
+    db.session.add(user)
+    db.session.commit()
+
+
 @pytest.fixture(scope='module')
-def perf_app(tmp_path_factory):
-    db_path = tmp_path_factory.mktemp('perf') / 'perf.sqlite'
+def bench_client():
     app.config.from_object('config.TestingConfig')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    keep = os.environ.get('BENCH_DB')
     with app.app_context():
+        db.session.remove()
+        original = db.engines[None]
+        if keep:  # the engine is bound at init, so swap it for the kept file
+            db.engines[None] = create_engine(f'sqlite:///{os.path.abspath(keep)}')
         db.create_all()
-        seed_invoices(10000)
-    yield app
+        missing = BENCH_INVOICES - Invoice.query.count()
+        if missing > 0:
+            seed_invoices(missing)
+        _prepare()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'bench', 'password': 'pass'})
+        yield c
     with app.app_context():
-        db.drop_all()
+        db.session.remove()
+        if keep:
+            db.engines[None].dispose()
+            db.engines[None] = original
+        else:
+            db.drop_all()
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    stored = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    measured = {}
+    yield stored.get(str(BENCH_INVOICES), {}), measured
+    if os.environ.get('BENCH_UPDATE_BASELINE') and measured:
+        stored.setdefault(str(BENCH_INVOICES), {}).update(measured)
+        BASELINE_PATH.write_text(json.dumps(stored, indent=2, sort_keys=True) + '\n')
+
+
+def _check(benchmark, baseline, name):
+    if benchmark.stats is None:  # --benchmark-disable or xdist
+        return
+    expected, measured = baseline
+    mean = benchmark.stats['mean']
+    measured[name] = round(mean, 4)
+    if BENCH_ENFORCE and name in expected:
+        limit = max(expected[name] * BENCH_TOLERANCE, MIN_LIMIT)
+        assert mean < limit, f'{name}: {mean:.4f}s, baseline {expected[name]:.4f}s'
+
+
+def test_report_query(bench_client, benchmark, baseline):
+    with app.app_context():
+        benchmark.pedantic(lambda: Invoice.query.limit(10000).all(), rounds=BENCH_ROUNDS, iterations=1)
+    _check(benchmark, baseline, 'invoice_query')
+
+
+@pytest.mark.parametrize('name,url', ENDPOINTS, ids=[name for name, _url in ENDPOINTS])
+def test_endpoint(bench_client, benchmark, baseline, name, url):
+    assert bench_client.get(url).status_code == 200
+    resp = benchmark.pedantic(bench_client.get, args=(url,), rounds=BENCH_ROUNDS, iterations=1)
+    assert resp.status_code == 200
+    _check(benchmark, baseline, name)
+
+
+def test_quotation_to_order(bench_client, benchmark, baseline):
+    with app.app_context():
+        warehouse_id = Warehouse.query.first().id
+
+    def setup():
+        with app.app_context():
+            source = db.session.get(Quotation, 1)
+            products = Product.query.filter(Product.code.in_([i.code for i in source.items])).all()
+            q = _quotation(source.company_id, source.client_id, products)
+            db.session.commit()
+            return (f'/cotizaciones/{q.id}/convertir',), {'data': {'warehouse_id': warehouse_id}}
+
+    resp = benchmark.pedantic(bench_client.post, setup=setup, rounds=BENCH_ROUNDS)
+    assert resp.status_code == 302 and '/pedidos' in resp.headers['Location']
+    _check(benchmark, baseline, 'cotizacion_convertir')
+
 
+def test_order_to_invoice(bench_client, benchmark, baseline):
+    def setup():
+        with app.app_context():
+            order = _order(db.session.get(Order, 1))
+            db.session.commit()
+            return (f'/pedidos/{order.id}/facturar',), {}
 
-@pytest.mark.parametrize('limit,threshold', [(10000, 3.0)])
-def test_report_query(perf_app, benchmark, limit, threshold):
-    with perf_app.app_context():
-        def run_query():
-            return list(Invoice.query.limit(limit).all())
-        benchmark(run_query)
-        assert benchmark.stats['mean'] < threshold
+    resp = benchmark.pedantic(bench_client.get, setup=setup, rounds=BENCH_ROUNDS)
+    assert resp.status_code == 302 and '/facturas' in resp.headers['Location']
+    _check(benchmark, baseline, 'pedido_facturar')
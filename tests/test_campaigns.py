@@ -0,0 +1,110 @@
+import os
+import sys
+from datetime import timedelta
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+import app as app_module
+from models import (
+    CompanyInfo, User, Client, Quotation, QuotationItem, QuotationCampaign, OutboundEmail, dom_now,
+)
+from smtp_stub import SMTPStub
+
+
+def _quotation(comp_id, client_id, age=1, valid=30, status='vigente'):
+    now = dom_now()
+    q = Quotation(client_id=client_id, date=now - timedelta(days=age), valid_until=now + timedelta(days=valid),
+                  subtotal=100, itbis=18, total=118, status=status, company_id=comp_id)
+    q.items.append(QuotationItem(code='P1', product_name='Producto', unit='Unidad',
+                                 unit_price=100, quantity=1, discount=0, company_id=comp_id))
+    db.session.add(q)
+    return q
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['CAMPAIGN_WORKERS'] = 2
+    monkeypatch.setattr(app_module, 'enqueue_export', lambda fn, *args: fn(app, *args))
+    with SMTPStub() as server:
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.port,
+                          MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_DEFAULT_SENDER='ventas@example.com')
+        with app.app_context():
+            db.session.remove(); db.engine.dispose(); db.create_all()
+            comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+            other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+            db.session.add_all([comp, other])
+            db.session.flush()
+            user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+            user.set_password('pass')
+            ana = Client(name='Ana', email='ana@example.com', company_id=comp.id)
+            beto = Client(name='Beto', company_id=comp.id)
+            carla = Client(name='Carla', email='carla@example.com', company_id=comp.id)
+            foreign = Client(name='Ajeno', email='x@example.com', company_id=other.id)
+            db.session.add_all([user, ana, beto, carla, foreign])
+            db.session.flush()
+            _quotation(comp.id, ana.id)                   # 1
+            _quotation(comp.id, beto.id)                  # 2: no email
+            _quotation(comp.id, carla.id, age=10)         # 3
+            _quotation(comp.id, carla.id, valid=-1)       # 4: expired
+            _quotation(comp.id, ana.id, status='convertida')  # 5
+            _quotation(other.id, foreign.id)              # 6: other tenant
+            db.session.commit()
+        with app.test_client() as c:
+            c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+            c.server = server
+            yield c
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+    app.config.update(MAIL_SERVER=None, MAIL_DEFAULT_SENDER=None)
+
+
+def test_campaign_sends_valid_quotations(client):
+    resp = client.post('/cotizaciones/campana', json={'status': 'vigente'})
+    assert resp.status_code == 202
+    assert resp.get_json()['quotations'] == 3
+    report = client.get(resp.get_json()['status_url']).get_json()
+    assert report['status'] == 'done'
+    assert [(i['quotation_id'], i['status']) for i in report['items']] == [(1, 'sent'), (2, 'error'), (3, 'sent')]
+    assert report['items'][1]['error'] == 'El cliente no tiene correo registrado'
+    assert report['counts'] == {'sent': 2, 'error': 1}
+    server = client.server
+    assert sorted(m[1][0] for m in server.messages) == ['ana@example.com', 'carla@example.com']
+    assert 'filename="cotizacion_1.pdf"' in ''.join(m[2] for m in server.messages)
+    assert server.connections == 1
+
+
+def test_campaign_reports_delivery_failures(client):
+    client.server.fail_next = 1
+    resp = client.post('/cotizaciones/campana', json={'ids': [1, 3]})
+    report = client.get(resp.get_json()['status_url']).get_json()
+    assert [i['status'] for i in report['items']] == ['pending', 'sent']
+    assert '451' in report['items'][0]['error']
+    with app.app_context():
+        assert OutboundEmail.query.filter_by(status='pending').count() == 1
+
+
+def test_campaign_scoped_to_company(client):
+    resp = client.post('/cotizaciones/campana', json={'ids': [6]})
+    assert resp.status_code == 400
+    resp = client.post('/cotizaciones/campana', json={'ids': [1]})
+    assert client.get(resp.get_json()['status_url']).status_code == 200
+    with app.app_context():
+        foreign = QuotationCampaign(company_id=2, status='done')
+        db.session.add(foreign); db.session.commit()
+        foreign_id = foreign.id
+    assert client.get(f'/api/cotizaciones/campana/{foreign_id}').status_code == 404
+
+
+def test_campaign_form_and_mail_config(client):
+    resp = client.post('/cotizaciones/campana', data={'status': 'vigente', 'date_from': '2000-01-01'})
+    assert resp.status_code == 302
+    with app.app_context():
+        assert QuotationCampaign.query.one().status == 'done'
+    app.config['MAIL_SERVER'] = None
+    resp = client.post('/cotizaciones/campana', json={'ids': [1]})
+    assert resp.status_code == 400
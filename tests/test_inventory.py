@@ -97,6 +97,25 @@ def test_inventory_import_csv(client):
         assert InventoryMovement.query.count() == 1
 
 
+def test_inventory_import_keeps_other_warehouses_in_total(client):
+    data = 'code,stock,min_stock\nP1,7,\n'
+    client.post('/inventario/importar', data={
+        'file': (BytesIO(data.encode('utf-8')), 's.csv'),
+        'warehouse_id': '2'
+    }, follow_redirects=True)
+    data = 'code,stock,min_stock\nP1,20,\nP1,12,\n'
+    client.post('/inventario/importar', data={
+        'file': (BytesIO(data.encode('utf-8')), 's.csv'),
+        'warehouse_id': '1'
+    }, follow_redirects=True)
+    with app.app_context():
+        levels = dict(db.session.query(ProductStock.warehouse_id, ProductStock.stock).filter_by(product_id=1))
+        assert levels == {1: 12, 2: 7}
+        prod = db.session.get(Product, 1)
+        assert prod.stock == 19
+        assert prod.min_stock == 3
+
+
 def test_inventory_import_invalid_header(client):
     data = 'code,stock\nP1,10\n'
     resp = client.post('/inventario/importar', data={
@@ -205,3 +224,115 @@ def test_inventory_movement_tracks_user(client):
         mov = InventoryMovement.query.first()
         assert mov.executed_by == 1
         assert mov.user.username == 'user'
+
+
+def test_product_import_updates_and_reports_errors(manager_client):
+    data = (
+        'code,name,unit,price,category,has_itbis\n'
+        'A1,Prod A,Unidad,10,Otros,1\n'
+        'A2,Prod B,Unidad,,Otros,0\n'
+        'A1,,,15,,1\n'
+        'A3,Prod C,Unidad,5,Otros,0\n'
+    )
+    resp = manager_client.post('/productos/importar', data={'file': (BytesIO(data.encode('utf-8')), 'p.csv')},
+                               follow_redirects=True)
+    body = resp.get_data(as_text=True)
+    assert 'Línea 3' in body
+    with app.app_context():
+        a1 = Product.query.filter_by(code='A1').first()
+        assert a1.name == 'Prod A'
+        assert a1.price == 15
+        assert Product.query.filter_by(code='A2').first() is None
+        assert Product.query.filter_by(code='A3').first().reference == 'PRO002'
+        assert a1.reference == 'PRO001'
+
+
+def test_product_import_chunks_assign_sequential_references(manager_client, monkeypatch):
+    import importers
+    monkeypatch.setattr(importers, 'CHUNK_SIZE', 2)
+    rows = ''.join(f'C{i},Caja {i},Unidad,1,Otros,1\n' for i in range(5))
+    data = 'code,name,unit,price,category,has_itbis\n' + rows
+    manager_client.post('/productos/importar', data={'file': (BytesIO(data.encode('utf-8')), 'p.csv')})
+    with app.app_context():
+        refs = sorted(p.reference for p in Product.query.filter(Product.code.like('C%')))
+        assert refs == ['CAJ001', 'CAJ002', 'CAJ003', 'CAJ004', 'CAJ005']
+
+
+def test_large_product_import_runs_in_background(manager_client, monkeypatch):
+    import app as app_module
+    from models import ExportLog
+    monkeypatch.setattr(app_module, 'enqueue_export', lambda fn, *args: fn(app, *args))
+    app.config['IMPORT_ASYNC_BYTES'] = 10
+    try:
+        data = 'code,name,unit,price,category,has_itbis\nB1,Bulk,Unidad,3,Otros,1\nB2,,Unidad,3,Otros,1\n'
+        resp = manager_client.post('/productos/importar', data={'file': (BytesIO(data.encode('utf-8')), 'p.csv')})
+        assert resp.status_code == 302
+    finally:
+        app.config.pop('IMPORT_ASYNC_BYTES')
+    with app.app_context():
+        assert Product.query.filter_by(code='B1').first() is not None
+        entry = ExportLog.query.filter_by(tipo='import_productos').first()
+        assert entry.status == 'success'
+        assert '1 errores' in entry.message
+        assert entry.file_path.endswith('_errores.csv')
+        os.remove(entry.file_path)
+        os.remove(entry.file_path.replace('_errores', ''))
+
+
+def test_inventory_import_upserts_existing_and_new_stock(client):
+    with app.app_context():
+        db.session.add(Product(code='P2', name='Prod2', unit='u', price=1, company_id=1))
+        db.session.commit()
+    data = 'code,stock,min_stock\nP1,7,\nP2,4,1\nP2,6,2\n'
+    resp = client.post('/inventario/importar', data={
+        'file': (BytesIO(data.encode('utf-8')), 's.csv'),
+        'warehouse_id': '1'
+    }, follow_redirects=True)
+    assert 'Se importaron 3 productos' in resp.get_data(as_text=True)
+    with app.app_context():
+        p1 = ProductStock.query.filter_by(product_id=1, warehouse_id=1).first()
+        assert p1.stock == 7
+        assert p1.min_stock == 3
+        p2 = ProductStock.query.filter_by(product_id=2, warehouse_id=1).one()
+        assert p2.stock == 6
+        assert p2.min_stock == 2
+        assert Product.query.get(2).stock == 6
+        assert InventoryMovement.query.filter_by(reference_type='import').count() == 3
+
+
+def test_inventory_import_rejects_other_company_codes(client):
+    with app.app_context():
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add(other)
+        db.session.flush()
+        db.session.add(Product(code='X1', name='Ajeno', unit='u', price=1, company_id=other.id))
+        db.session.commit()
+    data = 'code,stock,min_stock\nP1,9,1\nX1,4,1\n'
+    resp = client.post('/inventario/importar', data={
+        'file': (BytesIO(data.encode('utf-8')), 's.csv'),
+        'warehouse_id': '1'
+    }, follow_redirects=True)
+    body = resp.get_data(as_text=True)
+    assert 'Línea 3: Producto X1 no encontrado' in body
+    with app.app_context():
+        assert ProductStock.query.filter_by(product_id=1, warehouse_id=1).first().stock == 5
+        assert InventoryMovement.query.count() == 0
+
+
+def test_inventory_export_values_at_average_cost(manager_client):
+    with app.app_context():
+        comp = CompanyInfo.query.first()
+        prod = Product(code='C1', name='Cemento', unit='u', price=10, company_id=comp.id)
+        wh = Warehouse(name='Central', company_id=comp.id)
+        db.session.add_all([prod, wh])
+        db.session.flush()
+        db.session.add(ProductStock(product_id=prod.id, warehouse_id=wh.id, stock=0, company_id=comp.id))
+        db.session.commit()
+    manager_client.post('/inventario/ajustar', data={
+        'product_id': '1', 'warehouse_id': '1', 'quantity': '4', 'movement_type': 'entrada', 'unit_cost': '7.5',
+    })
+    rows = list(csv.reader(manager_client.get('/reportes/inventario/export').get_data(as_text=True).splitlines()))
+    assert rows[0][-2:] == ['Costo promedio', 'Valor']
+    assert rows[1] == ['C1', 'Cemento', 'Central', '4', '0', '7.50', '30.00']
+    data = manager_client.get('/api/inventario/valoracion').get_json()
+    assert data['total_value'] == 30.0
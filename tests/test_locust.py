@@ -0,0 +1,67 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from werkzeug.serving import make_server
+
+# Importing locust here would monkey-patch this process with gevent; it
+# only runs in a subprocess.
+if importlib.util.find_spec('locust') is None:  # pragma: no cover
+    pytest.skip('locust not installed', allow_module_level=True)
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import User
+from scripts.seed_invoices import SeedConfig, generate
+
+LOCUSTFILE = os.path.join(os.path.dirname(__file__), 'locustfile.py')
+
+
+@pytest.fixture
+def server(tmp_path):
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "test.sqlite"}'
+    app.config['WTF_CSRF_ENABLED'] = True  # the harness must handle tokens
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        generate(SeedConfig(invoices=50, companies=1, clients=10, products=10))
+        admin = User(username='admin', first_name='Admin', last_name='', role='admin')
+        admin.set_password('363636')
+        db.session.add(admin)
+        db.session.commit()
+    srv = make_server('127.0.0.1', 0, app)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{srv.server_port}'
+    srv.shutdown()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_headless_run_writes_percentiles(server, tmp_path):
+    results = tmp_path / 'results.json'
+    subprocess.run(
+        [sys.executable, '-m', 'locust', '-f', LOCUSTFILE, '--host', server, '--headless',
+         '-u', '5', '-r', '5', '--run-time', '8s', '--only-summary', '--loglevel', 'WARNING',
+         '--results', str(results), '--label', 'ci'],
+        check=False, capture_output=True, timeout=120,
+    )
+    data = json.loads(results.read_text())
+    assert data['label'] == 'ci' and data['users'] == 5
+    endpoints = data['endpoints']
+    failed = {name: row['failures'] for name, row in endpoints.items() if row['failures']}
+    assert not failed
+    # The setup hook went through the application's endpoints.
+    assert {'POST /productos', 'POST /inventario/ajustar', 'POST /ajustes/usuarios/agregar',
+            'POST /api/clients'} <= set(endpoints)
+    row = endpoints['GET /login']
+    assert row['p50'] <= row['p95'] <= row['p99'] <= row['max'] + 1
+
+    proc = subprocess.run([sys.executable, LOCUSTFILE, 'compare', str(results), str(results)],
+                          capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0 and 'GET /login' in proc.stdout
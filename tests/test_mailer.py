@@ -0,0 +1,137 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+from datetime import timedelta
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db, send_email
+from models import OutboundEmail, User, dom_now
+from mailer import SMTPPool, drain, send_pending
+from smtp_stub import SMTPStub
+
+
+@pytest.fixture
+def smtp(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with SMTPStub() as server:
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.port,
+                          MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_DEFAULT_SENDER='ventas@example.com')
+        with app.app_context():
+            db.session.remove(); db.engine.dispose(); db.create_all()
+            admin = User(username='admin', first_name='A', last_name='', role='admin')
+            admin.set_password('pass')
+            db.session.add(admin)
+            db.session.commit()
+        yield server
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+    app.config.update(MAIL_SERVER=None, MAIL_DEFAULT_SENDER=None)
+
+
+def _pool(server):
+    return SMTPPool('127.0.0.1', server.port)
+
+
+def test_send_email_only_enqueues(smtp):
+    with app.app_context():
+        send_email('ana@example.com', 'Hola', '<p>hola</p>', attachments=[('a.pdf', b'%PDF-1')])
+        email = OutboundEmail.query.one()
+        assert email.status == 'pending' and email.attachments[0].filename == 'a.pdf'
+    assert smtp.connections == 0 and smtp.messages == []
+
+
+def test_batch_reuses_one_connection(smtp):
+    pool = _pool(smtp)
+    with app.app_context():
+        for n in range(5):
+            send_email(f'c{n}@example.com', f'Asunto {n}', '<p>x</p>', attachments=[('a.pdf', b'%PDF-1')])
+        db.session.commit()
+        assert send_pending(pool, limit=3) == (3, 0)
+        assert drain(pool) == (2, 0)
+        assert {e.status for e in OutboundEmail.query} == {'sent'}
+    pool.close()
+    assert pool.connects == 1 and smtp.connections == 1
+    assert [m[1] for m in smtp.messages] == [[f'c{n}@example.com'] for n in range(5)]
+    assert 'filename="a.pdf"' in smtp.messages[0][2]
+
+
+def test_dropped_idle_connection_is_replaced(smtp):
+    pool = _pool(smtp)
+    with pool.connection() as conn:
+        conn.noop()
+    # The server closed the idle connection, e.g. after its timeout.
+    pool._idle.queue[0][0].sock.shutdown(socket.SHUT_RDWR)
+    with pool.connection() as conn:
+        assert conn.noop()[0] == 250
+    pool.close()
+    assert pool.connects == 2
+
+
+def test_retry_with_backoff_then_fail(smtp):
+    pool = _pool(smtp)
+    smtp.fail_next = 1
+    with app.app_context():
+        send_email('ana@example.com', 'Hola', '<p>x</p>')
+        db.session.commit()
+        now = dom_now()
+        assert send_pending(pool, now=now) == (0, 1)
+        email = OutboundEmail.query.one()
+        assert email.status == 'pending' and email.attempts == 1 and '451' in email.last_error
+        assert email.next_attempt_at == now + timedelta(seconds=60)
+        assert send_pending(pool, now=now) == (0, 0)
+        assert send_pending(pool, now=now + timedelta(seconds=61)) == (1, 0)
+
+        app.config['MAIL_MAX_ATTEMPTS'] = 2
+        smtp.fail_next = 2
+        send_email('beto@example.com', 'Hola', '<p>x</p>')
+        db.session.commit()
+        later = now + timedelta(hours=1)
+        assert send_pending(pool, now=later) == (0, 1)
+        assert send_pending(pool, now=later + timedelta(minutes=5)) == (0, 1)
+        assert OutboundEmail.query.filter_by(status='failed').count() == 1
+        app.config.pop('MAIL_MAX_ATTEMPTS')
+    pool.close()
+    assert smtp.connections == 1
+
+
+def test_expired_claim_is_retried(smtp):
+    pool = _pool(smtp)
+    with app.app_context():
+        send_email('ana@example.com', 'Hola', '<p>x</p>')
+        db.session.commit()
+        now = dom_now()
+        email = OutboundEmail.query.one()
+        email.status, email.claim = 'sending', 'dead'
+        email.next_attempt_at = now + timedelta(minutes=10)
+        db.session.commit()
+        assert send_pending(pool, now=now) == (0, 0)
+        assert send_pending(pool, now=now + timedelta(minutes=11)) == (1, 0)
+    pool.close()
+
+
+def test_admin_outbox_status(smtp):
+    with app.app_context():
+        send_email('ana@example.com', 'Hola', '<p>x</p>')
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'admin', 'password': 'pass'})
+        data = c.get('/admin/correos').get_json()
+    assert data['counts']['pending'] == 1 and data['oldest_pending']
+
+
+def test_mail_settings_are_read_from_dotenv(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copy(os.path.join(root, 'config.py'), tmp_path)
+    (tmp_path / '.env').write_text('MAIL_SERVER=smtp.example.com\nMAIL_USERNAME=ventas@example.com\n')
+    env = {k: v for k, v in os.environ.items() if not k.startswith('MAIL_')}
+    out = subprocess.run(
+        [sys.executable, '-c', 'import config; c = config.BaseConfig; print(c.MAIL_SERVER, c.MAIL_DEFAULT_SENDER)'],
+        cwd=tmp_path, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    assert out.split() == ['smtp.example.com', 'ventas@example.com']
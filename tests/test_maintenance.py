@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import (
+    CompanyInfo, User, Client, Quotation, Product, Warehouse, ProductStock, Notification, ExportLog,
+    MaintenanceJob, StockSnapshot,
+)
+from maintenance import run_due, run_job
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['EXPORT_FOLDER'] = str(tmp_path / 'maint')
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        admin = User(username='admin', first_name='A', last_name='', role='admin')
+        admin.set_password('pass')
+        user = User(username='user', first_name='U', last_name='', role='company', company_id=comp.id)
+        user.set_password('pass')
+        cli = Client(name='Ana', company_id=comp.id)
+        db.session.add_all([admin, user, cli])
+        db.session.flush()
+        past = datetime.now() - timedelta(days=40)
+        db.session.add_all([
+            Quotation(client_id=cli.id, subtotal=1, itbis=0, total=1, valid_until=past, company_id=comp.id),
+            Quotation(client_id=cli.id, subtotal=1, itbis=0, total=1,
+                      valid_until=datetime.now() + timedelta(days=5), company_id=comp.id),
+            Notification(company_id=comp.id, message='vieja', is_read=True, created_at=past),
+            Notification(company_id=comp.id, message='sin leer', is_read=False, created_at=past),
+        ])
+        prod = Product(code='P1', name='Prod', unit='u', price=1, company_id=comp.id)
+        wh = Warehouse(name='W', company_id=comp.id)
+        db.session.add_all([prod, wh])
+        db.session.flush()
+        db.session.add(ProductStock(product_id=prod.id, warehouse_id=wh.id, stock=1, min_stock=5,
+                                    company_id=comp.id))
+        db.session.commit()
+    yield app.test_client()
+    app.config.pop('EXPORT_FOLDER', None)
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_quotation_list_is_read_only(client):
+    client.post('/login', data={'username': 'user', 'password': 'pass'})
+    resp = client.get('/cotizaciones?status=vencida')
+    assert resp.data.count(b'<tr class="border-t">') == 1
+    with app.app_context():
+        assert Quotation.query.filter_by(status='vencida').count() == 0
+        assert Notification.query.count() == 2
+
+
+def test_jobs_run_and_record(client, tmp_path):
+    folder = tmp_path / 'maint'
+    folder.mkdir()
+    old = folder / 'export_1.csv'
+    fresh = folder / 'export_2.csv'
+    old.write_text('x'); fresh.write_text('y')
+    stale = time.time() - 8 * 86400
+    os.utime(old, (stale, stale))
+    with app.app_context():
+        db.session.add(ExportLog(user='u', company_id=1, formato='csv', tipo='detalle', filtros='{}',
+                                 status='success', file_path=str(old)))
+        db.session.commit()
+        ran = run_due()
+        assert set(ran) == {'expire_quotations', 'notify_low_stock', 'prune_notifications',
+                            'sweep_exports', 'sweep_pdfs', 'reconcile_balances', 'send_emails',
+                            'rebuild_recommendations', 'refresh_popularity', 'snapshot_stock',
+                            'archive_movements', 'compute_reorder_points'}
+        assert Quotation.query.filter_by(status='vencida').count() == 1
+        assert [n.message for n in Notification.query.order_by(Notification.id)] == ['sin leer', 'Stock bajo: Prod']
+        assert not old.exists() and fresh.exists()
+        assert ExportLog.query.one().file_path is None
+        assert StockSnapshot.query.one().stock == 1
+        job = db.session.get(MaintenanceJob, 'expire_quotations')
+        assert job.last_status == 'success' and job.runs == 1 and job.last_duration is not None
+        # Nothing is due again right away, and low-stock notices are not duplicated.
+        assert run_due() == []
+        run_job('notify_low_stock')
+        assert Notification.query.count() == 2
+        assert db.session.get(MaintenanceJob, 'notify_low_stock').runs == 2
+
+
+def test_admin_status_endpoint(client):
+    client.post('/login', data={'username': 'admin', 'password': 'pass'})
+    with app.app_context():
+        run_job('sweep_pdfs')
+    data = client.get('/admin/mantenimiento').get_json()
+    by_name = {j['name']: j for j in data}
+    assert by_name['sweep_pdfs']['runs'] == 1
+    assert by_name['expire_quotations']['last_status'] is None
@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import metrics
+from app import app, db
+from models import Client, CompanyInfo, Invoice, User
+
+
+def _child_job():
+    metrics.inc('tiendix_jobs_total', job='hijo', outcome='ok')
+    return os.getpid()
+
+
+def _value(text, sample):
+    match = re.search(rf'^{re.escape(sample)} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "test.sqlite"}'
+    monkeypatch.setattr(metrics._state, 'directory', str(tmp_path / 'metrics'))
+    metrics._state.reset()
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        db.session.add(CompanyInfo(id=1, name='Comp', street='', sector='', province='', phone='', rnc=''))
+        client = Client(name='Ana', identifier='001', company_id=1)
+        db.session.add(client)
+        db.session.flush()
+        db.session.add(Invoice(client_id=client.id, order_id=1, subtotal=100, itbis=18, total=118,
+                               ncf='B0100000001', company_id=1))
+        for username, role in (('admin', 'admin'), ('user', 'company')):
+            user = User(username=username, first_name='U', last_name='', role=role, company_id=1)
+            user.set_password('pass')
+            db.session.add(user)
+        db.session.commit()
+    with app.test_client() as c:
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _login(client, username):
+    client.post('/login', data={'username': username, 'password': 'pass'})
+
+
+def test_metrics_require_admin_or_token(client, monkeypatch):
+    assert client.get('/metrics').status_code == 403
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+    _login(client, 'user')
+    assert client.get('/metrics').status_code == 403
+
+
+def test_records_requests_templates_pdfs_and_queues(client):
+    _login(client, 'admin')
+    for _ in range(3):
+        assert client.get('/clientes').status_code == 200
+    assert client.get('/facturas/1/pdf').status_code == 200
+    resp = client.get('/metrics')
+    assert resp.status_code == 200 and resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+    assert '# TYPE tiendix_request_duration_seconds histogram' in text
+    assert _value(text, 'tiendix_request_duration_seconds_count{endpoint="clients"}') == 3
+    assert _value(text, 'tiendix_request_duration_seconds_bucket{endpoint="clients",le="+Inf"}') == 3
+    assert _value(text, 'tiendix_requests_total{endpoint="clients",method="GET",status="200"}') == 3
+    assert _value(text, 'tiendix_db_queries_total{endpoint="clients"}') >= 3
+    assert _value(text, 'tiendix_request_db_seconds_count{endpoint="clients"}') == 3
+    assert _value(text, 'tiendix_template_render_seconds_count{template="clientes.html"}') == 3
+    assert _value(text, 'tiendix_pdf_render_seconds_count{document="Factura"}') == 1
+    assert _value(text, 'tiendix_cache_requests_total{cache="company",result="hit"}') >= 3
+    assert _value(text, 'tiendix_queue_depth{queue="email",state="pending"}') == 0
+    assert _value(text, 'tiendix_queue_depth{queue="campaigns",state="running"}') == 0
+
+
+def test_histogram_buckets_are_cumulative(client):
+    for seconds in (0.001, 0.02, 0.02, 3):
+        metrics.observe('tiendix_job_duration_seconds', seconds, job='prueba')
+    text = metrics.render()
+    bucket = 'tiendix_job_duration_seconds_bucket{{job="prueba",le="{}"}}'
+    assert _value(text, bucket.format(0.005)) == 1
+    assert _value(text, bucket.format(0.025)) == 3
+    assert _value(text, bucket.format(2.5)) == 3
+    assert _value(text, bucket.format(5.0)) == 4
+    assert _value(text, bucket.format('+Inf')) == 4
+    assert _value(text, 'tiendix_job_duration_seconds_sum{job="prueba"}') == pytest.approx(3.041)
+
+
+def test_aggregates_across_processes(client):
+    metrics.inc('tiendix_jobs_total', job='hijo', outcome='ok')
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        pids = {f.result() for f in [pool.submit(_child_job) for _ in range(4)]}
+    # Another worker process that flushed its totals earlier.
+    other = os.path.join(metrics._state.directory, '999999.json')
+    with open(other, 'w') as f:
+        json.dump({'counters': [['tiendix_jobs_total', [['job', 'hijo'], ['outcome', 'ok']], 10]],
+                   'histograms': []}, f)
+    text = metrics.render()
+    assert os.getpid() not in pids
+    # 1 here + 4 in the pool + 10 elsewhere; forked workers do not repeat the parent's count.
+    assert _value(text, 'tiendix_jobs_total{job="hijo",outcome="ok"}') == 15
+
+
+def test_run_job_records_duration_and_outcome(client):
+    def failing(app_obj):
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        metrics.run_job(failing, app)
+    assert metrics.run_job(lambda app_obj, n: n * 2, app, 21) == 42
+    text = metrics.render()
+    assert _value(text, 'tiendix_jobs_total{job="failing",outcome="error"}') == 1
+    assert _value(text, 'tiendix_jobs_total{job="<lambda>",outcome="ok"}') == 1
+    assert _value(text, 'tiendix_job_duration_seconds_count{job="failing"}') == 1
+
+
+def test_process_files_are_unique_and_pruned(client):
+    metrics.inc('tiendix_jobs_total', job='viejo', outcome='ok')
+    metrics.flush(force=True)
+    first = metrics._state.filename
+    # A later process reusing the pid writes its own file.
+    metrics._state.reset()
+    assert metrics._state.filename != first
+    assert metrics._state.filename.startswith(f'{os.getpid()}-')
+    metrics.inc('tiendix_jobs_total', job='viejo', outcome='ok')
+    text = metrics.render()
+    assert _value(text, 'tiendix_jobs_total{job="viejo",outcome="ok"}') == 2
+    stale = os.path.join(metrics._state.directory, first)
+    old = os.path.getmtime(stale) - metrics.RETENTION - 1
+    os.utime(stale, (old, old))
+    text = metrics.render()
+    assert not os.path.exists(stale)
+    assert _value(text, 'tiendix_jobs_total{job="viejo",outcome="ok"}') == 1
@@ -0,0 +1,88 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import (
+    CompanyInfo, User, Product, Warehouse, ProductStock, InventoryMovement,
+    InventoryMovementArchive, StockSnapshot,
+)
+from movement_archive import archive_cutoff, archive_movements
+from stock_history import stock_as_of
+from stock_ledger import StockLine, apply_movements
+
+NOW = datetime(2025, 6, 15)
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        for n in (1, 2):
+            comp = CompanyInfo(name=f'Comp{n}', street='', sector='', province='', phone='', rnc='')
+            db.session.add(comp)
+            db.session.flush()
+            user = User(username=f'user{n}', first_name='U', last_name='', role='manager', company_id=comp.id)
+            user.set_password('pass')
+            db.session.add(user)
+            db.session.add(Product(code=f'P{n}', name='Prod', unit='u', price=1, stock=0, company_id=comp.id))
+            db.session.add(Warehouse(name='W', company_id=comp.id))
+        db.session.commit()
+        for n in (1, 2):
+            for when, qty, kind in ((datetime(2024, 1, 10), 50, 'entrada'),
+                                    (datetime(2024, 3, 10), 20, 'salida'),
+                                    (datetime(2025, 5, 10), 5, 'salida')):
+                apply_movements(n, n, [StockLine(n, n, qty, kind)])
+                InventoryMovement.query.order_by(InventoryMovement.id.desc()).first().timestamp = when
+                db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'user1', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_archive_moves_old_rows_and_keeps_history(client):
+    with app.app_context():
+        before = {d: stock_as_of(1, d) for d in (datetime(2024, 2, 1), datetime(2024, 6, 1), NOW)}
+        assert archive_movements(6, company_id=1, now=NOW, batch_size=1) == 2
+        assert InventoryMovement.query.filter_by(company_id=1).count() == 1
+        assert InventoryMovement.query.filter_by(company_id=2).count() == 3
+        assert InventoryMovementArchive.query.count() == 2
+        baseline = StockSnapshot.query.filter_by(company_id=1).one()
+        assert baseline.taken_at == archive_cutoff(6, NOW) == datetime(2024, 12, 1)
+        assert baseline.stock == 30
+        for d, levels in before.items():
+            assert stock_as_of(1, d) == levels
+        # Running again is a no-op.
+        assert archive_movements(6, company_id=1, now=NOW) == 0
+        assert StockSnapshot.query.count() == 1
+
+
+def test_history_api_reads_archive_transparently(client):
+    with app.app_context():
+        archive_movements(6, now=NOW)
+    items = client.get('/api/inventario/movimientos').get_json()['items']
+    assert [i['delta'] for i in items] == [-5, -20, 50]
+    assert [i['archived'] for i in items] == [False, True, True]
+    recent = client.get('/api/inventario/movimientos?desde=2025-01-01').get_json()['items']
+    assert [i['delta'] for i in recent] == [-5]
+    page = client.get('/api/inventario/movimientos?per_page=1&page=2').get_json()['items']
+    assert page[0]['delta'] == -20
+
+
+def test_archive_keeps_movements_without_user(client):
+    with app.app_context():
+        # Movements recorded before executed_by existed have no user; the
+        # column was added to those databases as nullable.
+        db.session.execute(db.text('ALTER TABLE inventory_movement RENAME COLUMN executed_by TO legacy_user'))
+        db.session.execute(db.text('ALTER TABLE inventory_movement ADD COLUMN executed_by INTEGER REFERENCES user(id)'))
+        db.session.commit()
+        assert archive_movements(6, company_id=1, now=NOW) == 2
+        assert [m.executed_by for m in InventoryMovementArchive.query] == [None, None]
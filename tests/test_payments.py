@@ -0,0 +1,117 @@
+import os
+import sys
+from datetime import timedelta
+from io import BytesIO
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Client, Order, Invoice, Payment, dom_now
+from balances import reconcile_balances
+from payments import import_payments
+from importers import csv_rows
+
+
+def _invoice(comp_id, client_id, total, age, ncf):
+    order = Order(client_id=client_id, subtotal=total, itbis=0, total=total, company_id=comp_id)
+    db.session.add(order); db.session.flush()
+    inv = Invoice(client_id=client_id, order_id=order.id, subtotal=total, itbis=0, total=total, ncf=ncf,
+                  invoice_type='Consumidor Final', date=dom_now() - timedelta(days=age), company_id=comp_id)
+    db.session.add(inv); db.session.flush()
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add_all([comp, other])
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        ana = Client(name='Ana', identifier='001', company_id=comp.id)
+        beto = Client(name='Beto', identifier='002', company_id=comp.id)
+        foreign = Client(name='Ajeno', identifier='001', company_id=other.id)
+        db.session.add_all([user, ana, beto, foreign])
+        db.session.flush()
+        _invoice(comp.id, ana.id, 100, 60, 'B0100000001')
+        _invoice(comp.id, ana.id, 200, 30, 'B0100000002')
+        _invoice(comp.id, ana.id, 300, 5, 'B0100000003')
+        _invoice(comp.id, beto.id, 80, 10, 'B0100000004')
+        _invoice(other.id, foreign.id, 999, 10, 'B0100000005')
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _balances():
+    return [round(i.balance_due, 2) for i in Invoice.query.order_by(Invoice.id)]
+
+
+def test_api_payment_oldest_first(client):
+    resp = client.post('/api/pagos', json={'identifier': '001', 'amount': 250, 'reference': 'T1'})
+    assert resp.status_code == 201
+    data = resp.get_json()
+    assert data['payments'] == [{'invoice_id': 1, 'amount': 100}, {'invoice_id': 2, 'amount': 150}]
+    assert data['applied'] == 1 and data['unapplied'] == []
+    with app.app_context():
+        assert _balances() == [0, 50, 300, 80, 999]
+        assert db.session.get(Invoice, 1).status == 'Pagada'
+        assert db.session.get(Client, 1).outstanding == 350
+        assert reconcile_balances(repair=False) == (0, 0)
+    detail = client.get('/api/facturas/2/pagos').get_json()
+    assert detail['balance_due'] == 50 and detail['payments'][0]['reference'] == 'T1'
+
+
+def test_api_payment_by_ncf_and_validation(client):
+    resp = client.post('/api/pagos', json={'payments': [
+        {'ncf': 'B0100000003', 'amount': 120, 'date': '2025-01-15'},
+        {'invoice_id': 4, 'amount': 100},
+    ]})
+    data = resp.get_json()
+    assert resp.status_code == 201
+    assert data['unapplied'] == [{'line': 2, 'amount': 20}]
+    with app.app_context():
+        assert _balances() == [100, 200, 180, 0, 999]
+    bad = client.post('/api/pagos', json={'payments': [
+        {'ncf': 'B0100000001', 'amount': 10},
+        {'ncf': 'B0100000005', 'amount': 10},
+        {'identifier': '002', 'amount': -1},
+    ]})
+    assert bad.status_code == 400
+    assert [e['line'] for e in bad.get_json()['errors']] == [2, 3]
+    with app.app_context():
+        assert _balances() == [100, 200, 180, 0, 999]
+
+
+def test_bulk_import_batches_and_skips_known_references(client):
+    rows = ['ncf,client,amount,date,reference']
+    rows += [f',001,10,2025-02-01,R{i}' for i in range(45)]
+    rows += ['B0100000004,,30,01/02/2025,R100', ',999,5,,R101', ',002,5,,R0']
+    body = '\n'.join(rows).encode()
+    with app.app_context():
+        result = import_payments(1, csv_rows(BytesIO(body)), chunk_size=10)
+        db.session.commit()
+        assert result['applied'] == 46 and result['amount'] == 480
+        assert result['errors'] == [(48, 'Cliente 999 no encontrado'), (49, 'Referencia R0 ya aplicada')]
+        assert _balances() == [0, 0, 150, 50, 999]
+        assert reconcile_balances(repair=False) == (0, 0)
+        again = import_payments(1, csv_rows(BytesIO(body)))
+        assert again['applied'] == 0 and len(again['errors']) == 48
+        assert Payment.query.count() == 46
+
+
+def test_import_page(client):
+    data = {'file': (BytesIO(b'client,amount\n002,100\n'), 'pagos.csv')}
+    resp = client.post('/pagos/importar', data=data, content_type='multipart/form-data')
+    html = resp.get_data(as_text=True)
+    assert 'Se aplicaron 1 pagos' in html and 'sobrante sin aplicar' in html
+    assert 'Saldo' in client.get('/facturas').get_data(as_text=True)
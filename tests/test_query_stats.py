@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import Invoice, User
+from query_stats import count_queries, statement_shape
+from scripts.seed_invoices import SeedConfig, generate
+from tests.query_budget import assert_query_budget
+
+# Statements per page; they must not grow with the number of rows listed.
+BUDGETS = {
+    '/clientes': 4,
+    '/productos': 3,
+    '/inventario': 8,
+    '/cotizaciones': 4,
+    '/cotizaciones/nueva': 6,
+    '/cotizaciones/1/convertir': 4,
+    '/pedidos': 3,
+    '/facturas': 3,
+    '/reportes': 16,
+    '/reportes/antiguedad': 4,
+    '/facturas/1/pdf': 5,
+}
+
+
+@pytest.fixture
+def client(tmp_path):
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "test.sqlite"}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        generate(SeedConfig(invoices=200, companies=1, clients=30, products=30, recommendations=False))
+        user = User(username='u', first_name='U', last_name='', role='manager', company_id=1)
+        user.set_password('pass')
+        db.session.add(user)
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'u', 'password': 'pass'})
+        yield c
+    app.config['SQL_STATS_HEADERS'] = False
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_statement_shape_collapses_values():
+    a = statement_shape("SELECT * FROM client WHERE id IN (?, ?, ?) AND name = 'Ana' LIMIT 10")
+    b = statement_shape('SELECT *  FROM client WHERE id IN (?) AND name = ? LIMIT 25')
+    assert a == b
+    assert statement_shape('SELECT * FROM t WHERE id = %(id_1)s') == 'SELECT * FROM t WHERE id = ?'
+
+
+def test_detects_lazy_loads_in_a_loop(client):
+    with app.app_context():
+        invoices = Invoice.query.limit(10).all()
+        with count_queries() as stats:
+            names = [invoice.client.name for invoice in invoices]
+    assert len(names) == 10 and stats.count >= 5
+    (shape, n), = stats.repeated()
+    assert n == stats.count and 'FROM client' in shape
+
+
+@pytest.mark.parametrize('url', list(BUDGETS))
+def test_query_budget(client, url):
+    assert_query_budget(client, url, BUDGETS[url])
+
+
+def test_headers_in_debug_mode(client):
+    app.config['SQL_STATS_HEADERS'] = True
+    resp = client.get('/facturas')
+    assert int(resp.headers['X-SQL-Queries']) <= BUDGETS['/facturas']
+    assert float(resp.headers['X-SQL-Time']) >= 0
+    assert resp.headers['X-SQL-Repeated'] == '0'
+
+
+def test_logs_requests_over_budget(client, caplog, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_QUERY_BUDGET', 1)
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        assert client.get('/facturas').headers.get('X-SQL-Queries') is None
+    record = next(r for r in caplog.records if r.getMessage().startswith('sql '))
+    data = json.loads(record.getMessage()[4:])
+    assert data['path'] == '/facturas' and data['endpoint'] == 'list_invoices'
+    assert data['queries'] > 1 and data['repeated'] == []
@@ -0,0 +1,81 @@
+import os
+import sys
+import csv
+from datetime import timedelta
+from io import StringIO
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Client, Order, Invoice, Payment, dom_now
+
+
+def _invoice(comp_id, client_id, total, age, paid=0):
+    order = Order(client_id=client_id, subtotal=total, itbis=0, total=total, company_id=comp_id)
+    db.session.add(order); db.session.flush()
+    inv = Invoice(client_id=client_id, order_id=order.id, subtotal=total, itbis=0, total=total,
+                  invoice_type='Consumidor Final', date=dom_now() - timedelta(days=age), company_id=comp_id)
+    db.session.add(inv); db.session.flush()
+    if paid:
+        db.session.add(Payment(invoice_id=inv.id, amount=paid, company_id=comp_id))
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add_all([comp, other])
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        ana = Client(name='Ana', identifier='001', company_id=comp.id)
+        beto = Client(name='Beto', company_id=comp.id)
+        paid = Client(name='Carla', company_id=comp.id)
+        foreign = Client(name='Ajeno', company_id=other.id)
+        db.session.add_all([user, ana, beto, paid, foreign])
+        db.session.flush()
+        _invoice(comp.id, ana.id, 100, 5)
+        _invoice(comp.id, ana.id, 200, 45, paid=50)
+        _invoice(comp.id, ana.id, 300, 130)
+        _invoice(comp.id, beto.id, 80, 95)
+        _invoice(comp.id, paid.id, 60, 70, paid=60)
+        _invoice(other.id, foreign.id, 999, 10)
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_aging_buckets_per_client(client):
+    data = client.get('/api/reportes/antiguedad').get_json()
+    assert [c['name'] for c in data['clients']] == ['Ana', 'Beto']
+    ana = data['clients'][0]
+    assert ana['buckets'] == {'0-30': 100, '31-60': 150, '61-90': 0, '91-120': 0, '121+': 300}
+    assert ana['balance'] == 550 and ana['overdue'] == 450 and ana['invoices'] == 3
+    assert data['clients'][1]['buckets']['91-120'] == 80
+    assert data['totals']['balance'] == 630 and data['totals']['clients'] == 2
+    page = client.get('/api/reportes/antiguedad?per_page=1&page=2').get_json()
+    assert [c['name'] for c in page['clients']] == ['Beto'] and not page['has_next']
+    assert client.get('/api/reportes/antiguedad?q=001').get_json()['totals']['balance'] == 550
+
+
+def test_aging_html_and_export(client):
+    assert 'Beto' in client.get('/reportes/antiguedad').get_data(as_text=True)
+    rows = list(csv.reader(StringIO(client.get('/reportes/antiguedad/export').get_data(as_text=True))))
+    assert rows[0][:3] == ['Cliente', 'RNC', 'Facturas']
+    assert rows[1] == ['Ana', '001', '3', '100.00', '150.00', '0.00', '0.00', '300.00', '450.00', '550.00']
+    assert len(rows) == 3
+
+
+def test_statement_detail_uses_sql_balances(client):
+    html = client.get('/reportes/estado-cuentas/1').get_data(as_text=True)
+    assert html.count('<tr class="border-b">') == 3
+    assert '% vencido: 81.82%' in html
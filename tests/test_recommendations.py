@@ -0,0 +1,164 @@
+import os
+import sys
+from datetime import timedelta
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from ai import frequently_bought_together, rebuild_recommendations, recommend_products, refresh_popularity
+from models import (
+    CompanyInfo, User, Client, Order, OrderItem, Quotation, QuotationItem,
+    PopularityCache, ProductAffinity, ProductPopularity, ProductScore, dom_now,
+)
+
+
+def _order(comp_id, client_id, *lines):
+    order = Order(client_id=client_id, subtotal=0, itbis=0, total=0, company_id=comp_id)
+    db.session.add(order)
+    db.session.flush()
+    for name, qty in lines:
+        db.session.add(OrderItem(order_id=order.id, product_name=name, unit='u', unit_price=1,
+                                 quantity=qty, company_id=comp_id))
+    db.session.flush()
+    return order
+
+
+def _matrix():
+    pop = {(p.company_id, p.product): (p.quantity, p.orders) for p in ProductPopularity.query}
+    pairs = {(a.company_id, a.product, a.other): a.orders for a in ProductAffinity.query}
+    return pop, pairs
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add_all([comp, other])
+        db.session.flush()
+        user = User(username='user', first_name='U', last_name='', role='company', company_id=comp.id)
+        user.set_password('pass')
+        ana = Client(name='Ana', company_id=comp.id)
+        foreign = Client(name='Ajeno', company_id=other.id)
+        db.session.add_all([user, ana, foreign])
+        db.session.flush()
+        _order(comp.id, ana.id, ('Cemento', 10), ('Arena', 2))
+        _order(comp.id, ana.id, ('Cemento', 5), ('Arena', 1), ('Varilla', 2))
+        _order(comp.id, ana.id, ('Cemento', 1), ('Pintura', 1), ('Cemento', 2))
+        _order(other.id, foreign.id, ('Secreto', 500), ('Cemento', 1))
+        q = Quotation(client_id=ana.id, valid_until=dom_now() + timedelta(days=30),
+                      subtotal=0, itbis=0, total=0, company_id=comp.id)
+        q.items.append(QuotationItem(product_name='Cemento', unit='u', unit_price=1, quantity=1,
+                                     company_id=comp.id))
+        db.session.add(q)
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'user', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_incremental_counts_match_rebuild(client):
+    with app.app_context():
+        incremental = _matrix()
+        pop, pairs = incremental
+        assert pop[(1, 'Cemento')] == (18, 3)
+        assert pairs[(1, 'Cemento', 'Arena')] == pairs[(1, 'Arena', 'Cemento')] == 2
+        assert (1, 'Cemento', 'Cemento') not in pairs
+        # Items added to an existing order in a later flush only count new pairs.
+        db.session.add(OrderItem(order_id=1, product_name='Varilla', unit='u', unit_price=1,
+                                 quantity=1, company_id=1))
+        db.session.add(OrderItem(order_id=1, product_name='Arena', unit='u', unit_price=1,
+                                 quantity=1, company_id=1))
+        db.session.commit()
+        incremental = _matrix()
+        assert rebuild_recommendations() == (6, 10)
+        db.session.commit()
+        assert _matrix() == incremental
+
+
+def test_recommendations_are_per_tenant(client):
+    with app.app_context():
+        assert recommend_products(1) == ['Cemento', 'Arena', 'Varilla', 'Pintura']
+        assert recommend_products(2, limit=1) == ['Secreto']
+        assert frequently_bought_together(1, ['Cemento']) == ['Arena', 'Pintura', 'Varilla']
+        assert frequently_bought_together(1, ['Cemento', 'Arena'], limit=1) == ['Varilla']
+        assert frequently_bought_together(1, []) == []
+    assert client.get('/api/recommendations').get_json()['products'][0] == 'Cemento'
+    resp = client.get('/api/recommendations?product=Arena&product=Varilla')
+    assert resp.get_json()['products'] == ['Cemento']
+    resp = client.get('/api/cotizaciones/1/recomendaciones')
+    assert 'Secreto' not in resp.get_json()['products']
+    assert resp.get_json()['products'] == ['Arena', 'Pintura', 'Varilla']
+
+
+def _scores(company_id):
+    return {s.product: s.score for s in ProductScore.query.filter_by(company_id=company_id)}
+
+
+def test_popularity_decays_with_incremental_refresh(client):
+    now = dom_now()
+    with app.app_context():
+        assert refresh_popularity(now=now) == 10
+        db.session.commit()
+        assert refresh_popularity(now=now) == 0
+        assert db.session.get(PopularityCache, 1).last_item_id == 8
+        # 100 units sold four half-lives ago weigh less than 18 recent ones.
+        old = _order(1, 1, ('Bloque', 100))
+        old.date = now - timedelta(days=120)
+        _order(1, 1, ('Pintura', 1))
+        db.session.commit()
+        later = now + timedelta(days=10)
+        assert refresh_popularity(now=later) == 2
+        db.session.commit()
+        assert recommend_products(1, limit=3) == ['Cemento', 'Bloque', 'Arena']
+        assert _scores(1)['Bloque'] == pytest.approx(100 * 0.5 ** (130 / 30))
+        assert _scores(1)['Cemento'] == pytest.approx(18 * 0.5 ** (10 / 30))
+        incremental = _scores(1)
+        refresh_popularity(1, now=later, force=True)
+        db.session.commit()
+        assert _scores(1) == pytest.approx(incremental)
+        assert recommend_products(2) == ['Secreto', 'Cemento']
+
+
+def test_popularity_scores_late_committed_items(client):
+    now = dom_now()
+    with app.app_context():
+        refresh_popularity(now=now)
+        order = _order(1, 1)
+        for iid in (11, 13):  # 12 belongs to an order that is still being saved
+            db.session.add(OrderItem(id=iid, order_id=order.id, product_name='Bloque', unit='u',
+                                     unit_price=1, quantity=1, company_id=1))
+        db.session.commit()
+        assert refresh_popularity(now=now) == 2
+        db.session.commit()
+        cache = db.session.get(PopularityCache, 1)
+        assert (cache.last_item_id, cache.pending_ids) == (13, '12')
+        db.session.add(OrderItem(id=12, order_id=order.id, product_name='Bloque', unit='u',
+                                 unit_price=1, quantity=1, company_id=1))
+        db.session.commit()
+        assert refresh_popularity(now=now) == 1
+        db.session.commit()
+        assert _scores(1)['Bloque'] == pytest.approx(3)
+        assert refresh_popularity(now=now) == 0
+        assert db.session.get(PopularityCache, 1).pending_ids == ''
+
+
+def test_popularity_cache_is_bounded(client):
+    with app.app_context():
+        assert recommend_products(1, limit=2) == ['Cemento', 'Arena']  # all-time fallback
+        refresh_popularity(size=2)
+        db.session.commit()
+        assert set(_scores(1)) == {'Cemento', 'Arena'}
+        _order(1, 1, ('Pintura', 40))
+        db.session.commit()
+        refresh_popularity(size=2)
+        db.session.commit()
+        assert recommend_products(1) == ['Pintura', 'Cemento']
+    assert client.post('/api/recommendations/refresh').status_code == 403
@@ -0,0 +1,73 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Product, ReferenceCounter
+from references import allocate_references, claim_reference, peek_reference
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='user', first_name='U', last_name='One', role='company', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        db.session.add(Product(code='P1', reference='PRO004', name='Prod', unit='u', price=1, company_id=comp.id))
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'user', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.drop_all()
+    if db_path.exists():
+        db_path.unlink()
+
+
+def test_api_reference_peeks_without_reserving(client):
+    assert client.get('/api/reference?name=Producto').get_json()['reference'] == 'PRO005'
+    assert client.get('/api/reference?name=Producto').get_json()['reference'] == 'PRO005'
+    with app.app_context():
+        assert ReferenceCounter.query.count() == 0
+
+
+def test_allocate_seeds_from_existing_references(client):
+    with app.app_context():
+        assert allocate_references(1, 'PRO', 3) == ['PRO005', 'PRO006', 'PRO007']
+        assert allocate_references(1, 'NEW') == ['NEW001']
+        db.session.commit()
+        assert ReferenceCounter.query.filter_by(prefix='PRO').one().last_value == 7
+
+
+def test_claim_reference_falls_back_when_taken(client):
+    with app.app_context():
+        assert claim_reference(1, 'Producto', 'PRO005') == 'PRO005'
+        assert claim_reference(1, 'Producto', 'PRO005') == 'PRO006'
+        assert claim_reference(1, 'Producto', 'PRO090') == 'PRO090'
+        assert claim_reference(1, 'Producto', 'CUSTOM-1') == 'CUSTOM-1'
+        assert peek_reference(1, 'Producto') == 'PRO091'
+
+
+def test_claim_reference_keeps_free_numbers_below_counter(client):
+    with app.app_context():
+        assert claim_reference(1, 'Producto', 'PRO010') == 'PRO010'
+        assert claim_reference(1, 'Producto', 'PRO002') == 'PRO002'
+        assert claim_reference(1, 'Producto', 'PRO004') == 'PRO011'
+        assert peek_reference(1, 'Producto') == 'PRO012'
+
+
+def test_create_product_uses_counter(client):
+    client.post('/productos', data={'code': 'P2', 'name': 'Probeta', 'unit': 'Unidad', 'price': '3'})
+    client.post('/productos', data={'code': 'P3', 'name': 'Probador', 'unit': 'Unidad', 'price': '3',
+                                    'reference': 'PRO005'})
+    with app.app_context():
+        assert Product.query.filter_by(code='P2').one().reference == 'PRO005'
+        assert Product.query.filter_by(code='P3').one().reference == 'PRO006'
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import (
+    CompanyInfo, User, Product, Warehouse, ProductStock, InventoryMovement, Client, Order, OrderItem,
+)
+from reorder import compute_reorder_points, demand_stats
+
+NOW = datetime(2025, 4, 30, 12)
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        for code in ('P1', 'P2', 'P3'):
+            db.session.add(Product(code=code, name=code, unit='u', price=1, company_id=comp.id))
+        db.session.add(Warehouse(name='W1', company_id=comp.id))
+        db.session.flush()
+        db.session.add_all([
+            ProductStock(product_id=1, warehouse_id=1, stock=5, company_id=comp.id),
+            ProductStock(product_id=2, warehouse_id=1, stock=500, company_id=comp.id),
+            ProductStock(product_id=3, warehouse_id=1, stock=1, company_id=comp.id),
+        ])
+        cli = Client(name='Ana', company_id=comp.id)
+        db.session.add(cli); db.session.flush()
+        # P1: 10 units per day for the last 10 days through orders.
+        for d in range(10):
+            order = Order(client_id=cli.id, subtotal=0, itbis=0, total=0, warehouse_id=1,
+                          date=NOW - timedelta(days=d), company_id=comp.id)
+            db.session.add(order); db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, code='P1', product_name='P1', unit='u',
+                                     unit_price=1, quantity=10, company_id=comp.id))
+            # Order movements are not counted twice.
+            db.session.add(InventoryMovement(product_id=1, quantity=10, movement_type='salida',
+                                             reference_type='Order', reference_id=order.id,
+                                             warehouse_id=1, timestamp=NOW - timedelta(days=d),
+                                             company_id=comp.id, executed_by=user.id))
+        # P2: one manual exit of 90 units; transfers are ignored.
+        db.session.add_all([
+            InventoryMovement(product_id=2, quantity=90, movement_type='salida', warehouse_id=1,
+                              timestamp=NOW - timedelta(days=3), company_id=comp.id, executed_by=user.id),
+            InventoryMovement(product_id=2, quantity=400, movement_type='salida', reference_type='transfer',
+                              warehouse_id=1, timestamp=NOW, company_id=comp.id, executed_by=user.id),
+        ])
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_reorder_points_from_demand(client):
+    with app.app_context():
+        assert compute_reorder_points(1, lookback_days=90, lead_time=9, cover_days=30, z=2, now=NOW) == 2
+        p1 = ProductStock.query.filter_by(product_id=1).one()
+        assert p1.demand_rate == pytest.approx(100 / 90, rel=1e-3)
+        mean = 100 / 90
+        std = (1000 / 90 - mean ** 2) ** 0.5
+        assert p1.reorder_point == int(-(-(mean * 9 + 2 * std * 3) // 1))
+        assert p1.reorder_qty == 34
+        p2 = ProductStock.query.filter_by(product_id=2).one()
+        assert p2.demand_rate == pytest.approx(1.0)
+        assert ProductStock.query.filter_by(product_id=3).one().reorder_point == 0
+
+
+def test_reorder_points_only_update_existing_stock_rows(client):
+    with app.app_context():
+        # Demand at a warehouse where product 3 has never been stocked.
+        db.session.add(Warehouse(name='W2', company_id=1))
+        db.session.add(InventoryMovement(product_id=3, quantity=30, movement_type='salida', warehouse_id=2,
+                                         timestamp=NOW, company_id=1, executed_by=1))
+        db.session.commit()
+        assert compute_reorder_points(1, now=NOW) == 2
+        assert ProductStock.query.filter_by(warehouse_id=2).count() == 0
+        assert ProductStock.query.count() == 3
+
+
+def test_inventory_report_filters_suggested_reorder(client):
+    with app.app_context():
+        compute_reorder_points(1, now=NOW)
+    html = client.get('/inventario?warehouse_id=1&status=reorder').get_data(as_text=True)
+    table = html.split('<tbody>')[1].split('</tbody>')[0]
+    assert '<td class="px-4 py-2">P1</td>' in table
+    assert '<td class="px-4 py-2">P2</td>' not in table
+    assert '(pedir 34)' in table
+
+
+def test_demand_stats_large_catalogue():
+    since = datetime(2025, 1, 1)
+    n = 100_000
+    rows = [(1, pid, 1 + pid % 3, '2025-01-%02d' % (1 + pid % 28), 1 + pid % 7) for pid in range(n)]
+    rows += [(1, pid, 1 + pid % 3, '2025-02-%02d' % (1 + pid % 28), 2) for pid in range(n)]
+    started = time.perf_counter()
+    company, product, warehouse, mean, std = demand_stats(rows, since, 90)
+    assert time.perf_counter() - started < 5
+    assert len(product) == n
+    assert mean[0] == pytest.approx(3 / 90)
+    assert std[0] > 0
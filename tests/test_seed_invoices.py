@@ -0,0 +1,69 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+from sqlalchemy import func
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from balances import reconcile_balances
+from models import Client, InventoryMovement, Invoice, Payment, Product, ProductStock, Quotation
+from scripts.seed_invoices import SeedConfig, generate
+
+NOW = datetime(2025, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def ctx(tmp_path):
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "test.sqlite"}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+def _config(**kwargs):
+    return SeedConfig(invoices=600, companies=2, clients=20, products=15, batch=250, now=NOW, **kwargs)
+
+
+def _fingerprint():
+    return (
+        db.session.query(func.count(Invoice.id), func.round(func.sum(Invoice.total), 2)).one(),
+        db.session.query(func.count(Payment.id), func.round(func.sum(Payment.amount), 2)).one(),
+        db.session.query(func.sum(ProductStock.stock)).scalar(),
+    )
+
+
+def test_generator_is_deterministic(ctx):
+    counts = generate(_config(seed=5))
+    first = _fingerprint()
+    assert counts['invoices'] == 600 and counts['companies'] == 2
+    db.drop_all(); db.create_all()
+    assert generate(_config(seed=5)) == counts
+    assert _fingerprint() == first
+    db.drop_all(); db.create_all()
+    generate(_config(seed=6))
+    assert _fingerprint() != first
+
+
+def test_generated_data_is_consistent(ctx):
+    generate(_config(company_skew=2, product_skew=1.5))
+    assert reconcile_balances(repair=False) == (0, 0)
+    per_company = dict(db.session.query(Invoice.company_id, func.count(Invoice.id)).group_by(Invoice.company_id))
+    assert per_company[1] > per_company[2] and sum(per_company.values()) == 600
+    # Stock levels match the movement ledger, and products hold the warehouse totals.
+    ledger = dict(
+        db.session.query(InventoryMovement.product_id, func.sum(InventoryMovement.delta))
+        .group_by(InventoryMovement.product_id)
+    )
+    stock = dict(db.session.query(ProductStock.product_id, func.sum(ProductStock.stock)).group_by(ProductStock.product_id))
+    assert ledger == stock == {p.id: p.stock for p in Product.query}
+    assert min(stock.values()) >= 0
+    # Skewed products sell more than the tail.
+    sold = dict(db.session.query(InventoryMovement.product_id, func.sum(-InventoryMovement.delta))
+                .filter(InventoryMovement.movement_type == 'salida').group_by(InventoryMovement.product_id))
+    assert sold[1] > sold[15]
+    assert Quotation.query.filter_by(status='vigente').count() == 60
+    assert Client.query.filter(Client.outstanding > 0).count() > 0
@@ -0,0 +1,115 @@
+import os
+import sys
+import csv
+import zipfile
+from datetime import timedelta
+from io import StringIO
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+import app as app_module
+from models import CompanyInfo, User, Client, Order, Invoice, Payment, ExportLog, dom_now
+from statements import generate_statements, statement_data
+
+
+def _invoice(comp_id, client_id, total, age, paid=0):
+    order = Order(client_id=client_id, subtotal=total, itbis=0, total=total, company_id=comp_id)
+    db.session.add(order); db.session.flush()
+    inv = Invoice(client_id=client_id, order_id=order.id, subtotal=total, itbis=0, total=total,
+                  invoice_type='Consumidor Final', date=dom_now() - timedelta(days=age), company_id=comp_id)
+    db.session.add(inv); db.session.flush()
+    if paid:
+        db.session.add(Payment(invoice_id=inv.id, amount=paid, company_id=comp_id))
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['EXPORT_FOLDER'] = str(tmp_path / 'maint')
+    app.config['STATEMENT_WORKERS'] = 1
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add_all([comp, other])
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        ana = Client(name='Ana', identifier='001', email='ana@example.com', company_id=comp.id)
+        beto = Client(name='Beto', company_id=comp.id)
+        carla = Client(name='Carla', email='carla@example.com', company_id=comp.id)
+        foreign = Client(name='Ajeno', email='x@example.com', company_id=other.id)
+        db.session.add_all([user, ana, beto, carla, foreign])
+        db.session.flush()
+        _invoice(comp.id, ana.id, 100, 5)
+        _invoice(comp.id, ana.id, 200, 45, paid=50)
+        _invoice(comp.id, beto.id, 80, 95)
+        _invoice(comp.id, carla.id, 60, 70, paid=60)
+        _invoice(other.id, foreign.id, 999, 10)
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_statement_data_one_pass(client):
+    with app.app_context():
+        payloads = statement_data(1, dom_now())
+    assert [p['client']['name'] for p in payloads] == ['Ana', 'Beto']
+    ana = payloads[0]
+    assert ana['total'] == 250 and [r['balance'] for r in ana['rows']] == [150, 100]
+    assert ana['aging']['31-60'] == 150 and round(ana['overdue_pct'], 2) == 60
+
+
+def test_generate_statements_in_worker_processes(client, tmp_path):
+    sent = []
+    with app.app_context():
+        result = generate_statements(1, str(tmp_path / 'out'), 'lote', workers=2,
+                                     send=lambda *args, **kwargs: sent.append((args, kwargs)) or True)
+    assert result['clients'] == 2 and result['emailed'] == 1 and result['balance'] == 330
+    assert [args[0] for args, _kw in sent] == ['ana@example.com']
+    assert sent[0][1]['attachments'][0][1].startswith(b'%PDF')
+    with zipfile.ZipFile(result['path']) as archive:
+        assert sorted(archive.namelist()) == ['estado_cuenta_1.pdf', 'estado_cuenta_2.pdf', 'resumen.csv']
+        summary = list(csv.reader(StringIO(archive.read('resumen.csv').decode())))
+    assert summary[1] == ['Ana', '001', 'ana@example.com', '2', '250.00', '150.00', 'estado_cuenta_1.pdf', 'enviado']
+    assert os.listdir(tmp_path / 'out') == ['lote.zip']
+
+
+def test_batch_route_logs_summary(client, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_module, 'enqueue_export', lambda fn, *args: fn(app, *args))
+    monkeypatch.setattr(app_module, 'send_email', lambda to, *args, **kwargs: sent.append(to) or True)
+    resp = client.post('/reportes/estado-cuentas/lote', data={'email': '1'})
+    assert resp.status_code == 302
+    with app.app_context():
+        entry = ExportLog.query.filter_by(tipo='estados_cuenta').one()
+        assert entry.status == 'success' and entry.file_path.endswith('.zip')
+        assert entry.message.startswith('2 estados de cuenta')
+    assert sent == ['ana@example.com']
+
+
+def test_statements_not_emailed_without_mail_settings(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAIL_SERVER', None)
+    with app.app_context():
+        result = generate_statements(1, str(tmp_path / 'out'), 'lote', send=app_module.send_email)
+    assert result['emailed'] == 0 and result['failed'] == ['Ana']
+    with zipfile.ZipFile(result['path']) as archive:
+        summary = list(csv.reader(StringIO(archive.read('resumen.csv').decode())))
+    assert [row[-1] for row in summary[1:]] == ['error', '']
+
+
+def test_single_statement_pdf_per_client_path(client):
+    pdf_path = os.path.join(app.static_folder, 'pdfs', 'estado_cuenta_1.pdf')
+    before = os.path.getmtime(pdf_path) if os.path.exists(pdf_path) else None
+    resp = client.get('/reportes/estado-cuentas/1?pdf=1')
+    assert resp.data.startswith(b'%PDF')
+    assert 'estado_cuenta_1.pdf' in resp.headers['Content-Disposition']
+    # Statements are not published under the static folder.
+    assert (os.path.getmtime(pdf_path) if os.path.exists(pdf_path) else None) == before
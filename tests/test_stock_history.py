@@ -0,0 +1,81 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Product, Warehouse, ProductStock, InventoryMovement, StockSnapshot
+from stock_history import stock_as_of, take_snapshots
+from stock_ledger import StockLine, apply_movements
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='user', first_name='U', last_name='One', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        db.session.add(Product(code='P1', name='Prod', unit='u', price=2.5, stock=10, company_id=comp.id))
+        db.session.add(Warehouse(name='W1', company_id=comp.id))
+        db.session.flush()
+        db.session.add(ProductStock(product_id=1, warehouse_id=1, stock=10, company_id=comp.id))
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'user', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _move(qty, kind, when):
+    apply_movements(1, 1, [StockLine(1, 1, qty, kind)])
+    last = InventoryMovement.query.order_by(InventoryMovement.id.desc()).first()
+    last.timestamp = when
+    db.session.commit()
+
+
+def test_as_of_from_snapshot_and_without(client):
+    with app.app_context():
+        take_snapshots(1, now=datetime(2025, 1, 1))
+        _move(5, 'entrada', datetime(2025, 1, 5))
+        _move(3, 'salida', datetime(2025, 1, 10))
+        _move(4, 'ajuste', datetime(2025, 1, 20))
+        assert stock_as_of(1, datetime(2025, 1, 7)) == {(1, 1): 15}
+        assert stock_as_of(1, datetime(2025, 1, 15)) == {(1, 1): 12}
+        assert stock_as_of(1, datetime(2025, 1, 25)) == {(1, 1): 4}
+        # Without a snapshot the current level is rolled back instead.
+        StockSnapshot.query.delete()
+        db.session.commit()
+        assert stock_as_of(1, datetime(2025, 1, 7)) == {(1, 1): 15}
+        assert stock_as_of(1, datetime(2024, 12, 31)) == {(1, 1): 10}
+
+
+def test_take_snapshots_once_per_period(client):
+    with app.app_context():
+        assert take_snapshots(period='daily', now=datetime(2025, 2, 1, 8)) == 1
+        assert take_snapshots(period='daily', now=datetime(2025, 2, 1, 20)) == 0
+        assert take_snapshots(period='daily', now=datetime(2025, 2, 2, 8)) == 1
+        assert take_snapshots(period='monthly', now=datetime(2025, 2, 3)) == 0
+        assert StockSnapshot.query.count() == 2
+
+
+def test_api_and_valuation_export(client):
+    with app.app_context():
+        take_snapshots(1, now=datetime(2025, 1, 1))
+        _move(2, 'salida', datetime(2025, 1, 5))
+    data = client.get('/api/inventario/existencias?fecha=2025-01-03').get_json()
+    assert data['items'][0]['stock'] == 10
+    assert data['total_value'] == 25
+    assert client.get('/api/inventario/existencias?fecha=ayer').status_code == 400
+    resp = client.get('/reportes/inventario/export?fecha=2025-01-05')
+    text = resp.data.decode()
+    assert 'P1,Prod,W1,8,2.50,20.00' in text
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import pytest
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Product, Warehouse, ProductStock, InventoryMovement
+from stock_ledger import InsufficientStock, StockLine, apply_movements
+
+
+@pytest.fixture
+def ledger_app(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='user', first_name='U', last_name='One', role='company', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        for code in ('P1', 'P2'):
+            db.session.add(Product(code=code, name=code, unit='u', price=1, stock=120, company_id=comp.id))
+        db.session.add_all([Warehouse(name='W1', company_id=comp.id), Warehouse(name='W2', company_id=comp.id)])
+        db.session.flush()
+        db.session.add_all([
+            ProductStock(product_id=1, warehouse_id=1, stock=100, company_id=comp.id),
+            ProductStock(product_id=2, warehouse_id=1, stock=100, company_id=comp.id),
+            ProductStock(product_id=1, warehouse_id=2, stock=20, company_id=comp.id),
+            ProductStock(product_id=2, warehouse_id=2, stock=20, company_id=comp.id),
+        ])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _levels():
+    return {(ps.product_id, ps.warehouse_id): ps.stock for ps in ProductStock.query}
+
+
+def test_batch_is_all_or_nothing(ledger_app):
+    with app.app_context():
+        with pytest.raises(InsufficientStock) as exc:
+            apply_movements(1, 1, [StockLine(1, 1, 10, 'salida'), StockLine(2, 2, 50, 'salida')])
+        db.session.rollback()
+        assert exc.value.product_id == 2
+        assert _levels()[(1, 1)] == 100
+        assert InventoryMovement.query.count() == 0
+
+
+def test_adjust_and_entry_keep_product_total(ledger_app):
+    with app.app_context():
+        apply_movements(1, 1, [StockLine(1, 1, 40, 'ajuste'), StockLine(2, 2, 5, 'entrada')])
+        db.session.commit()
+        assert _levels()[(1, 1)] == 40
+        assert _levels()[(2, 2)] == 25
+        assert Product.query.get(1).stock == 60
+        assert Product.query.get(2).stock == 125
+        adj = InventoryMovement.query.filter_by(movement_type='ajuste').one()
+        assert adj.quantity == 60
+
+
+def test_concurrent_sales_never_oversell(ledger_app):
+    attempts_per_thread = 15
+    threads = 16
+    sold = []
+
+    def worker(n):
+        for i in range(attempts_per_thread):
+            lines = [StockLine(1, 1, 1, 'salida'), StockLine(2, 1 + (n + i) % 2, 1, 'salida')]
+            with app.app_context():
+                while True:
+                    try:
+                        apply_movements(1, 1, lines, reference_type='test')
+                        db.session.commit()
+                        sold.append(lines)
+                    except InsufficientStock:
+                        db.session.rollback()
+                    except OperationalError:  # database is locked: retry the row
+                        db.session.rollback()
+                        continue
+                    break
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    with app.app_context():
+        levels = _levels()
+        taken_p1 = len(sold)
+        assert levels[(1, 1)] == 100 - taken_p1 >= 0
+        assert levels[(2, 1)] >= 0 and levels[(2, 2)] >= 0
+        assert levels[(2, 1)] + levels[(2, 2)] == 120 - taken_p1
+        assert Product.query.get(1).stock == 120 - taken_p1
+        assert Product.query.get(2).stock == 120 - taken_p1
+        assert InventoryMovement.query.count() == 2 * taken_p1
+        # 240 attempts compete for 100 units of P1, so it must sell out
+        # unless P2's smaller warehouse ran out first.
+        assert levels[(1, 1)] == 0 or levels[(2, 2)] == 0 or levels[(2, 1)] == 0
+
+
+def test_costed_entries_maintain_weighted_average(ledger_app):
+    with app.app_context():
+        apply_movements(1, 1, [StockLine(1, 1, 100, 'entrada', unit_cost=10.0)])
+        db.session.commit()
+        ps = ProductStock.query.filter_by(product_id=1, warehouse_id=1).one()
+        assert ps.stock == 200 and ps.avg_cost == pytest.approx(10.0)  # 100 uncosted units
+        apply_movements(1, 1, [StockLine(1, 1, 50, 'salida'), StockLine(1, 1, 30, 'entrada')])
+        db.session.commit()
+        db.session.refresh(ps)
+        assert ps.stock == 180 and ps.avg_cost == pytest.approx(10.0)
+        apply_movements(1, 1, [StockLine(1, 1, 20, 'entrada', unit_cost=14.0),
+                               StockLine(2, 2, 10, 'entrada', unit_cost=3.0)])
+        db.session.commit()
+        db.session.refresh(ps)
+        assert ps.avg_cost == pytest.approx((180 * 10 + 20 * 14) / 200)
+        other = ProductStock.query.filter_by(product_id=2, warehouse_id=2).one()
+        assert other.avg_cost == pytest.approx(3.0)
+        move = InventoryMovement.query.filter_by(product_id=2).one()
+        assert move.unit_cost == 3.0
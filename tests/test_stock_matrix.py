@@ -0,0 +1,94 @@
+import os
+import sys
+import csv
+import pytest
+from io import StringIO
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User, Product, Warehouse, ProductStock, Client, Order, Invoice
+import stock_matrix
+from stock_matrix import invalidate_sales, warehouse_sales
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    invalidate_sales()
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        db.session.add(comp)
+        db.session.flush()
+        user = User(username='mgr', first_name='M', last_name='', role='manager', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        for code, name in (('P1', 'Arroz'), ('P2', 'Frijol'), ('P3', 'Sal')):
+            db.session.add(Product(code=code, name=name, unit='u', price=1, company_id=comp.id))
+        db.session.add_all([Warehouse(name='Centro', company_id=comp.id), Warehouse(name='Norte', company_id=comp.id)])
+        db.session.flush()
+        db.session.add_all([
+            ProductStock(product_id=1, warehouse_id=1, stock=10, company_id=comp.id),
+            ProductStock(product_id=1, warehouse_id=2, stock=4, company_id=comp.id),
+            ProductStock(product_id=2, warehouse_id=1, stock=6, company_id=comp.id),
+        ])
+        cli = Client(name='Ana', company_id=comp.id)
+        db.session.add(cli); db.session.flush()
+        order = Order(client_id=cli.id, subtotal=100, itbis=0, total=100, company_id=comp.id)
+        db.session.add(order); db.session.flush()
+        db.session.add(Invoice(client_id=cli.id, order_id=order.id, subtotal=100, itbis=0, total=100,
+                               invoice_type='Consumidor Final', warehouse_id=2, company_id=comp.id))
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_matrix_pages_and_filters(client):
+    data = client.get('/api/inventario/matriz?per_page=2').get_json()
+    assert [w['name'] for w in data['warehouses']] == ['Centro', 'Norte']
+    assert data['warehouses'][1]['sales_total'] == 100
+    assert [(r['code'], r['stock'], r['total']) for r in data['rows']] == [
+        ('P1', {'1': 10, '2': 4}, 14), ('P2', {'1': 6, '2': 0}, 6),
+    ]
+    assert data['has_next']
+    last = client.get('/api/inventario/matriz?per_page=2&page=2').get_json()
+    assert [r['total'] for r in last['rows']] == [0] and not last['has_next']
+    imbalanced = client.get('/api/inventario/matriz?imbalanced=1').get_json()
+    assert [r['code'] for r in imbalanced['rows']] == ['P2']
+    assert 'Frijol' in client.get('/inventario/matriz').get_data(as_text=True)
+
+
+def test_sales_cache_invalidated_on_invoice_commit(client):
+    with app.app_context():
+        assert warehouse_sales(1) == {2: 100.0}
+        inv = Invoice.query.first()
+        inv.total = 150
+        db.session.commit()
+        assert warehouse_sales(1) == {2: 150.0}
+
+
+def test_sales_cache_expires_for_other_workers(client, monkeypatch):
+    with app.app_context():
+        first = warehouse_sales(1)
+        # Another worker process invoiced; this one never saw the commit.
+        db.session.execute(db.text('UPDATE invoice SET total = 175'))
+        db.session.commit()
+        assert warehouse_sales(1) is first
+        monkeypatch.setattr(stock_matrix, 'TTL', 0)
+        assert warehouse_sales(1) == {2: 175.0}
+
+
+def test_matrix_export(client):
+    resp = client.get('/inventario/matriz/export')
+    rows = list(csv.reader(StringIO(resp.get_data(as_text=True))))
+    assert rows[0] == ['Código', 'Producto', 'Centro', 'Norte', 'Total']
+    assert rows[1] == ['P1', 'Arroz', '10', '4', '14']
+    assert len(rows) == 4
+    data = client.get('/inventario/matriz/export?formato=json').get_json()
+    assert len(data['rows']) == 3
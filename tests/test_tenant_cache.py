@@ -0,0 +1,74 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import CompanyInfo, User
+import tenant_cache
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.create_all()
+        company = CompanyInfo(name='Comp', street='s', sector='s', province='p', phone='1', rnc='1')
+        db.session.add(company)
+        db.session.flush()
+        u = User(username='mgr', first_name='Man', last_name='Ager', role='admin', company_id=company.id)
+        u.set_password('pass')
+        db.session.add(u)
+        db.session.commit()
+    with app.test_client() as client:
+        client.post('/login', data={'username': 'mgr', 'password': 'pass'})
+        yield client
+    with app.app_context():
+        db.drop_all()
+    if db_path.exists():
+        db_path.unlink()
+
+
+def test_snapshot_is_cached(client):
+    with app.app_context():
+        first = tenant_cache.get_company(1)
+        assert first.name == 'Comp'
+        # A raw UPDATE bypasses the ORM, so the cached snapshot is still served
+        db.session.execute(db.text("UPDATE company_info SET name = 'Raw' WHERE id = 1"))
+        db.session.commit()
+        assert tenant_cache.get_company(1) is first
+        tenant_cache.invalidate_company(1)
+        assert tenant_cache.get_company(1).name == 'Raw'
+
+
+def test_orm_commit_invalidates_snapshot(client):
+    with app.app_context():
+        assert tenant_cache.get_company(1).phone == '1'
+        company = CompanyInfo.query.get(1)
+        company.phone = '40'
+        db.session.commit()
+        assert tenant_cache.get_company(1).phone == '40'
+
+
+def test_snapshot_expires_for_other_workers(client, monkeypatch):
+    with app.app_context():
+        first = tenant_cache.get_company(1)
+        assert not hasattr(first, 'ncf_final')
+        # Another worker process changed the row; this one never saw the commit.
+        db.session.execute(db.text("UPDATE company_info SET name = 'Otro' WHERE id = 1"))
+        db.session.commit()
+        assert tenant_cache.get_company(1) is first
+        monkeypatch.setattr(tenant_cache, 'TTL', 0)
+        assert tenant_cache.get_company(1).name == 'Otro'
+
+
+def test_settings_update_refreshes_company(client):
+    client.get('/ajustes/empresa')
+    client.post('/ajustes/empresa', data={
+        'name': 'Nueva', 'rnc': '1', 'phone': '1', 'street': 's', 'sector': 's', 'province': 'p',
+        'ncf_final': '1', 'ncf_fiscal': '1'
+    })
+    with app.app_context():
+        assert tenant_cache.get_company(1).name == 'Nueva'
@@ -0,0 +1,110 @@
+import os
+import sys
+import pytest
+from io import BytesIO
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app import app, db
+from models import (
+    CompanyInfo, User, Product, Warehouse, ProductStock, InventoryMovement, StockTransfer,
+)
+
+
+@pytest.fixture
+def client(tmp_path):
+    db_path = tmp_path / "test.sqlite"
+    app.config.from_object('config.TestingConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    with app.app_context():
+        db.session.remove(); db.engine.dispose(); db.create_all()
+        comp = CompanyInfo(name='Comp', street='', sector='', province='', phone='', rnc='')
+        other = CompanyInfo(name='Other', street='', sector='', province='', phone='', rnc='')
+        db.session.add_all([comp, other])
+        db.session.flush()
+        user = User(username='user', first_name='U', last_name='One', role='company', company_id=comp.id)
+        user.set_password('pass')
+        db.session.add(user)
+        for n in range(1, 4):
+            db.session.add(Product(code=f'P{n}', name=f'Prod{n}', unit='u', price=1, stock=10,
+                                   company_id=comp.id))
+        db.session.add(Product(code='X1', name='Ajeno', unit='u', price=1, stock=10, company_id=other.id))
+        db.session.add_all([Warehouse(name='W1', company_id=comp.id), Warehouse(name='W2', company_id=comp.id),
+                            Warehouse(name='WX', company_id=other.id)])
+        db.session.flush()
+        for pid in (1, 2, 3):
+            db.session.add(ProductStock(product_id=pid, warehouse_id=1, stock=10, avg_cost=2.5 * pid,
+                                        company_id=comp.id))
+        db.session.commit()
+    with app.test_client() as c:
+        c.post('/login', data={'username': 'user', 'password': 'pass'})
+        yield c
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _levels():
+    return {(ps.product_id, ps.warehouse_id): ps.stock for ps in ProductStock.query}
+
+
+def test_api_transfer_document(client):
+    resp = client.post('/api/inventario/transferencias', json={
+        'origin_id': 1, 'dest_id': 2,
+        'items': [{'code': 'P1', 'quantity': 4}, {'product_id': 2, 'quantity': 10},
+                  {'code': 'P1', 'quantity': 1}],
+    })
+    assert resp.status_code == 201
+    doc = resp.get_json()
+    assert sorted((i['code'], i['quantity']) for i in doc['items']) == [('P1', 5), ('P2', 10)]
+    with app.app_context():
+        levels = _levels()
+        assert levels[(1, 1)] == 5 and levels[(1, 2)] == 5
+        assert levels[(2, 1)] == 0 and levels[(2, 2)] == 10
+        moves = InventoryMovement.query.filter_by(reference_type='transfer').all()
+        assert len(moves) == 4
+        assert {m.reference_id for m in moves} == {doc['id']}
+        dest = ProductStock.query.filter_by(product_id=2, warehouse_id=2).one()
+        assert dest.avg_cost == 5.0
+        assert Product.query.get(1).stock == 10
+    assert client.get(f"/api/inventario/transferencias/{doc['id']}").get_json()['id'] == doc['id']
+
+
+def test_api_transfer_rejects_whole_document(client):
+    resp = client.post('/api/inventario/transferencias', json={
+        'origin_id': 1, 'dest_id': 3,
+        'items': [{'code': 'P1', 'quantity': 1}, {'code': 'X1', 'quantity': 1}, {'code': 'P2', 'quantity': 0}],
+    })
+    assert resp.status_code == 400
+    assert len(resp.get_json()['errors']) == 3
+    resp = client.post('/api/inventario/transferencias', json={
+        'origin_id': 1, 'dest_id': 2,
+        'items': [{'code': 'P1', 'quantity': 1}, {'code': 'P2', 'quantity': 11}],
+    })
+    assert resp.status_code == 400
+    assert 'Prod2' in resp.get_json()['errors'][0]['error']
+    with app.app_context():
+        assert StockTransfer.query.count() == 0
+        assert InventoryMovement.query.count() == 0
+        assert _levels()[(1, 1)] == 10
+
+
+def test_csv_transfer_upload(client):
+    data = {
+        'origin_id': '1', 'dest_id': '2', 'note': 'Rebalanceo',
+        'file': (BytesIO(b'code,quantity\nP1,2\nP3,7\n'), 'lineas.csv'),
+    }
+    resp = client.post('/inventario/transferir', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 302
+    with app.app_context():
+        transfer = StockTransfer.query.one()
+        assert transfer.note == 'Rebalanceo'
+        assert len(transfer.items) == 2
+        assert _levels()[(3, 2)] == 7
+    data['file'] = (BytesIO(b'code,quantity\nP1,2\nP9,1\nP2,x\n'), 'lineas.csv')
+    resp = client.post('/inventario/transferir', data=data, content_type='multipart/form-data')
+    assert 'Línea 3: Producto P9 no encontrado' in resp.get_data(as_text=True)
+    assert 'Línea 4: Cantidad inválida' in resp.get_data(as_text=True)
+    data['file'] = (BytesIO(b'code,quantity\nP1,2\nP9,1\n'), 'lineas.csv')
+    resp = client.post('/inventario/transferir', data=data, content_type='multipart/form-data',
+                       follow_redirects=True)
+    assert 'Línea 3: Producto P9 no encontrado' in resp.get_data(as_text=True)
@@ -0,0 +1,144 @@
+"""Multi-line stock transfer documents.
+
+``create_transfer`` validates every line of a transfer with a couple of
+set-based lookups, stores the ``StockTransfer`` document and applies all
+lines through :func:`stock_ledger.apply_movements` in the caller's
+transaction.  Each line becomes a ``salida`` from the origin and an
+``entrada`` into the destination, both with ``reference_type='transfer'``
+and the document id as ``reference_id``.  Stock arrives at the destination
+at the origin's weighted-average cost.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+
+from sqlalchemy import insert
+
+from models import db, Product, ProductStock, StockTransfer, StockTransferItem, Warehouse
+from stock_ledger import StockError, StockLine, apply_movements
+
+
+class TransferError(StockError):
+    """Raised with the list of ``(line, message)`` validation errors."""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} líneas con errores')
+        self.errors = errors
+
+
+def transfer_items(reader, start=2):
+    """Turn CSV rows with ``code`` and ``quantity`` into transfer items."""
+    for line, row in enumerate(reader, start=start):
+        yield {
+            'line': line,
+            'code': (row.get('code') or '').strip(),
+            'quantity': (row.get('quantity') or '').strip(),
+        }
+
+
+def _resolve(company_id, items):
+    """Return ``({product_id: quantity}, errors)`` for raw item dicts."""
+    items = list(items)
+    ids = {item.get('product_id') for item in items} - {None, ''}
+    codes = {item.get('code') for item in items} - {None, ''}
+    by_id = set()
+    by_code = {}
+    if ids or codes:
+        query = db.session.query(Product.id, Product.code).filter(Product.company_id == company_id)
+        for pid, code in query.filter(db.or_(Product.id.in_(ids), Product.code.in_(codes))):
+            by_id.add(pid)
+            by_code[code] = pid
+
+    totals = OrderedDict()
+    errors = []
+    for n, item in enumerate(items, start=1):
+        line = item.get('line', n)
+        pid = item.get('product_id')
+        if pid not in (None, ''):
+            try:
+                pid = int(pid)
+            except (TypeError, ValueError):
+                pid = None
+            if pid not in by_id:
+                errors.append((line, f"Producto {item.get('product_id')} no encontrado"))
+                continue
+        else:
+            pid = by_code.get(item.get('code'))
+            if pid is None:
+                errors.append((line, f"Producto {item.get('code') or '(sin código)'} no encontrado"))
+                continue
+        try:
+            qty = int(item.get('quantity'))
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            errors.append((line, 'Cantidad inválida'))
+            continue
+        totals[pid] = totals.get(pid, 0) + qty
+    if not items:
+        errors.append((0, 'La transferencia no tiene líneas'))
+    return totals, errors
+
+
+def create_transfer(company_id, user_id, origin_id, dest_id, items, note=None):
+    """Validate and apply a transfer document; return the ``StockTransfer``.
+
+    ``items`` are dicts with ``product_id`` or ``code`` and ``quantity``
+    (plus an optional ``line`` used in error messages).  Raises
+    :class:`TransferError` when any line is invalid and
+    :class:`stock_ledger.InsufficientStock` when the origin lacks stock;
+    nothing is written in either case once the caller rolls back.
+    Committing is left to the caller.
+    """
+    errors = []
+    if origin_id == dest_id:
+        errors.append((0, 'Seleccione almacenes distintos'))
+    found = {
+        wid for (wid,) in db.session.query(Warehouse.id).filter(
+            Warehouse.company_id == company_id, Warehouse.id.in_([origin_id, dest_id])
+        )
+    }
+    if origin_id not in found or dest_id not in found:
+        errors.append((0, 'Almacén no encontrado'))
+    totals, item_errors = _resolve(company_id, items)
+    errors.extend(item_errors)
+    if errors:
+        raise TransferError(errors)
+
+    transfer = StockTransfer(
+        origin_id=origin_id, dest_id=dest_id, note=note,
+        created_by=user_id, company_id=company_id,
+    )
+    db.session.add(transfer)
+    db.session.flush()
+    db.session.execute(insert(StockTransferItem), [
+        {'transfer_id': transfer.id, 'product_id': pid, 'quantity': qty, 'company_id': company_id}
+        for pid, qty in totals.items()
+    ])
+    costs = dict(
+        db.session.query(ProductStock.product_id, ProductStock.avg_cost).filter(
+            ProductStock.warehouse_id == origin_id, ProductStock.product_id.in_(list(totals))
+        )
+    )
+    lines = []
+    for pid, qty in totals.items():
+        cost = costs.get(pid) or None
+        lines.append(StockLine(pid, origin_id, qty, 'salida', unit_cost=cost))
+        lines.append(StockLine(pid, dest_id, qty, 'entrada', unit_cost=cost))
+    apply_movements(company_id, user_id, lines, reference_type='transfer', reference_id=transfer.id)
+    return transfer
+
+
+def transfer_to_dict(transfer):
+    return {
+        'id': transfer.id,
+        'origin_id': transfer.origin_id,
+        'dest_id': transfer.dest_id,
+        'note': transfer.note,
+        'created_at': transfer.created_at.isoformat() if transfer.created_at else None,
+        'items': [
+            {'product_id': i.product_id, 'code': i.product.code, 'name': i.product.name,
+             'quantity': i.quantity}
+            for i in transfer.items
+        ],
+    }
@@ -3,9 +3,13 @@ from __future__ import annotations
 
 from datetime import datetime
 from pathlib import Path
+import logging
 import os
 
-from flask import current_app
+from flask import current_app, has_app_context
+
+from metrics import timed
+
 try:
     from weasyprint import HTML
 except ModuleNotFoundError:  # pragma: no cover
@@ -34,6 +38,10 @@ body {{ font-family: Helvetica, Arial, sans-serif; margin:0; }}
 .footer {{ position:absolute; bottom:80px; left:20px; font-size:12px; }}
 """
 
+def _logger():
+    # PDFs are also rendered in worker processes without an app context.
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
 def _fmt_money(value: float) -> str:
     return f"RD$ {value:,.2f}"
 
@@ -174,15 +182,16 @@ def generate_pdf(title: str, company: dict, client: dict, items: list,
     html = build_html(title, company, client_dict, item_dicts, subtotal,
                       discount_total, itbis, total, meta)
     output_path = Path(output_path or 'document.pdf')
-    current_app.logger.info("Rendering %s PDF to %s", title, output_path)
-    if HTML is None:
-        current_app.logger.warning("WeasyPrint is not installed; generating placeholder PDF")
-        with open(output_path, 'wb') as f:
-            f.write(b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF")
-    else:
-        try:
-            HTML(string=html, base_url='.').write_pdf(output_path)
-        except Exception as exc:  # pragma: no cover
-            current_app.logger.exception("PDF generation failed: %s", exc)
-            raise
+    _logger().info("Rendering %s PDF to %s", title, output_path)
+    with timed('tiendix_pdf_render_seconds', document=title):
+        if HTML is None:
+            _logger().warning("WeasyPrint is not installed; generating placeholder PDF")
+            with open(output_path, 'wb') as f:
+                f.write(b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF")
+        else:
+            try:
+                HTML(string=html, base_url='.').write_pdf(output_path)
+            except Exception as exc:  # pragma: no cover
+                _logger().exception("PDF generation failed: %s", exc)
+                raise
     return str(output_path)